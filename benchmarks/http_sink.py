@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal local HTTP server accepting the webhook POSTs (keep-alive, gzipped or plain
+JSON bodies), used to test and benchmark the webhook handlers without a real service.
+The first `fail` requests are answered with 503 (to exercise the retries).
+"""
+import gzip, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ============================================================= #
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+
+    # keep-alive connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        sink = self.server.sink
+        if sink.take_failure():
+            self._reply(503, b'unavailable')
+            return
+        gzipped = self.headers.get('Content-Encoding', '') == 'gzip'
+        try:
+            payload = json.loads(gzip.decompress(body) if gzipped else body)
+        except ValueError:
+            self._reply(400, b'bad json')
+            return
+        sink.record(self.client_address, len(body), gzipped, payload.get('events', []))
+        self._reply(200, b'ok')
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# ============================================================= #
+
+class HTTPSink:
+    """Counts the received requests and events (with the event arrival times and the client connections)."""
+
+    def __init__(self, host='127.0.0.1', port=0, fail=0):
+        self._server = _Server((host, port), _WebhookRequestHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address[:2]
+        self.url = f'http://{self.host}:{self.port}/events'
+        self.fail = fail
+        self._lock = threading.Lock()
+        self.events = []
+        self.times = []
+        self.requests = 0
+        self.gzipped = 0
+        self.bytes = 0
+        self.connections = set()
+        self._thread = None
+
+    def take_failure(self):
+        with self._lock:
+            if self.fail <= 0:
+                return False
+            self.fail -= 1
+            return True
+
+    def record(self, client, size, gzipped, events):
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.gzipped += int(gzipped)
+            self.bytes += size
+            self.connections.add(client)
+            self.events.extend(events)
+            self.times.extend([now] * len(events))
+
+    @property
+    def count(self):
+        return len(self.events)
+
+    def rate(self):
+        """Events per second between the first and the last event."""
+        with self._lock:
+            if len(self.times) < 2:
+                return 0.0
+            return (len(self.times) - 1) / max(1e-9, self.times[-1] - self.times[0])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='http-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
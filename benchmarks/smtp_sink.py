@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal local SMTP server accepting and discarding all mail (no TLS, no auth),
+used to benchmark the email handlers without a real mail server.
+"""
+import time, threading, socketserver
+
+# ============================================================= #
+
+class _SMTPSession(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost SMTP sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line[:4].upper()
+            if cmd == b'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif cmd == b'HELO':
+                self.reply('250 localhost')
+            elif cmd in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply('250 OK')
+            elif cmd == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    size += len(data)
+                self.server.sink.record(size)
+                self.reply('250 OK')
+            elif cmd == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# ============================================================= #
+
+class SMTPSink:
+    """Counts the received messages (with their arrival times and sizes)."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = _Server((host, port), _SMTPSession)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self._lock = threading.Lock()
+        self.times = []
+        self.bytes = 0
+        self._thread = None
+
+    def record(self, size):
+        with self._lock:
+            self.times.append(time.monotonic())
+            self.bytes += size
+
+    @property
+    def count(self):
+        return len(self.times)
+
+    def rate(self):
+        """Messages per second between the first and the last message."""
+        with self._lock:
+            if len(self.times) < 2:
+                return 0.0
+            return (len(self.times) - 1) / max(1e-9, self.times[-1] - self.times[0])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
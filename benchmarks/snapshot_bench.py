@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Memory / throughput comparison of watchdog's DirectorySnapshot (used by the
+stock PollingObserver) and snapshot.CompactSnapshot on a generated tree.
+
+Usage: python benchmarks/snapshot_bench.py [--files N] [--per-dir N] [--dir PATH]
+"""
+import os, sys, time, json, shutil, tempfile, tracemalloc, gc, argparse
+
+from treegen import generate_tree
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ============================================================= #
+
+def modify_tree(root, every=100):
+    """Touches every `every`-th file and renames as many others; returns number of changes."""
+    n = 0
+    for i, (dirpath, _, filenames) in enumerate(os.walk(root)):
+        for j, name in enumerate(filenames):
+            if (i + j) % every == 0:
+                with open(os.path.join(dirpath, name), 'ab') as f:
+                    f.write(b'x')
+                n += 1
+            elif (i + j) % every == 1:
+                os.rename(os.path.join(dirpath, name), os.path.join(dirpath, name + '.ren'))
+                n += 1
+    return n
+
+def measure(take, root):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    ref = take(root)
+    take_time = time.perf_counter() - t0
+    gc.collect()
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return ref, {'take_sec': round(take_time, 3), 'memory_mb': round(mem / 2**20, 2)}
+
+def bench(root, changes):
+    from watchdog.utils.dirsnapshot import DirectorySnapshot, DirectorySnapshotDiff
+    from snapshot import CompactSnapshot, SnapshotDiff
+
+    impls = {'watchdog': (DirectorySnapshot, DirectorySnapshotDiff),
+             'compact': (CompactSnapshot.take, SnapshotDiff)}
+    refs = {}
+    results = {}
+    for name, (take, diff) in impls.items():
+        refs[name], results[name] = measure(take, root)
+
+    results['changes'] = modify_tree(root) if changes else 0
+
+    for name, (take, diff) in impls.items():
+        snap = take(root)
+        t0 = time.perf_counter()
+        d = diff(refs[name], snap)
+        results[name]['diff_sec'] = round(time.perf_counter() - t0, 3)
+        results[name]['diff_events'] = sum(len(getattr(d, a)) for a in ('files_created', 'files_deleted', 'files_modified', 'files_moved'))
+        refs[name] = snap = None
+        gc.collect()
+    return results
+
+# ============================================================= #
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare snapshot implementations')
+    parser.add_argument('--files', type=int, default=100000, help='number of files to generate')
+    parser.add_argument('--per-dir', type=int, default=100, help='files per directory')
+    parser.add_argument('--dir', default=None, help='existing directory to scan (no tree is generated)')
+    parser.add_argument('--no-changes', action='store_true', help='diff unchanged trees only')
+    args = parser.parse_args()
+
+    # globals.py reads the config path from the command line
+    sys.argv[1:] = []
+    sys.path.insert(0, ROOT)
+
+    tmp = None
+    root = args.dir
+    if not root:
+        tmp = root = tempfile.mkdtemp(prefix='watcher_bench_')
+        t0 = time.perf_counter()
+        generate_tree(root, args.files, args.per_dir)
+        print(f'Generated {args.files} files in {time.perf_counter() - t0:.1f} sec', file=sys.stderr)
+    try:
+        results = bench(root, not args.no_changes and not args.dir)
+        results['files'] = args.files if tmp else None
+        print(json.dumps(results, indent=2))
+    finally:
+        if tmp: shutil.rmtree(tmp, ignore_errors=True)
+
+# ============================================================= #
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic directory trees and scripted change workloads for the benchmarks.
+
+Every workload applies its changes to a generated tree and returns a list of
+(key, timestamp) tuples: `key` is the path (relative to the root, with a leading
+separator, as reported by the watcher) the change is expected to be reported for,
+`timestamp` is the time.monotonic() time the change was made.
+"""
+import os, time, random
+
+# ============================================================= #
+
+def dir_path(d, fanout=10):
+    """Relative path of the `d`-th generated directory."""
+    parts = []
+    while True:
+        parts.append(f'd{d % fanout}')
+        d //= fanout
+        if not d: break
+    return os.path.join(*parts)
+
+def generate_tree(root, files, per_dir=100, fanout=10):
+    """
+    Creates `files` empty files, `per_dir` files in each directory, directories nested `fanout`-wise.
+    Returns the list of relative paths of the directories holding the files.
+    """
+    dirs = []
+    n = 0
+    d = 0
+    while n < files:
+        rel = dir_path(d, fanout)
+        path = os.path.join(root, rel)
+        os.makedirs(path, exist_ok=True)
+        for i in range(min(per_dir, files - n)):
+            open(os.path.join(path, f'file_{i:05d}.dat'), 'wb').close()
+        dirs.append(rel)
+        n += per_dir
+        d += 1
+    return dirs
+
+def _key(rel):
+    return os.sep + rel
+
+def _files(root, dirs, n, rnd):
+    # picks up to `n` distinct existing files from random directories
+    picked = {}
+    for _ in range(n * 10):
+        if len(picked) >= n: break
+        rel = rnd.choice(dirs)
+        names = [f for f in os.listdir(os.path.join(root, rel)) if f.endswith('.dat')]
+        if names:
+            picked[os.path.join(rel, rnd.choice(names))] = None
+    return list(picked)
+
+# ============================================================= #
+
+def burst(root, dirs, n, rnd=random):
+    """Creates `n` new files across random directories as fast as possible."""
+    changes = []
+    for i in range(n):
+        rel = os.path.join(rnd.choice(dirs), f'burst_{i:07d}.new')
+        with open(os.path.join(root, rel), 'wb') as f:
+            f.write(b'x' * 64)
+        changes.append((_key(rel), time.monotonic()))
+    return changes
+
+def modify(root, dirs, n, rnd=random):
+    """Appends to `n` existing files."""
+    changes = []
+    for rel in _files(root, dirs, n, rnd):
+        with open(os.path.join(root, rel), 'ab') as f:
+            f.write(b'y' * 64)
+        changes.append((_key(rel), time.monotonic()))
+    return changes
+
+def rename(root, dirs, n, rnd=random):
+    """Renames `n` existing files within their directories."""
+    changes = []
+    for rel in _files(root, dirs, n, rnd):
+        dest = rel[:-4] + '.ren'
+        os.rename(os.path.join(root, rel), os.path.join(root, dest))
+        changes.append((_key(dest), time.monotonic()))
+    return changes
+
+def deep_move(root, dirs, n, rnd=random):
+    """Moves `n` existing files from the deepest directories into directories of other branches."""
+    changes = []
+    depth = max(rel.count(os.sep) for rel in dirs)
+    deep = [rel for rel in dirs if rel.count(os.sep) == depth] or dirs
+    for i, rel in enumerate(_files(root, deep, n, rnd)):
+        src_dir = os.path.dirname(rel)
+        targets = [d for d in dirs if d.split(os.sep)[0] != src_dir.split(os.sep)[0]] or dirs
+        dest = os.path.join(rnd.choice(targets), f'moved_{i:07d}.dat')
+        os.rename(os.path.join(root, rel), os.path.join(root, dest))
+        changes.append((_key(dest), time.monotonic()))
+    return changes
+
+WORKLOADS = {'burst': burst, 'modify': modify, 'rename': rename, 'deep_move': deep_move}
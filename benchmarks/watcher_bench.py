@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the watcher: generates a tree, runs the real Watcher /
+DirWatcher / email handler stack against a local SMTP sink (smtp_sink.py), or the
+webhook handler against a local HTTP sink (http_sink.py), and applies scripted
+change workloads (treegen.py) to the watched tree.
+
+Prints JSON results per backend: scan time per poll, event-to-handler latency
+percentiles per workload, emails (webhook events) per second and peak RSS.
+Each backend is benchmarked in a separate process.
+
+Usage: python benchmarks/watcher_bench.py [--files N] [--backends polling,inotify]
+                                          [--workloads burst,modify,rename,deep_move] [--ops N] [--journal]
+                                          [--handler email|webhook]
+"""
+import os, sys, time, json, random, shutil, tempfile, threading, argparse, subprocess
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from treegen import generate_tree, WORKLOADS
+from smtp_sink import SMTPSink
+from http_sink import HTTPSink
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ============================================================= #
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {f'p{p}': round(values[min(len(values) - 1, int(len(values) * p / 100))], 2) for p in points}
+    result['max'] = round(values[-1], 2)
+    result['avg'] = round(sum(values) / len(values), 2)
+    return result
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+def write_config(tmp, root, backend, sink, args):
+    cfg = {
+        'poll_interval': args.poll_interval,
+        'scan_workers': args.scan_workers,
+        'backend': backend,
+        'snapshots': {'dir': None},
+        'journal': {'file': os.path.join(tmp, 'journal.db') if args.journal else None},
+        'watchers': [{
+            'path': root,
+            'recursive': True,
+            'types': ['*'],
+            'backend': backend,
+            'handlers': [handler_config(sink, args)],
+        }],
+        'logging': {'log': True, 'file': os.path.join(tmp, 'watcher.log'), 'verbose': False, 'async': True},
+    }
+    path = os.path.join(tmp, 'config.yaml')
+    with open(path, 'w', encoding='utf-8') as f:
+        # JSON is valid YAML
+        json.dump(cfg, f, indent=2)
+    return path
+
+def handler_config(sink, args):
+    handler = {
+        'active': True,
+        'type': args.handler,
+        'events': ['cre', 'del', 'mod', 'mov'],
+        'emit': {'interval': 0, 'unit': 's'},
+        'dispatch': {'queue': 1000000, 'workers': args.senders, 'overflow': 'block'},
+    }
+    if args.handler == 'webhook':
+        handler.update({'url': sink.url, 'batch': {'size': args.batch, 'wait': 200}})
+    else:
+        handler.update({'from': 'bench@localhost', 'to': ['sink@localhost'], 'subject': 'WATCHER BENCHMARK - {path}',
+                        'smtp': {'server': sink.host, 'port': sink.port, 'protocol': 'PLAIN', 'login': '', 'password': ''}})
+    return handler
+
+def wait_for(condition, timeout, step=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(step)
+    return condition()
+
+# ============================================================= #
+
+def run(backend, args):
+    """Benchmarks a single backend in this process."""
+    tmp = tempfile.mkdtemp(prefix='watcher_bench_')
+    root = os.path.join(tmp, 'tree')
+    sink = (HTTPSink() if args.handler == 'webhook' else SMTPSink()).start()
+    results = {'backend': backend, 'files': args.files}
+    try:
+        t0 = time.perf_counter()
+        dirs = generate_tree(root, args.files, args.per_dir)
+        results['generate_sec'] = round(time.perf_counter() - t0, 2)
+
+        # globals.py reads the config path from the command line
+        sys.argv[1:] = [write_config(tmp, root, backend, sink, args)]
+        sys.path.insert(0, ROOT)
+        import watcher as watcher_
+
+        w = watcher_.Watcher()
+        dw = w.watchers[0]
+
+        # first time each path is handed to the handlers
+        seen = {}
+        triggered = [0]
+        trigger_all = dw.trigger_all
+
+        def timed_trigger_all(event, message, src_path, dest_path):
+            seen.setdefault(dest_path or src_path, time.monotonic())
+            triggered[0] += 1
+            trigger_all(event, message, src_path, dest_path)
+
+        dw.trigger_all = timed_trigger_all
+
+        thread = threading.Thread(target=w.run, name='watcher', daemon=True)
+        t0 = time.perf_counter()
+        thread.start()
+        wait_for(lambda: dw.observer is not None and w.scheduler is not None, 600)
+        results['active_backend'] = dw.active_backend
+        results['start_sec'] = round(time.perf_counter() - t0, 2)
+
+        # time the scans of the polling emitters
+        scans = []
+        for emitter in list(getattr(dw.observer, 'emitters', [])):
+            take = getattr(emitter, '_take_snapshot', None)
+            if take is None: continue
+
+            def timed_take(take=take):
+                t = time.perf_counter()
+                snap = take()
+                scans.append(time.perf_counter() - t)
+                return snap
+
+            emitter._take_snapshot = timed_take
+
+        # let the initial snapshot / inotify watches settle
+        time.sleep(args.poll_interval * 2 if dw.active_backend == 'polling' else 1)
+        rnd = random.Random(args.seed)
+        results['workloads'] = {}
+        for name in args.workloads:
+            changes = WORKLOADS[name](root, dirs, args.ops, rnd)
+            wait_for(lambda: all(k in seen for k, _ in changes), args.timeout)
+            latencies = [(seen[k] - t) * 1000 for k, t in changes if k in seen]
+            results['workloads'][name] = {'changes': len(changes), 'reported': len(latencies),
+                                          'latency_ms': percentiles(latencies)}
+            time.sleep(args.poll_interval)
+
+        # every handled event is sent as one email / webhook event record
+        wait_for(lambda: sink.count >= triggered[0], args.timeout)
+        results['emails' if args.handler == 'email' else 'webhook'] = {'handled': triggered[0], 'sent': sink.count, 'per_sec': round(sink.rate(), 1)}
+        if args.handler == 'webhook':
+            results['webhook'].update({'requests': sink.requests, 'gzipped': sink.gzipped, 'connections': len(sink.connections)})
+        results['scan_ms'] = percentiles([s * 1000 for s in scans])
+        if results['scan_ms']:
+            results['scan_ms']['polls'] = len(scans)
+
+        wait_for(lambda: w.scheduler is not None, 1)
+        w.scheduler.stop()
+        thread.join(60)
+        results['peak_rss_mb'] = peak_rss_mb()
+    finally:
+        sink.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+# ============================================================= #
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end watcher benchmark')
+    parser.add_argument('--files', type=int, default=10000, help='number of files to generate')
+    parser.add_argument('--per-dir', type=int, default=100, help='files per directory')
+    parser.add_argument('--backends', default='polling,inotify', help='comma-separated observer backends to compare')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help='comma-separated workloads to apply in order')
+    parser.add_argument('--ops', type=int, default=1000, help='number of changes per workload')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='polling interval (seconds)')
+    parser.add_argument('--scan-workers', type=int, default=4, help='number of scanning threads')
+    parser.add_argument('--handler', choices=('email', 'webhook'), default='email', help='handler type to benchmark')
+    parser.add_argument('--senders', type=int, default=2, help='number of email dispatch workers')
+    parser.add_argument('--batch', type=int, default=100, help='max events per webhook request')
+    parser.add_argument('--journal', action='store_true', help='record the events in the event journal')
+    parser.add_argument('--timeout', type=float, default=120, help='max seconds to wait for the events of a workload')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the workloads')
+    parser.add_argument('--out', default=None, help='write the results to this JSON file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.workloads = [w for w in args.workloads.split(',') if w]
+    for w in args.workloads:
+        if not w in WORKLOADS:
+            parser.error(f'unknown workload: {w}')
+    backends = [b for b in args.backends.split(',') if b]
+
+    if args.child:
+        print(json.dumps(run(backends[0], args)))
+        return
+
+    results = {}
+    for backend in backends:
+        # same options, a single backend, no output file
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', '--backends', backend]
+        i = 1
+        while i < len(sys.argv):
+            a = sys.argv[i]
+            if a in ('--backends', '--out'):
+                i += 2
+                continue
+            if not a.startswith('--backends=') and not a.startswith('--out='):
+                cmd.append(a)
+            i += 1
+        print(f'Running {backend} benchmark ...', file=sys.stderr)
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+        if proc.returncode:
+            results[backend] = {'error': f'exit code {proc.returncode}'}
+            continue
+        results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+# ============================================================= #
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os, time, threading
+from collections import OrderedDict
+from watchdog.events import (EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED,
+                             DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent,
+                             FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent)
+
+import utils
+
+# ============================================================= #
+
+# pending events are released at the latest after this many windows, even if the path stays busy
+MAX_DELAY_WINDOWS = 5
+# number of recently seen path inodes remembered to pair deletions with creations
+INODE_CACHE_SIZE = 10000
+
+EVENT_CLASSES = {(EVENT_TYPE_CREATED, False): FileCreatedEvent, (EVENT_TYPE_CREATED, True): DirCreatedEvent,
+                 (EVENT_TYPE_DELETED, False): FileDeletedEvent, (EVENT_TYPE_DELETED, True): DirDeletedEvent,
+                 (EVENT_TYPE_MODIFIED, False): FileModifiedEvent, (EVENT_TYPE_MODIFIED, True): DirModifiedEvent,
+                 (EVENT_TYPE_MOVED, False): FileMovedEvent, (EVENT_TYPE_MOVED, True): DirMovedEvent}
+
+# ============================================================= #
+
+class PendingEvent:
+
+    __slots__ = ('event_type', 'is_directory', 'src_path', 'inode', 'modified', 'first', 'last')
+
+    def __init__(self, event_type, is_directory, src_path='', inode=None, modified=False):
+        self.event_type = event_type
+        self.is_directory = is_directory
+        # source path of a pending move
+        self.src_path = src_path
+        self.inode = inode
+        # a pending move of a path modified before or after it was moved
+        self.modified = modified
+        self.first = self.last = time.monotonic()
+
+    def to_events(self, path):
+        cls_ = EVENT_CLASSES[(self.event_type, self.is_directory)]
+        if self.event_type != EVENT_TYPE_MOVED:
+            return [cls_(path)]
+        events = [cls_(self.src_path, path)]
+        if self.modified:
+            # the modification is reported at the destination
+            events.append(EVENT_CLASSES[(EVENT_TYPE_MODIFIED, self.is_directory)](path))
+        return events
+
+# ============================================================= #
+
+class EventCoalescer:
+    """
+    Merges raw events per path over a time window and passes on one net event per path:
+    repeated 'modified' events are merged, created -> modified becomes 'created',
+    created -> deleted cancels out, deleted -> created becomes 'modified' (file replaced)
+    and a deleted path plus a created path with the same inode become 'moved'
+    (deleted paths have no inode left to stat: only the paths whose inode was recorded
+    by an earlier event, see INODE_CACHE_SIZE, can be paired this way).
+    A path modified and moved (in any order) within the window is reported as moved,
+    then modified at its destination.
+
+    A path's net event is released to `callback` once the path has been quiet for `window`
+    seconds (or after MAX_DELAY_WINDOWS windows at most).
+    """
+
+    def __init__(self, callback, window=1.0, watched_path=''):
+        self.callback = callback
+        self.window = window
+        self.watched_path = watched_path
+        self._pending = {}
+        self._inodes = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._stopped = False
+        self._idle = True
+
+    def start(self):
+        if self._thread: return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='coalescer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush(True)
+
+    @staticmethod
+    def _inode(path):
+        try:
+            return os.lstat(path).st_ino
+        except OSError:
+            return None
+
+    def push(self, event):
+        etype = event.event_type
+        if not (etype, event.is_directory) in EVENT_CLASSES:
+            return
+        src = event.src_path
+        # stat outside of the lock
+        inode = self._inode(event.dest_path if etype == EVENT_TYPE_MOVED else src) if etype != EVENT_TYPE_DELETED else None
+        with self._lock:
+            pending = self._pending
+            prev = pending.get(src)
+            if etype == EVENT_TYPE_MODIFIED:
+                if prev is None:
+                    pending[src] = PendingEvent(etype, event.is_directory, inode=inode)
+                elif prev.event_type == EVENT_TYPE_DELETED:
+                    # should not normally happen: treat as replaced
+                    prev.event_type = EVENT_TYPE_MODIFIED
+                    prev.inode = inode
+                else:
+                    # created / moved / modified absorb the modification
+                    prev.inode = inode or prev.inode
+                    if prev.event_type == EVENT_TYPE_MOVED:
+                        prev.modified = True
+                self._touch(src)
+
+            elif etype == EVENT_TYPE_CREATED:
+                if prev is None:
+                    pending[src] = PendingEvent(etype, event.is_directory, inode=inode)
+                elif prev.event_type == EVENT_TYPE_DELETED:
+                    # deleted and created again: replaced
+                    pending[src] = PendingEvent(EVENT_TYPE_MODIFIED, event.is_directory, inode=inode)
+                    pending[src].first = prev.first
+                self._touch(src)
+
+            elif etype == EVENT_TYPE_DELETED:
+                if prev is None:
+                    pending[src] = PendingEvent(etype, event.is_directory, inode=self._inodes.pop(src, None))
+                elif prev.event_type == EVENT_TYPE_CREATED:
+                    # created and deleted within the window: nothing happened
+                    del pending[src]
+                    return
+                elif prev.event_type == EVENT_TYPE_MOVED:
+                    # moved, then deleted: the original path is deleted
+                    del pending[src]
+                    pending[prev.src_path] = PendingEvent(etype, event.is_directory, inode=prev.inode)
+                    return
+                else:
+                    first = prev.first
+                    pending[src] = PendingEvent(etype, event.is_directory, inode=prev.inode)
+                    pending[src].first = first
+                self._touch(src)
+
+            elif etype == EVENT_TYPE_MOVED:
+                dest = event.dest_path
+                pending.pop(src, None)
+                if prev is not None and prev.event_type == EVENT_TYPE_CREATED:
+                    # created, then moved: created at the destination
+                    item = PendingEvent(EVENT_TYPE_CREATED, event.is_directory, inode=inode)
+                else:
+                    moved = prev is not None and prev.event_type == EVENT_TYPE_MOVED
+                    origin = prev.src_path if moved else src
+                    # a pending modification is kept (reported at the destination)
+                    modified = prev is not None and (prev.event_type == EVENT_TYPE_MODIFIED or prev.modified)
+                    if origin != dest:
+                        item = PendingEvent(EVENT_TYPE_MOVED, event.is_directory, origin, inode, modified)
+                    elif modified:
+                        # moved back to where it was, modified meanwhile
+                        item = PendingEvent(EVENT_TYPE_MODIFIED, event.is_directory, inode=inode)
+                    else:
+                        # moved back to where it was
+                        return
+                pending.pop(dest, None)
+                pending[dest] = item
+                self._touch(dest)
+
+    def _touch(self, path):
+        item = self._pending[path]
+        item.last = time.monotonic()
+        if not item.inode is None and item.event_type != EVENT_TYPE_DELETED:
+            self._inodes[path] = item.inode
+            self._inodes.move_to_end(path)
+            if len(self._inodes) > INODE_CACHE_SIZE:
+                self._inodes.popitem(last=False)
+        # new events only have later deadlines: wake up the flushing thread only if it is idle
+        if self._idle:
+            self._idle = False
+            self._wakeup.notify()
+
+    def flush(self, force=False):
+        """Releases all due net events (all pending events if `force` is True)."""
+        now = time.monotonic()
+        with self._lock:
+            due = [p for p, item in self._pending.items()
+                   if force or now - item.last >= self.window or now - item.first >= self.window * MAX_DELAY_WINDOWS]
+            if not due:
+                return
+            events = []
+            creates = {item.inode: p for p, item in self._pending.items()
+                       if item.event_type == EVENT_TYPE_CREATED and not item.inode is None}
+            for path in due:
+                item = self._pending.pop(path, None)
+                if item is None:
+                    continue
+                if item.event_type == EVENT_TYPE_DELETED and item.inode in creates:
+                    # deleted + created with the same inode: moved
+                    dest = creates.pop(item.inode)
+                    created = self._pending.pop(dest, None)
+                    if created is not None:
+                        events.extend(PendingEvent(EVENT_TYPE_MOVED, item.is_directory, path).to_events(dest))
+                        continue
+                if item.event_type == EVENT_TYPE_CREATED and item.inode in creates:
+                    creates.pop(item.inode)
+                events.extend(item.to_events(path))
+        for event in events:
+            try:
+                self.callback(event)
+            except Exception as err:
+                utils.log(err, how='exception', watched_path=self.watched_path)
+
+    def _next_deadline(self):
+        if not self._pending:
+            return None
+        return min(min(item.last + self.window, item.first + self.window * MAX_DELAY_WINDOWS)
+                   for item in self._pending.values())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                deadline = self._next_deadline()
+                self._idle = deadline is None
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if timeout is None or timeout > 0:
+                    self._wakeup.wait(timeout)
+                if self._stopped:
+                    return
+            self.flush()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import os, csv, time, shutil, datetime, threading
+from collections import Counter
+
+import utils
+
+# ============================================================= #
+
+DEFAULT_TOP = 20
+# buffered records above this size (bytes) are spilled to disk
+DEFAULT_SPILL_BYTES = 4 * 2**20
+# max number of distinct paths counted for the top-N list
+MAX_TRACKED_PATHS = 100000
+# approximate per-record overhead (bytes) besides the path strings
+RECORD_OVERHEAD = 64
+
+# ============================================================= #
+
+class DigestBuffer:
+    """
+    Collects event records of an interval handler in memory and renders them
+    once per interval as a digest: counts per event type, counts per directory
+    and the top-N most active paths.
+    The raw records are kept only if `keep_records` is set (e.g. to attach them
+    to the digest) and are spilled to `spill_file` whenever they take more than
+    `spill_bytes` in memory.
+    A digest taken out of the buffer can be put back with `restore` (e.g. if it could not be sent).
+    """
+
+    def __init__(self, watched_path='', top=DEFAULT_TOP, spill_bytes=DEFAULT_SPILL_BYTES, spill_file=None, keep_records=False):
+        self.watched_path = watched_path
+        self.top = top
+        self.keep_records = keep_records
+        self.spill_bytes = spill_bytes
+        self.spill_file = spill_file
+        self._lock = threading.Lock()
+        self._taken = None
+        self._reset()
+
+    def _reset(self):
+        self.started = utils.get_now()
+        self.total = 0
+        self.events = Counter()
+        self.dirs = Counter()
+        self.paths = Counter()
+        self._records = []
+        self._size = 0
+        self._spilled = 0
+
+    def add(self, event, message, src_path, dest_path):
+        with self._lock:
+            self.total += 1
+            self.events[event] += 1
+            self.dirs[os.path.dirname(src_path) or os.sep] += 1
+            if src_path in self.paths or len(self.paths) < MAX_TRACKED_PATHS:
+                self.paths[src_path] += 1
+            if not self.keep_records:
+                return
+            self._records.append((time.time(), event, src_path, dest_path))
+            self._size += len(src_path) + len(dest_path) + RECORD_OVERHEAD
+            if self.spill_file and self._size > self.spill_bytes:
+                self._spill()
+
+    def _spill(self):
+        with open(self.spill_file, 'a', encoding='utf-8', newline='') as f:
+            self._write(f, self._records)
+        self._spilled += len(self._records)
+        self._records = []
+        self._size = 0
+
+    @staticmethod
+    def _write(f, records):
+        writer = csv.writer(f, delimiter=';')
+        for ts, event, src_path, dest_path in records:
+            writer.writerow((datetime.datetime.fromtimestamp(ts).isoformat(sep=' ', timespec='seconds'), event, src_path, dest_path))
+
+    def render(self):
+        """Returns the digest text."""
+        with self._lock:
+            return self._render()
+
+    def _render(self):
+        lines = [f'{self.total} events in {self.watched_path} from {self.started:%Y-%m-%d %H:%M:%S} to {utils.get_now():%Y-%m-%d %H:%M:%S}',
+                 '', 'EVENTS:']
+        lines.extend(f'  {evt}: {n}' for evt, n in self.events.most_common())
+        lines.extend(['', f'DIRECTORIES (top {self.top} of {len(self.dirs)}):'])
+        lines.extend(f'  {d}: {n}' for d, n in self.dirs.most_common(self.top))
+        lines.extend(['', f'PATHS (top {self.top} of {len(self.paths)}):'])
+        lines.extend(f'  {p}: {n}' for p, n in self.paths.most_common(self.top))
+        return '\n'.join(lines)
+
+    def take(self, records_file=None):
+        """
+        Renders the digest and starts a new one. If `records_file` is given,
+        all records of the digest are written there (CSV).
+        Returns (text, records_file or None) or None if no events were collected.
+        """
+        with self._lock:
+            self._taken = None
+            if not self.total:
+                return None
+            text = self._render()
+            taken = len(self._records) + self._spilled
+            if records_file and self.keep_records:
+                if self._spilled and self.spill_file and os.path.isfile(self.spill_file):
+                    os.replace(self.spill_file, records_file)
+                with open(records_file, 'a' if self._spilled else 'w', encoding='utf-8', newline='') as f:
+                    self._write(f, self._records)
+            else:
+                records_file = None
+                if self.spill_file and os.path.isfile(self.spill_file):
+                    os.remove(self.spill_file)
+            self._taken = (self.started, self.total, self.events, self.dirs, self.paths, records_file, taken)
+            self._reset()
+        return (text, records_file)
+
+    def restore(self):
+        """Puts the last taken digest back, merged with the events collected since."""
+        with self._lock:
+            if not self._taken: return
+            started, total, events, dirs, paths, records_file, taken = self._taken
+            self._taken = None
+            self.started = started
+            self.total += total
+            self.events.update(events)
+            self.dirs.update(dirs)
+            for path, n in paths.items():
+                if path in self.paths or len(self.paths) < MAX_TRACKED_PATHS:
+                    self.paths[path] += n
+            if not (records_file and self.spill_file and os.path.isfile(records_file)):
+                return
+            # the taken records go before the ones spilled since
+            if self._spilled and os.path.isfile(self.spill_file):
+                with open(records_file, 'ab') as f, open(self.spill_file, 'rb') as spilled:
+                    shutil.copyfileobj(spilled, f)
+            os.replace(records_file, self.spill_file)
+            self._spilled += taken
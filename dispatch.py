@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import abc, time, threading
+from collections import deque, Counter
+
+import utils
+import metrics
+
+# ============================================================= #
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'collapse')
+DEFAULT_DISPATCH = {'queue': 1000, 'workers': 1, 'overflow': 'block'}
+# interval (seconds) between queue statistics log records
+STATS_INTERVAL = 60
+# number of collapsed messages quoted in the summary
+SUMMARY_SAMPLES = 10
+
+# ============================================================= #
+
+def collapse_summary(collapsed, samples):
+    """The 'sum' item of the items collapsed while a queue was full (counts per event, sample messages)."""
+    counts = ', '.join(f'{k}: {v}' for k, v in collapsed.most_common())
+    lines = [f'{sum(collapsed.values())} events collapsed while the queue was full ({counts}), first {len(samples)} listed:']
+    lines.extend(samples)
+    return ('sum', '\n'.join(lines), '', '')
+
+# ============================================================= #
+
+class BoundedQueue(abc.ABC):
+    """
+    Bounded queue of (event, message, src_path, dest_path, *extra) items consumed by
+    `threads` background threads (see `_run`).
+
+    When the queue is full, `overflow` decides what happens to a new item:
+        'block'       -- the caller waits for a free slot
+        'drop_oldest' -- the oldest queued item is discarded
+        'collapse'    -- the item is counted into a summary which is
+                         consumed as a single 'sum' item once the queue drains
+    Queue depth, wait times and losses are logged every STATS_INTERVAL seconds.
+    `on_drop` (if set) is called with the items discarded or collapsed; like the warnings,
+    outside the queue lock.
+    Once stopped, the queue rejects new items until it is started again.
+    """
+
+    # name of the queue in the log records, prefix of the thread names
+    label = 'Queue'
+    thread_name = 'queue'
+
+    def __init__(self, maxsize=1000, threads=1, overflow='block', name='', watched_path=''):
+        if not overflow in OVERFLOW_POLICIES:
+            raise Exception(f'Wrong overflow policy: {overflow}!')
+        self.maxsize = max(1, maxsize)
+        self.workers = max(1, threads)
+        self.overflow = overflow
+        self.name = name
+        self.watched_path = watched_path
+        self.on_drop = None
+        # (monotonic time, wall time, item) queued
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._threads = []
+        self._started = False
+        self._stopped = False
+        self._full = False
+        self._collapsed = Counter()
+        self._samples = []
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats_time = time.monotonic()
+        self._processed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._dropped = 0
+        self._collapsed_total = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads: return
+            self._started = True
+            self._stopped = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'{self.thread_name}-{self.name}-{i}', daemon=True)
+                self._threads.append(t)
+                t.start()
+
+    def stop(self, timeout=None):
+        """Stops the threads after the queued items (and summary) have been processed."""
+        with self._lock:
+            self._stopped = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+            threads = self._threads
+            self._threads = []
+        for t in threads:
+            t.join(timeout)
+
+    def put(self, event, message, src_path='', dest_path='', *extra):
+        """Queues an item; returns False if it was rejected (queue stopped) or collapsed."""
+        if not self._started and not self._stopped:
+            # the threads are started on first use
+            self.start()
+        item = (event, message, src_path, dest_path) + extra
+        dropped = None
+        # logged once the lock is released (a blocking log handler must not stall the queue)
+        warnings = []
+        with self._lock:
+            if len(self._queue) >= self.maxsize and not self._stopped:
+                if not self._full:
+                    self._full = True
+                    warnings.append(f'{self.label} [{self.name}] is full ({self.maxsize} items), overflow policy: {self.overflow}')
+                if self.overflow == 'block':
+                    while len(self._queue) >= self.maxsize and not self._stopped:
+                        self._not_full.wait()
+                elif self.overflow == 'drop_oldest':
+                    _, _, dropped = self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    self._collapsed[event] += 1
+                    self._collapsed_total += 1
+                    if len(self._samples) < SUMMARY_SAMPLES:
+                        self._samples.append(message)
+                    dropped, item = item, None
+            if self._stopped:
+                # not queued (nor reported as dropped): journaled events stay pending
+                warnings.append(f'{self.label} [{self.name}] is stopped, message rejected: {message}')
+                item = None
+            elif item:
+                self._queue.append((time.monotonic(), time.time(), item))
+                self._queued()
+        for msg in warnings:
+            utils.log(msg, how='warning', watched_path=self.watched_path)
+        if dropped and self.on_drop:
+            self.on_drop(*dropped)
+        return item is not None
+
+    def _queued(self):
+        # an item was queued (called with the lock)
+        self._not_empty.notify()
+
+    def _take(self):
+        # the oldest item (called with the lock): (seconds waited, wall time queued, item)
+        enqueued, timestamp, item = self._queue.popleft()
+        self._not_full.notify()
+        if not self._queue:
+            self._full = False
+        wait = time.monotonic() - enqueued
+        self._processed += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        return wait, timestamp, item
+
+    def _summary(self):
+        # the 'sum' item of the collapsed items (called with the lock)
+        item = collapse_summary(self._collapsed, self._samples)
+        self._collapsed.clear()
+        self._samples = []
+        return item
+
+    @abc.abstractmethod
+    def _run(self):
+        """Consumes the queued items until the queue is stopped and empty."""
+        pass
+
+    def _log_stats(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._stats_time < STATS_INTERVAL:
+                return
+            avg = self._wait_total / self._processed if self._processed else 0.0
+            msg = (f'{self.label} [{self.name}]: depth {len(self._queue)}, processed {self._processed}, '
+                   f'wait avg {avg:.3f} s / max {self._wait_max:.3f} s, dropped {self._dropped}, collapsed {self._collapsed_total}')
+            self._reset_stats()
+        utils.log(msg, watched_path=self.watched_path)
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+# ============================================================= #
+
+class DispatchQueue(BoundedQueue):
+    """Bounded queue (see BoundedQueue) of items processed one by one by `func` on `workers` background threads."""
+
+    label = 'Dispatch queue'
+    thread_name = 'dispatch'
+
+    def __init__(self, func, maxsize=1000, workers=1, overflow='block', name='', watched_path=''):
+        super().__init__(maxsize, workers, overflow, name, watched_path)
+        self.func = func
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._collapsed and not self._stopped:
+                    self._not_empty.wait()
+                if self._queue:
+                    wait, _, item = self._take()
+                elif self._collapsed:
+                    # the backlog is processed: send the summary of collapsed items
+                    item = self._summary()
+                else:
+                    return
+            if item[0] != 'sum':
+                metrics.DISPATCH_WAIT.observe(wait, root=self.watched_path, handler=self.name)
+            try:
+                self.func(*item)
+            except Exception as err:
+                utils.log(err, how='exception', watched_path=self.watched_path)
+            self._log_stats()
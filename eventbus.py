@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+import os, sys, json, stat, time, struct, socket, argparse, datetime, threading
+from collections import deque
+
+from globals import CONFIG
+import utils
+import metrics
+
+# ============================================================= #
+
+DEFAULT_BUS = {'socket': None, 'host': '127.0.0.1', 'port': 0, 'buffer': 10000, 'events': ['cre', 'del', 'mod', 'mov']}
+# frames: 4-byte (big-endian) length + UTF-8 JSON
+HEADER = struct.Struct('>I')
+# max size (bytes) of a subscription frame
+MAX_REQUEST_BYTES = 2**16
+# fields of the event records (JSON arrays)
+FIELDS = ('time', 'root', 'event', 'is_dir', 'path', 'dest')
+VERSION = 1
+# max frames written to a subscriber at once
+SEND_BATCH = 1000
+
+# ============================================================= #
+
+def encode(obj):
+    data = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+def _read_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return bytes(data)
+
+def read_frame(sock, limit=None):
+    """The next decoded frame of `sock`."""
+    size = HEADER.unpack(_read_exact(sock, HEADER.size))[0]
+    if limit and size > limit:
+        raise ValueError(f'Frame too large: {size} bytes')
+    return json.loads(_read_exact(sock, size))
+
+def wants(events, event):
+    # 'mov' stands for moves and renames (as in the handler events)
+    return event in events or (event == 'ren' and 'mov' in events)
+
+def published_events():
+    """The event types published on the bus (empty if the bus is disabled)."""
+    cfg = CONFIG.get('bus', None)
+    if not cfg or not (cfg.get('socket', None) or cfg.get('port', 0)):
+        return set()
+    return set(cfg.get('events', None) or DEFAULT_BUS['events'])
+
+def stale_socket(path):
+    """True if `path` is a Unix socket nobody listens on (left over by a previous run)."""
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        return True
+    finally:
+        probe.close()
+    return False
+
+def bus_address(cfg=None):
+    """Unix socket path or (host, port) of the bus."""
+    cfg = dict(DEFAULT_BUS, **(cfg if not cfg is None else (CONFIG.get('bus', None) or {})))
+    if cfg['socket']:
+        return cfg['socket'] if os.path.isabs(cfg['socket']) else utils.abspath(cfg['socket'])
+    return (cfg['host'] or DEFAULT_BUS['host'], cfg['port'])
+
+# ============================================================= #
+
+class Subscriber:
+    """
+    A connected subscriber: the records matching its filter are buffered (up to `buffer` records,
+    the oldest dropped beyond) and written by a thread of its own, so a slow subscriber only
+    delays (and loses) its own records.
+    """
+
+    def __init__(self, sock, name, buffer=10000):
+        self.sock = sock
+        self.name = name
+        self.buffer = max(1, buffer)
+        self.paths = ()
+        self.events = None
+        self.dropped = 0
+        self.closed = False
+        self._frames = deque()
+        self._ready = threading.Condition()
+
+    def subscribe(self, request):
+        """Applies the filter sent by the subscriber: {"paths": [...], "events": [...]} (missing / empty = all)."""
+        if not isinstance(request, dict):
+            raise ValueError(f'Wrong subscription: {request}')
+        self.paths = tuple(os.path.abspath(p).rstrip(os.sep) or os.sep for p in (request.get('paths', None) or []))
+        self.events = set(request.get('events', None) or []) or None
+
+    def matches(self, event, path, dest):
+        if self.events and not wants(self.events, event):
+            return False
+        if not self.paths:
+            return True
+        return any(p == os.sep or x == p or x.startswith(p + os.sep) for p in self.paths for x in (path, dest) if x)
+
+    def push(self, frame):
+        with self._ready:
+            if len(self._frames) >= self.buffer:
+                self._frames.popleft()
+                self.dropped += 1
+                metrics.BUS_DROPPED.inc()
+            self._frames.append(frame)
+            self._ready.notify()
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def run(self):
+        # writes the buffered frames until the subscriber is closed or disconnects
+        while True:
+            with self._ready:
+                while not self._frames and not self.closed:
+                    self._ready.wait()
+                if self.closed:
+                    return
+                frames = [self._frames.popleft() for _ in range(min(SEND_BATCH, len(self._frames)))]
+                if self.dropped:
+                    # tells the subscriber how many records it has lost
+                    frames.insert(0, encode({'dropped': self.dropped}))
+                    self.dropped = 0
+            self.sock.sendall(b''.join(frames))
+            metrics.BUS_RECORDS.inc(len(frames))
+
+# ============================================================= #
+
+class EventBus:
+    """
+    Publishes the handled events to any number of local subscribers over a Unix domain socket
+    (`address` = socket path) or a local TCP port (`address` = (host, port)), as length-prefixed JSON frames.
+
+    A subscriber connects and sends its filter (a frame {"paths": [...], "events": [...]}:
+    watched roots or any paths under them, event types); it then receives a frame
+    {"version": 1, "fields": [...]} and the matching event records [time, root, event, is_dir, path, dest]
+    (absolute paths), plus {"dropped": N} frames when its buffer of `buffer` records overflowed.
+    """
+
+    def __init__(self, address, buffer=10000, events=None):
+        self.address = address
+        self.buffer = buffer
+        self.events = set(events or DEFAULT_BUS['events'])
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # replaced (not changed) on (un)subscription: read without the lock by publish
+        self._subscribers = ()
+
+    @staticmethod
+    def from_config():
+        """The bus set in the config file (None if not set)."""
+        if not published_events():
+            return None
+        cfg = dict(DEFAULT_BUS, **CONFIG['bus'])
+        return EventBus(bus_address(cfg), cfg['buffer'], cfg['events'])
+
+    @property
+    def unix(self):
+        return isinstance(self.address, str)
+
+    def start(self):
+        if self.unix:
+            if not hasattr(socket, 'AF_UNIX'):
+                raise Exception('Unix domain sockets are not supported on this platform: set a bus port instead!')
+            if os.path.lexists(self.address):
+                # only a stale socket is replaced: never a file set by mistake, nor the socket of a running bus
+                if not stale_socket(self.address):
+                    raise Exception(f'Bus socket path already in use: {self.address}!')
+                os.remove(self.address)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            server = socket.socket(socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(self.address)
+        server.listen(16)
+        if not self.unix:
+            self.address = server.getsockname()[:2]
+        self._server = server
+        self._thread = threading.Thread(target=self._accept, name='bus', daemon=True)
+        self._thread.start()
+        utils.log(f'Publishing events on {self.address if self.unix else "%s:%s" % self.address}')
+        return self
+
+    def stop(self):
+        server, self._server = self._server, None
+        if not server: return
+        try:
+            server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        server.close()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, ()
+        for s in subscribers:
+            s.close()
+        if self.unix and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _accept(self):
+        n = 0
+        while self._server:
+            try:
+                sock, peer = self._server.accept()
+            except OSError:
+                return
+            n += 1
+            threading.Thread(target=self._serve, args=(sock, f'subscriber-{n}'), name=f'bus-{n}', daemon=True).start()
+
+    def _serve(self, sock, name):
+        subscriber = Subscriber(sock, name, self.buffer)
+        try:
+            sock.settimeout(10)
+            subscriber.subscribe(read_frame(sock, MAX_REQUEST_BYTES))
+            sock.settimeout(None)
+            sock.sendall(encode({'version': VERSION, 'fields': FIELDS}))
+        except (OSError, ValueError) as err:
+            utils.log(f'Bus {name} rejected: {err}', how='warning')
+            subscriber.close()
+            return
+        self._register(subscriber, True)
+        utils.log(f'Bus {name} subscribed (paths: {list(subscriber.paths) or "all"}, events: {sorted(subscriber.events or []) or "all"})')
+        try:
+            subscriber.run()
+        except OSError:
+            pass
+        finally:
+            self._register(subscriber, False)
+            subscriber.close()
+        utils.log(f'Bus {name} disconnected')
+
+    def _register(self, subscriber, add):
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s is not subscriber]
+            if add and self._server:
+                subscribers.append(subscriber)
+            self._subscribers = tuple(subscribers)
+        metrics.BUS_SUBSCRIBERS.set(len(self._subscribers))
+
+    def publish(self, root, event, is_dir, src_path, dest_path=''):
+        """Sends an event (paths relative to `root`) to the matching subscribers."""
+        subscribers = self._subscribers
+        if not subscribers or not wants(self.events, event):
+            return
+        path, dest = root + src_path, (root + dest_path if dest_path else '')
+        frame = None
+        for s in subscribers:
+            if s.matches(event, path, dest):
+                if frame is None:
+                    frame = encode([round(time.time(), 3), root, event, int(is_dir), path, dest])
+                s.push(frame)
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+# ============================================================= #
+
+def subscribe(address, paths=None, events=None, timeout=None):
+    """
+    Yields the event records of the bus at `address` (Unix socket path or (host, port)) as dicts
+    (see FIELDS), and {'dropped': N} when records were lost; ends when the bus is stopped.
+    """
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection(address, timeout)
+    try:
+        sock.sendall(encode({'paths': list(paths or []), 'events': list(events or [])}))
+        fields = read_frame(sock)['fields']
+        while True:
+            try:
+                frame = read_frame(sock)
+            except ConnectionError:
+                return
+            yield dict(zip(fields, frame)) if isinstance(frame, list) else frame
+    finally:
+        sock.close()
+
+def main(argv=None):
+    """The `subscribe` command: prints the events published on the bus."""
+    parser = argparse.ArgumentParser(prog='watcher.py subscribe', description='Print the events published on the event bus')
+    parser.add_argument('--config', default=None, help='config file (default = config.yaml)')
+    parser.add_argument('--socket', default=None, help="Unix socket of the bus (default = 'bus' settings of the config file)")
+    parser.add_argument('--port', type=int, default=None, help='local TCP port of the bus')
+    parser.add_argument('--host', default=DEFAULT_BUS['host'], help='host of the bus')
+    parser.add_argument('--path', action='append', default=None, help='watched path (prefix) to subscribe to (repeatable, default = all)')
+    parser.add_argument('--events', default=None, help='comma-separated event types: cre, mod, del, mov, ren')
+    parser.add_argument('--format', choices=('text', 'json'), default='text', help='output format')
+    args = parser.parse_args(argv)
+
+    if args.socket:
+        address = os.path.abspath(args.socket)
+    elif args.port:
+        address = (args.host, args.port)
+    else:
+        address = bus_address()
+    if not address or (not isinstance(address, str) and not address[1]):
+        parser.error('no bus set: --socket, --port or the bus settings of the config file')
+    events = [e.strip() for e in args.events.split(',') if e.strip()] if args.events else None
+    try:
+        # the bus matches absolute paths
+        paths = [os.path.abspath(p) for p in args.path] if args.path else None
+        for record in subscribe(address, paths, events):
+            if args.format == 'json':
+                print(json.dumps(record, ensure_ascii=False), flush=True)
+            elif 'dropped' in record:
+                print(f"... {record['dropped']} events lost (buffer full)", file=sys.stderr, flush=True)
+            else:
+                dt = datetime.datetime.fromtimestamp(record['time']).isoformat(sep=' ', timespec='seconds')
+                line = f"{dt}  {record['event']}  {'DIR ' if record['is_dir'] else 'FILE'}  {record['path']}"
+                print(line + (f"  ==>  {record['dest']}" if record['dest'] else ''), flush=True)
+    except (OSError, ValueError) as err:
+        parser.exit(1, f'Bus connection closed: {err}\n')
+    except KeyboardInterrupt:
+        pass
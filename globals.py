@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
-import os, sys
-from ruamel.yaml import YAML
+import os, sys, marshal
 
 # ============================================================= #
 
 ROOT_DIR = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
 
-config_file_ = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
+# watcher.py [config file] or watcher.py query|subscribe [--config config file] [options]
+args_ = sys.argv[1:]
+if args_ and args_[0] in ('query', 'subscribe'):
+    args_ = [a.split('=', 1)[1] if a.startswith('--config=') else args_[i + 1] for i, a in enumerate(args_)
+             if (a == '--config' and i + 1 < len(args_)) or a.startswith('--config=')]
+config_file_ = args_[0] if args_ else 'config.yaml'
 if not os.path.isabs(config_file_):
     config_file_ = os.path.join(ROOT_DIR, config_file_)
 
@@ -15,9 +19,75 @@ if not os.path.isfile(config_file_):
 
 CONFIG_FILE = config_file_
 
-with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-    CONFIG = YAML().load(f)
+# format version of the compiled config cache (see load_config)
+CONFIG_CACHE_VERSION = 1
+
+def _cache_file(filename):
+    folder, name = os.path.split(filename)
+    return os.path.join(folder, f'.{name}.cache')
+
+def _parse_yaml(f):
+    # safe loading (plain dicts and lists): the C loader of PyYAML (libyaml) if available, else ruamel
+    try:
+        from yaml import load, CSafeLoader
+    except ImportError:
+        from ruamel.yaml import YAML
+        return YAML(typ='safe').load(f)
+    return load(f, Loader=CSafeLoader)
+
+def _normalize(config, filename):
+    if not isinstance(config, dict):
+        raise Exception(f'Wrong config file: {filename}!')
+    if not isinstance(config.get('logging', None), dict):
+        config['logging'] = {}
+    watchers = config.get('watchers', None) or []
+    if not isinstance(watchers, list) or not all(isinstance(w, dict) for w in watchers):
+        raise Exception(f'Wrong watchers in config file: {filename}!')
+    for w in watchers:
+        handlers = w.get('handlers', None) or []
+        if not isinstance(handlers, list) or not all(isinstance(h, dict) for h in handlers):
+            raise Exception(f'Wrong handlers of watcher "{w.get("path", "")}" in config file: {filename}!')
+    return config
+
+def load_config(filename=None):
+    """
+    Reads and validates the config file. The result is cached in a hidden file next to it
+    (keyed on its modification time and size), so that unchanged configs are not parsed again.
+    """
+    filename = filename or CONFIG_FILE
+    st = os.stat(filename)
+    key = (CONFIG_CACHE_VERSION, sys.version, filename, st.st_mtime_ns, st.st_size)
+    cache = _cache_file(filename)
+    try:
+        with open(cache, 'rb') as f:
+            cached_key, config = marshal.load(f)
+        if cached_key == key:
+            return config
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    with open(filename, 'r', encoding='utf-8') as f:
+        config = _normalize(_parse_yaml(f), filename)
+    tmp = f'{cache}.{os.getpid()}'
+    try:
+        with open(tmp, 'wb') as f:
+            marshal.dump((key, config), f)
+        os.replace(tmp, cache)
+    except (OSError, ValueError):
+        # read-only location or values marshal does not support (e.g. dates): no cache
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    return config
+
+def reload_config():
+    """Reads the config file again into CONFIG (in place: the modules keep their reference to it)."""
+    config = load_config()
+    CONFIG.clear()
+    CONFIG.update(config)
+
+CONFIG = load_config()
 
 DEFAULT_POLL_SECONDS = 10
 
-# ============================================================= #
\ No newline at end of file
+# ============================================================= #
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import os, re, sys, csv, json, time, datetime, argparse
+
+from globals import CONFIG
+import utils
+from journal import BatchWriter
+
+# ============================================================= #
+
+DEFAULT_HISTORY = {'file': None, 'commit': {'interval': 1, 'batch': 10000}, 'keep': {'interval': 30, 'unit': 'd'}}
+# interval (seconds) between the removals of expired events
+COMPACT_SECONDS = 3600
+# max number of events printed by a query (0 = all)
+DEFAULT_LIMIT = 1000
+# relative times of the query command, e.g. '90m' (ago)
+RELATIVE_TIME = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhdw])$', re.I)
+
+# ============================================================= #
+
+class EventHistory(BatchWriter):
+    """
+    Indexed store of the handled events: time, watched root, event type, directory flag
+    and full source / destination paths. The events are indexed by time and by path
+    (a path prefix query is an index range scan), written in group commits without
+    a sync per commit (a history, not a journal: see EventJournal).
+    Events older than `keep` seconds are removed and the freed pages are returned
+    to the file system (incremental vacuum) every COMPACT_SECONDS.
+    """
+
+    SCHEMA = (
+        # only effective for a new database (before the tables are created)
+        'PRAGMA auto_vacuum=INCREMENTAL',
+        'CREATE TABLE IF NOT EXISTS events (time REAL NOT NULL, root TEXT NOT NULL, event TEXT NOT NULL, '
+        'is_dir INTEGER NOT NULL, path TEXT NOT NULL, dest TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS events_time ON events (time)',
+        'CREATE INDEX IF NOT EXISTS events_path ON events (path, time)',
+        "CREATE INDEX IF NOT EXISTS events_dest ON events (dest, time) WHERE dest != ''",
+    )
+    SYNCHRONOUS = 'NORMAL'
+    NAME = 'history'
+
+    def __init__(self, filename, commit_interval=1, commit_batch=10000, keep=30 * 86400):
+        super().__init__(filename, commit_interval, commit_batch)
+        self.keep = keep
+
+    @staticmethod
+    def from_config():
+        """The history set in the config file (None if not set)."""
+        filename = history_file()
+        if not filename:
+            return None
+        cfg = CONFIG['history']
+        commit = dict(DEFAULT_HISTORY['commit'], **(cfg.get('commit', None) or {}))
+        keep = dict(DEFAULT_HISTORY['keep'], **(cfg.get('keep', None) or {}))
+        return EventHistory(filename, commit['interval'], commit['batch'], utils.span_to_seconds(keep['interval'], keep['unit']))
+
+    def _opened(self):
+        self.compact()
+        utils.log(f'Event history: {self.filename}')
+
+    def add(self, root, event, is_dir, src_path, dest_path=''):
+        """Queues an event (paths relative to `root`) for the next commit."""
+        self._queue.put(('e', (time.time(), root, event, int(is_dir), root + src_path, root + dest_path if dest_path else '')))
+
+    def compact(self):
+        """Queues the removal of the expired events."""
+        self._queue.put(('p', time.time() - self.keep))
+
+    def _write(self, items):
+        self._conn.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)', [data for kind, data in items if kind == 'e'])
+        for kind, cutoff in items:
+            if kind != 'p': continue
+            self._conn.execute('DELETE FROM events WHERE time < ?', (cutoff,))
+            self._conn.execute('PRAGMA incremental_vacuum')
+            # refreshes the statistics the query planner chooses the index by
+            self._conn.execute('PRAGMA optimize')
+
+# ============================================================= #
+
+def history_file():
+    cfg = CONFIG.get('history', None)
+    if not cfg or not cfg.get('file', None):
+        return None
+    return cfg['file'] if os.path.isabs(cfg['file']) else utils.abspath(cfg['file'])
+
+def query(filename, since=None, until=None, prefix=None, events=None, limit=DEFAULT_LIMIT, count=False):
+    """
+    (time, root, event, is_dir, path, dest) of the events between the timestamps `since` and `until`
+    whose source or destination path is `prefix` or lies under it, ordered by time;
+    (event, count) pairs with `count`.
+    """
+    conditions = []
+    args = []
+    if not since is None:
+        conditions.append('time >= ?')
+        args.append(since)
+    if not until is None:
+        conditions.append('time < ?')
+        args.append(until)
+    if events:
+        conditions.append(f'event IN ({", ".join("?" * len(events))})')
+        args.extend(events)
+    columns = 'time, root, event, is_dir, path, dest'
+    conn = BatchWriter.connect(filename, 'NORMAL')
+    try:
+        sql = f'SELECT {columns} FROM events'
+        if prefix:
+            base = prefix.rstrip(os.sep)
+            # the root ('/') is kept
+            prefix = base or prefix
+            # the paths under the prefix sort between 'prefix/' and 'prefix0' ('0' follows '/')
+            low, high = base + os.sep, base + chr(ord(os.sep) + 1)
+            in_path = '(path = ? OR (path >= ? AND path < ?))'
+            in_dest = "(dest != '' AND (dest = ? OR (dest >= ? AND dest < ?)))"
+            index = _choose_index(conn, since, until, prefix, low, high)
+            # one index range scan per column: events moved into the prefix are added to those under it
+            # (the indexes are forced: the planner would rather scan the time index to merge in time order)
+            sql = (f'SELECT {columns} FROM events INDEXED BY {index} WHERE {" AND ".join(conditions + [in_path])} UNION ALL '
+                   f'SELECT {columns} FROM events INDEXED BY events_dest WHERE {" AND ".join(conditions + [in_dest, "NOT " + in_path])}')
+            args = args + [prefix, low, high] + args + [prefix, low, high, prefix, low, high]
+        elif conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if count:
+            sql = f'SELECT event, COUNT(*) FROM ({sql}) GROUP BY event ORDER BY event'
+        else:
+            sql += ' ORDER BY time'
+            if limit:
+                sql += f' LIMIT {int(limit)}'
+        return conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+def _choose_index(conn, since, until, prefix, low, high):
+    """
+    The index with fewer entries to visit for a time range + path prefix query: the number of events
+    in the time range is estimated from the time span of the store, the events under the prefix
+    are counted (up to that number).
+    """
+    if since is None and until is None:
+        return 'events_path'
+    first = conn.execute('SELECT MIN(time) FROM events').fetchone()[0]
+    last = conn.execute('SELECT MAX(time) FROM events').fetchone()[0]
+    # MIN / MAX each in their own query: one index lookup instead of a scan
+    total = conn.execute('SELECT MAX(rowid) FROM events').fetchone()[0] or 0
+    total -= (conn.execute('SELECT MIN(rowid) FROM events').fetchone()[0] or 1) - 1
+    if not total or last is None or last <= first:
+        return 'events_time'
+    span = min(last, until if not until is None else last) - max(first, since if not since is None else first)
+    in_range = int(max(0, span) / (last - first) * total) + 1
+    under = conn.execute('SELECT COUNT(*) FROM (SELECT 1 FROM events INDEXED BY events_path '
+                         'WHERE path = ? OR (path >= ? AND path < ?) LIMIT ?)', (prefix, low, high, in_range)).fetchone()[0]
+    return 'events_path' if under < in_range else 'events_time'
+
+def parse_time(value):
+    """Timestamp of an ISO date / time ('2024-05-01 02:00', '02:00' = today) or a time span ago ('90m', '2h')."""
+    if value is None:
+        return None
+    value = value.strip()
+    m = RELATIVE_TIME.match(value)
+    if m:
+        return time.time() - utils.span_to_seconds(float(m.group(1)), m.group(2).lower())
+    if value.lower() == 'now':
+        return time.time()
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return datetime.datetime.combine(datetime.date.today(), datetime.time.fromisoformat(value)).timestamp()
+
+# ============================================================= #
+
+def main(argv=None):
+    """The `query` command: prints the events of the history matching the options."""
+    parser = argparse.ArgumentParser(prog='watcher.py query', description='Query the event history')
+    parser.add_argument('--config', default=None, help='config file (default = config.yaml)')
+    parser.add_argument('--file', default=None, help="history database (default = 'history: file' of the config file)")
+    parser.add_argument('--since', default=None, help="start time: ISO date / time ('2024-05-01 02:00', '02:00' = today) or time span ago ('2h')")
+    parser.add_argument('--until', default=None, help='end time (excluded), same formats as --since')
+    parser.add_argument('--path', default=None, help='path (prefix): events of the path and of everything under it')
+    parser.add_argument('--events', default=None, help='comma-separated event types: cre, mod, del, mov, ren')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help=f'max number of events (0 = all, default = {DEFAULT_LIMIT})')
+    parser.add_argument('--format', choices=('text', 'csv', 'json'), default='text', help='output format')
+    parser.add_argument('--count', action='store_true', help='only print the number of events per type')
+    args = parser.parse_args(argv)
+
+    filename = args.file or history_file()
+    if not filename or not os.path.isfile(filename):
+        parser.error(f'no event history found: {filename or "no history file set in the config file"}')
+    try:
+        since, until = parse_time(args.since), parse_time(args.until)
+    except ValueError as err:
+        parser.error(f'wrong time: {err}')
+    events = [e.strip() for e in args.events.split(',') if e.strip()] if args.events else None
+
+    started = time.perf_counter()
+    rows = query(filename, since, until, args.path and os.path.abspath(args.path), events, args.limit, args.count)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    out = sys.stdout
+    total = sum(count for _, count in rows) if args.count else len(rows)
+    if args.count and args.format == 'json':
+        json.dump(dict(rows), out, indent=2)
+        out.write('\n')
+    elif args.count:
+        for event, count in rows:
+            out.write(f'{event}\t{count}\n')
+    elif args.format == 'json':
+        json.dump([{'time': datetime.datetime.fromtimestamp(t).isoformat(), 'root': root, 'event': event, 'is_dir': bool(is_dir),
+                    'path': path, 'dest': dest} for t, root, event, is_dir, path, dest in rows], out, indent=2)
+        out.write('\n')
+    elif args.format == 'csv':
+        writer = csv.writer(out, delimiter=';', quoting=csv.QUOTE_ALL)
+        writer.writerow(('time', 'root', 'event', 'is_dir', 'path', 'dest'))
+        for t, root, event, is_dir, path, dest in rows:
+            writer.writerow((datetime.datetime.fromtimestamp(t).isoformat(sep=' ', timespec='seconds'), root, event, is_dir, path, dest))
+    else:
+        for t, root, event, is_dir, path, dest in rows:
+            line = f"{datetime.datetime.fromtimestamp(t).isoformat(sep=' ', timespec='seconds')}  {event}  {'DIR ' if is_dir else 'FILE'}  {path}"
+            out.write(line + (f'  ==>  {dest}\n' if dest else '\n'))
+    print(f'{total} events ({elapsed:.1f} ms)', file=sys.stderr)
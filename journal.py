@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+import os, time, heapq, queue, threading
+import abc
+
+from globals import CONFIG
+import utils
+import metrics
+
+# ============================================================= #
+
+DEFAULT_JOURNAL = {'file': None, 'commit': {'interval': 0.05, 'batch': 1000},
+                   'retry': {'min': 5, 'max': 600}, 'keep': {'interval': 7, 'unit': 'd'}}
+# interval (seconds) between the removals of delivered and expired events
+PRUNE_SECONDS = 3600
+# number of journaled events read at once (redelivery, replay)
+READ_BATCH = 500
+
+# ============================================================= #
+
+class BatchWriter(abc.ABC):
+    """
+    SQLite database (WAL mode) written by a background thread in group commits:
+    the items queued within `commit_interval` seconds (up to `commit_batch` items)
+    are written in one transaction, i.e. one fsync with synchronous = FULL.
+    Subclasses define the schema and write the batches (`_write`).
+    """
+
+    SCHEMA = ()
+    SYNCHRONOUS = 'FULL'
+    NAME = 'writer'
+
+    def __init__(self, filename, commit_interval=0.05, commit_batch=1000):
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.commit_batch = max(1, commit_batch)
+        self._queue = queue.SimpleQueue()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._thread = None
+
+    @staticmethod
+    def connect(filename, synchronous='FULL', schema=()):
+        # imported here: only needed if a database is enabled
+        import sqlite3
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # transactions are managed explicitly (isolation_level=None)
+        conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={synchronous}')
+        for sql in schema:
+            conn.execute(sql)
+        return conn
+
+    def open(self):
+        # the connection is shared with the writer thread, guarded by _db_lock
+        self._conn = BatchWriter.connect(self.filename, self.SYNCHRONOUS, self.SCHEMA)
+        self._opened()
+        self._thread = threading.Thread(target=self._run, name=self.NAME, daemon=True)
+        self._thread.start()
+        return self
+
+    def _opened(self):
+        pass
+
+    def close(self):
+        """Writes the queued items and closes the database."""
+        if not self._thread: return
+        self._queue.put(('x', None))
+        self._thread.join()
+        self._thread = None
+        with self._db_lock:
+            self._conn.close()
+            self._conn = None
+
+    def flush(self, timeout=None):
+        """Waits until the items queued so far are committed."""
+        if not self._thread or self._thread is threading.current_thread(): return
+        done = threading.Event()
+        self._queue.put(('f', done))
+        done.wait(timeout)
+
+    def _next_batch(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.commit_interval
+        while len(items) < self.commit_batch and not items[-1][0] in ('f', 'x'):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0: break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            data = [item for item in items if not item[0] in ('f', 'x')]
+            if data:
+                try:
+                    with self._db_lock:
+                        self._conn.execute('BEGIN')
+                        try:
+                            self._write(data)
+                            self._conn.execute('COMMIT')
+                        except Exception:
+                            self._conn.execute('ROLLBACK')
+                            raise
+                except Exception as err:
+                    utils.log(f'Failed to write {len(data)} items to {self.filename}: {err}', how='error')
+            for kind, done in items:
+                if kind == 'f':
+                    done.set()
+            if items[-1][0] == 'x':
+                return
+
+    @abc.abstractmethod
+    def _write(self, items):
+        """Writes the (kind, data) items queued for a commit (in a transaction)."""
+        pass
+
+# ============================================================= #
+
+class EventJournal(BatchWriter):
+    """
+    Append-only journal of the events handed to the handlers and of the delivery
+    cursors of the handlers (the id of the last event each handler has delivered).
+
+    Events get their (increasing) ids when appended and are written with the cursor
+    updates in group commits. A crash loses at most the events of the last commit interval.
+    Events delivered by all handlers of their root and events older than `keep` seconds
+    are removed every PRUNE_SECONDS.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, time REAL NOT NULL, root TEXT NOT NULL, '
+        'event TEXT NOT NULL, message TEXT NOT NULL, src TEXT NOT NULL, dest TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS events_root ON events (root, id)',
+        'CREATE TABLE IF NOT EXISTS cursors (handler TEXT PRIMARY KEY, root TEXT NOT NULL, position INTEGER NOT NULL, time REAL NOT NULL)',
+    )
+    NAME = 'journal'
+
+    def __init__(self, filename, commit_interval=0.05, commit_batch=1000, keep=7 * 86400, retry_min=5, retry_max=600):
+        super().__init__(filename, commit_interval, commit_batch)
+        self.keep = keep
+        self.retry_min = retry_min
+        self.retry_max = max(retry_min, retry_max)
+        self._lock = threading.Lock()
+        self._next_id = 1
+        # handler key -> delivered position
+        self._cursors = {}
+
+    @staticmethod
+    def from_config():
+        """The journal set in the config file (None if not set)."""
+        cfg = CONFIG.get('journal', None)
+        if not cfg or not cfg.get('file', None):
+            return None
+        commit = dict(DEFAULT_JOURNAL['commit'], **(cfg.get('commit', None) or {}))
+        retry = dict(DEFAULT_JOURNAL['retry'], **(cfg.get('retry', None) or {}))
+        keep = dict(DEFAULT_JOURNAL['keep'], **(cfg.get('keep', None) or {}))
+        return EventJournal(cfg['file'] if os.path.isabs(cfg['file']) else utils.abspath(cfg['file']),
+                            commit['interval'], commit['batch'], utils.span_to_seconds(keep['interval'], keep['unit']),
+                            retry['min'], retry['max'])
+
+    def _opened(self):
+        last = self._conn.execute('SELECT MAX(id) FROM events').fetchone()[0]
+        self._cursors = {key: position for key, position in self._conn.execute('SELECT handler, position FROM cursors')}
+        # the ids go on after the delivered events already removed from the journal
+        self._next_id = max([last or 0] + list(self._cursors.values())) + 1
+        self.prune()
+        utils.log(f'Event journal: {self.filename} ({len(self._cursors)} handler cursors)')
+
+    def append(self, root, event, message, src_path, dest_path):
+        """Queues an event for the next commit and returns its id."""
+        with self._lock:
+            eid = self._next_id
+            self._next_id += 1
+            self._queue.put(('e', (eid, time.time(), root, event, message, src_path or '', dest_path or '')))
+        return eid
+
+    @property
+    def last_id(self):
+        with self._lock:
+            return self._next_id - 1
+
+    def register(self, key, root):
+        """Delivery position of handler `key`: a new handler starts at the end of the journal."""
+        with self._lock:
+            if not key in self._cursors:
+                self._cursors[key] = self._next_id - 1
+                self._queue.put(('c', (key, root, self._cursors[key])))
+            return self._cursors[key]
+
+    def advance(self, key, root, position):
+        """Queues the delivery position of handler `key` for the next commit."""
+        with self._lock:
+            self._cursors[key] = position
+            self._queue.put(('c', (key, root, position)))
+
+    def pending(self, root, after, limit=READ_BATCH, until=None):
+        """(id, event, message, src_path, dest_path) of the events of `root` after id `after` (up to id `until`)."""
+        self.flush()
+        sql = 'SELECT id, event, message, src, dest FROM events WHERE root = ? AND id > ?'
+        args = [root, after]
+        if not until is None:
+            sql += ' AND id <= ?'
+            args.append(until)
+        with self._db_lock:
+            if not self._conn:
+                return []
+            return self._conn.execute(sql + ' ORDER BY id LIMIT ?', args + [limit]).fetchall()
+
+    def prune(self):
+        """Queues the removal of the delivered and expired events."""
+        self._queue.put(('p', time.time() - self.keep))
+
+    def _write(self, items):
+        events = [data for kind, data in items if kind == 'e']
+        # the last position of each handler
+        now = time.time()
+        cursors = {data[0]: data + (now,) for kind, data in items if kind == 'c'}
+        with metrics.JOURNAL_COMMIT_SECONDS.time():
+            self._conn.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)', events)
+            self._conn.executemany('INSERT OR REPLACE INTO cursors VALUES (?, ?, ?, ?)', list(cursors.values()))
+            for kind, cutoff in items:
+                if kind != 'p': continue
+                self._conn.execute('DELETE FROM events WHERE time < ?', (cutoff,))
+                # cursors of handlers no longer configured
+                self._conn.execute('DELETE FROM cursors WHERE time < ?', (cutoff,))
+                self._conn.execute('DELETE FROM events WHERE id <= (SELECT MIN(position) FROM cursors WHERE cursors.root = events.root)')
+        if events:
+            metrics.JOURNAL_EVENTS.inc(len(events))
+
+# ============================================================= #
+
+class DeliveryCursor:
+    """
+    Delivery position of a handler in the journal. Events may be delivered out of order
+    (several dispatch workers): the position is the id before the lowest id still in flight.
+    After a failure the handler is 'retrying' until the events after the position have been
+    resent from the journal; new events wait in the journal meanwhile.
+    """
+
+    def __init__(self, journal: EventJournal, key, root):
+        self.journal = journal
+        self.key = key
+        self.root = root
+        self.position = journal.register(key, root)
+        # last event seen by the handler
+        self.seen = self.position
+        self.retrying = False
+        self.delay = 0
+        self._inflight = set()
+        # heap of the ids in flight (ids no longer in flight are popped lazily): events are not
+        # always sent in id order (several threads may trigger the handlers)
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _update(self):
+        while self._heap and not self._heap[0] in self._inflight:
+            heapq.heappop(self._heap)
+        position = self._heap[0] - 1 if self._heap else self.seen
+        if position > self.position:
+            self.position = position
+            self.journal.advance(self.key, self.root, position)
+
+    def skip(self, eid):
+        """Event `eid` is not for the handler."""
+        with self._lock:
+            self.seen = max(self.seen, eid)
+            if not self.retrying:
+                self._update()
+
+    def send(self, eid):
+        """Returns True if event `eid` is to be sent now (False while retrying)."""
+        with self._lock:
+            self.seen = max(self.seen, eid)
+            if self.retrying:
+                return False
+            self._inflight.add(eid)
+            heapq.heappush(self._heap, eid)
+            return True
+
+    def mark(self, eid):
+        """Event `eid` is collected for an interval emit."""
+        with self._lock:
+            self.seen = max(self.seen, eid)
+
+    def done(self, eid):
+        with self._lock:
+            if not eid in self._inflight: return
+            self._inflight.discard(eid)
+            if not self.retrying:
+                self._update()
+
+    def failed(self, eid):
+        """Returns True if the handler starts retrying (the events after the position are resent)."""
+        with self._lock:
+            self._inflight.clear()
+            self._heap = []
+            if self.retrying:
+                return False
+            self.retrying = True
+            return True
+
+    def advance(self, position):
+        """The events up to `position` are delivered."""
+        with self._lock:
+            if position > self.position:
+                self.position = position
+                self.journal.advance(self.key, self.root, position)
+
+    def pending(self, limit=READ_BATCH, until=None):
+        return self.journal.pending(self.root, self.position, limit, until)
+
+    def finish_retry(self):
+        """Stops retrying if no events are left after the position; returns False otherwise."""
+        with self._lock:
+            if self.journal.pending(self.root, self.position, 1):
+                return False
+            self.retrying = False
+            self.delay = 0
+            self.seen = max(self.seen, self.position)
+            return True
+
+    def next_delay(self):
+        """Seconds to wait before the next retry: doubled after every failure."""
+        self.delay = min(self.journal.retry_max, self.delay * 2) if self.delay else self.journal.retry_min
+        return self.delay
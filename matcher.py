@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os, re, fnmatch
+from watchdog.events import FileSystemEventHandler
+
+# ============================================================= #
+
+def _compile(masks, case_sensitive, anchored_dirs=False):
+    """Compiles a list of shell masks into a single regex (None if the list is empty)."""
+    if not masks:
+        return None
+    parts = []
+    for mask in masks:
+        rx = fnmatch.translate(str(mask))
+        # relative path masks match at any directory level, like pathlib.PurePath.match
+        parts.append(rf'(?:.*{re.escape(os.sep)})?{rx}' if anchored_dirs else rx)
+    return re.compile('|'.join(f'(?:{p})' for p in parts), 0 if case_sensitive else re.IGNORECASE)
+
+def _normsep(mask):
+    return str(mask).replace('/', os.sep).replace('\\', os.sep).strip(os.sep)
+
+# ============================================================= #
+
+class PathMatcher:
+    """
+    Compiled file and directory filter of a watcher.
+
+    `types` and `ignore_types` are file masks matched against base names
+    (or against the trailing path components if the mask contains a separator).
+    `ignore_dirs` are directory masks: a plain name (e.g. 'node_modules', '.git', '*cache*')
+    excludes such directories at any depth, a relative or absolute path excludes
+    only the directory under the watched root.
+    The masks are compiled once into combined regular expressions so that the scanner
+    can skip whole ignored subtrees and files not matching `types` without stat'ing them.
+    """
+
+    def __init__(self, root, types=None, ignore_types=None, ignore_dirs=None, case_sensitive=False):
+        self.root = root
+        self._prefix = root.rstrip(os.sep) + os.sep
+        self.case_sensitive = case_sensitive
+        types = [t for t in (types or []) if t]
+        # '*' matches everything: no need to test names at all
+        if '*' in types:
+            types = []
+        self._types_name = _compile([t for t in types if not os.sep in _normsep(t)], case_sensitive)
+        self._types_path = _compile([_normsep(t) for t in types if os.sep in _normsep(t)], case_sensitive, True)
+        self._has_types = bool(types)
+        ignore_types = [t for t in (ignore_types or []) if t]
+        self._ignore_name = _compile([t for t in ignore_types if not os.sep in _normsep(t)], case_sensitive)
+        self._ignore_path = _compile([_normsep(t) for t in ignore_types if os.sep in _normsep(t)], case_sensitive, True)
+        # ignore_dirs used to be passed to watchdog as the 'ignore_directories' flag
+        self.ignore_dir_events = ignore_dirs is True
+        dirs = ignore_dirs if isinstance(ignore_dirs, (list, tuple)) else []
+        dir_names, dir_paths = [], []
+        for d in dirs:
+            if not d: continue
+            # an absolute path is a path under the root, even one level deep
+            absolute = os.path.isabs(str(d))
+            if absolute:
+                d = os.path.relpath(str(d), root)
+            d = _normsep(d)
+            (dir_paths if absolute or os.sep in d else dir_names).append(d)
+        self._dir_name = _compile(dir_names, case_sensitive)
+        self._dir_path = _compile(dir_paths, case_sensitive)
+
+    @property
+    def is_trivial(self):
+        return not any((self._has_types, self._ignore_name, self._ignore_path, self._dir_name, self._dir_path,
+                        self.ignore_dir_events))
+
+    def match_dir(self, rel, name):
+        """Whether directory `name` (relative path `rel`) must be scanned."""
+        if self._dir_name and self._dir_name.match(name):
+            return False
+        if self._dir_path and self._dir_path.match(rel):
+            return False
+        return True
+
+    def match_file(self, rel, name):
+        """Whether a file (or the name of a directory) passes the type masks."""
+        if self._has_types:
+            if not ((self._types_name and self._types_name.match(name)) or (self._types_path and self._types_path.match(rel))):
+                return False
+        if self._ignore_name and self._ignore_name.match(name):
+            return False
+        if self._ignore_path and self._ignore_path.match(rel):
+            return False
+        return True
+
+    def match_path(self, path, is_directory=False):
+        """Whether an event on the absolute `path` must be reported."""
+        if path == self.root:
+            rel = ''
+        elif path.startswith(self._prefix):
+            rel = path[len(self._prefix):]
+        else:
+            return False
+        parts = rel.split(os.sep) if rel else []
+        # none of the parent directories (and the directory itself) must be ignored
+        sub = ''
+        for part in (parts if is_directory else parts[:-1]):
+            sub = os.path.join(sub, part) if sub else part
+            if not self.match_dir(sub, part):
+                return False
+        if is_directory and self.ignore_dir_events:
+            return False
+        return self.match_file(rel, parts[-1] if parts else os.path.basename(self.root))
+
+    def match_event(self, event):
+        paths = [event.src_path]
+        dest = getattr(event, 'dest_path', '')
+        if dest: paths.append(dest)
+        return any(self.match_path(p, event.is_directory) for p in paths)
+
+    @property
+    def signature(self):
+        """String identifying the filter (changes whenever the masks change)."""
+        rxs = (self._types_name, self._types_path, self._ignore_name, self._ignore_path, self._dir_name, self._dir_path)
+        return '|'.join(rx.pattern if rx else '' for rx in rxs) + f'|{self.case_sensitive}|{self.ignore_dir_events}'
+
+# ============================================================= #
+
+class MatchingEventHandler(FileSystemEventHandler):
+    """Event handler dispatching only the events accepted by a PathMatcher."""
+
+    def __init__(self, matcher: PathMatcher):
+        super().__init__()
+        self.matcher = matcher
+
+    def dispatch(self, event):
+        if self.matcher.match_event(event):
+            super().dispatch(event)
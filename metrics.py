@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import time, bisect, threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from globals import CONFIG
+import utils
+
+# ============================================================= #
+
+DEFAULT_METRICS = {'host': '127.0.0.1', 'port': 0, 'dump': {'interval': 0, 'unit': 'm'}}
+# upper bounds of the histogram buckets: durations (seconds) and sizes (bytes)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2**i for i in range(10, 28, 2))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# ============================================================= #
+
+class Metric:
+    """A metric family: one value per combination of label values."""
+
+    kind = ''
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def export(self):
+        """Copy of the local values (e.g. to be sent to another process)."""
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def items(self):
+        """(label values, value) pairs: the local values combined with those merged from other processes."""
+        values = self.export()
+        for state in _remote_states(self.name):
+            for key, value in state.items():
+                values[key] = self._combine(values[key], value) if key in values else self._copy(value)
+        return list(values.items())
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _combine(value, other):
+        return value + other
+
+    def _key(self, labels):
+        return tuple(str(labels.get(l, '')) for l in self.labels)
+
+    def _label_str(self, key, extra=''):
+        pairs = [f'{l}="{_escape(v)}"' for l, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self):
+        """Yields the lines of the metric in Prometheus text format."""
+        yield f'# HELP {self.name} {self.doc}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for key, value in self.items():
+            yield f'{self.name}{self._label_str(key)} {value:g}'
+
+    def summary(self):
+        """Short text of the values for the log dump."""
+        return ', '.join(f'{self._label_str(key) or "total"} = {value:g}' for key, value in self.items())
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    @staticmethod
+    def _combine(value, other):
+        return other
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count per label values (plus the max for the log dump)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            item = self._values.get(key, None)
+            if item is None:
+                # [bucket counts..., +Inf], sum, max
+                item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0.0]
+            item[0][bisect.bisect_left(self.buckets, value)] += 1
+            item[1] += value
+            item[2] = max(item[2], value)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def _combine(value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], max(value[2], other[2])]
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        yield f'# HELP {self.name} {self.doc}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for key, (counts, total, _) in self.items():
+            n = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                n += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{self._label_str(key, le)} {n}'
+            yield f'{self.name}_sum{self._label_str(key)} {total:g}'
+            yield f'{self.name}_count{self._label_str(key)} {n}'
+
+    def summary(self):
+        items = [(key, sum(counts), total, top) for key, (counts, total, top) in self.items()]
+        return ', '.join(f'{self._label_str(key) or "total"} = {n} (avg {total / n:.3g} / max {top:.3g})'
+                         for key, n, total, top in items if n)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# ============================================================= #
+
+# polling
+SCAN_SECONDS = Histogram('watcher_scan_seconds', 'Duration of the polling scans per watched root.', ('root',))
+SCAN_FILES = Counter('watcher_scan_files_total', 'Entries (files and directories) visited by the polling scans.', ('root',))
+SCAN_OVERRUNS = Counter('watcher_scan_overruns_total', 'Polling scans that took longer than the poll interval.', ('root',))
+POLL_INTERVAL = Gauge('watcher_poll_interval_seconds', 'Current poll interval per watched root.', ('root',))
+# events
+EVENTS = Counter('watcher_events_total', 'Filesystem events received from the observers per type.', ('root', 'type'))
+DUPLICATES = Counter('watcher_events_duplicate_total', 'Duplicate events dropped.', ('root',))
+# handlers
+EMIT_SECONDS = Histogram('watcher_handler_emit_seconds', 'Duration of the handler messages (sending included).', ('root', 'handler'))
+EMIT_FAILURES = Counter('watcher_handler_failures_total', 'Handler messages that failed.', ('root', 'handler'))
+DISPATCH_WAIT = Histogram('watcher_dispatch_wait_seconds', 'Time the messages wait in the dispatch queues.', ('root', 'handler'))
+LOG_EMIT_BYTES = Histogram('watcher_log_emit_bytes', 'Size of the log regions emitted by the handlers.', ('root', 'handler'), SIZE_BUCKETS)
+# email
+SMTP_CONNECT_SECONDS = Histogram('watcher_smtp_connect_seconds', 'Duration of the SMTP connections (login included).', ('server',))
+SMTP_SEND_SECONDS = Histogram('watcher_smtp_send_seconds', 'Duration of email sending (connection included).', ('server',))
+SMTP_FAILURES = Counter('watcher_smtp_failures_total', 'Emails that failed to be sent.', ('server',))
+# journal
+JOURNAL_EVENTS = Counter('watcher_journal_events_total', 'Events written to the journal.')
+JOURNAL_COMMIT_SECONDS = Histogram('watcher_journal_commit_seconds', 'Duration of the journal group commits.')
+REDELIVERIES = Counter('watcher_handler_redeliveries_total', 'Messages resent from the journal after a failure or restart.', ('root', 'handler'))
+RATE_LIMITED = Counter('watcher_handler_rate_limited_total', 'Events collected into storm summaries beyond the handler rate.', ('root', 'handler'))
+# event bus
+BUS_SUBSCRIBERS = Gauge('watcher_bus_subscribers', 'Subscribers connected to the event bus.')
+BUS_RECORDS = Counter('watcher_bus_frames_total', 'Frames written to the event bus subscribers.')
+BUS_DROPPED = Counter('watcher_bus_dropped_total', 'Event records dropped from the buffers of slow bus subscribers.')
+
+METRICS = (SCAN_SECONDS, SCAN_FILES, SCAN_OVERRUNS, POLL_INTERVAL, EVENTS, DUPLICATES, EMIT_SECONDS, EMIT_FAILURES,
+           DISPATCH_WAIT, LOG_EMIT_BYTES, SMTP_CONNECT_SECONDS, SMTP_SEND_SECONDS, SMTP_FAILURES,
+           JOURNAL_EVENTS, JOURNAL_COMMIT_SECONDS, REDELIVERIES, RATE_LIMITED,
+           BUS_SUBSCRIBERS, BUS_RECORDS, BUS_DROPPED)
+
+# metric values exported by other processes (worker processes): source -> {metric name: values}
+_REMOTE = {}
+_REMOTE_LOCK = threading.Lock()
+
+def _remote_states(name):
+    with _REMOTE_LOCK:
+        return [state[name] for state in _REMOTE.values() if name in state]
+
+def export():
+    """Local values of all metrics (see `merge`)."""
+    return {m.name: m.export() for m in METRICS}
+
+def merge(source, state):
+    """Includes (replaces) the values exported by another process `source` in the reported values."""
+    with _REMOTE_LOCK:
+        _REMOTE[source] = state
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    return '\n'.join(line for m in METRICS for line in m.samples()) + '\n'
+
+def dump():
+    """Logs the current values of the metrics that have any."""
+    for m in METRICS:
+        text = m.summary()
+        if text:
+            utils.log(f'Metrics: {m.name}: {text}')
+
+# ============================================================= #
+
+@lru_cache(maxsize=None)
+def _request_handler():
+    # http.server is only imported if the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsRequestHandler
+
+class MetricsServer:
+    """HTTP endpoint serving the metrics (GET /metrics) on a background thread."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        from http.server import ThreadingHTTPServer
+        self._server = ThreadingHTTPServer((host, port), _request_handler())
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        utils.log(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# ============================================================= #
+
+_SERVER = None
+_JOBS = []
+
+def start(scheduler=None):
+    """Starts the endpoint and the periodic log dump (with `scheduler`) if configured."""
+    global _SERVER
+    cfg = dict(DEFAULT_METRICS, **(CONFIG.get('metrics', None) or {}))
+    if cfg['port'] and _SERVER is None:
+        try:
+            _SERVER = MetricsServer(cfg['host'] or DEFAULT_METRICS['host'], cfg['port']).start()
+        except OSError as err:
+            utils.log(f'Failed to start metrics endpoint: {err}', how='error')
+    dump_cfg = cfg['dump'] or {}
+    if scheduler and dump_cfg.get('interval', 0) > 0:
+        _JOBS.append(scheduler.every(utils.span_to_seconds(dump_cfg['interval'], dump_cfg.get('unit', 'm')), dump, name='metrics dump'))
+
+def stop():
+    global _SERVER
+    while _JOBS:
+        _JOBS.pop().cancel()
+    if _SERVER:
+        _SERVER.stop()
+        _SERVER = None
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import smtplib
 import socks
-import re, os
+import re, os, socket, time, hashlib, threading
 from urllib.request import getproxies
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -9,10 +9,21 @@ from email.mime.application import MIMEApplication
 
 from globals import CONFIG
 import utils
+import metrics
+# ============================================================= #
+
+SMTP_TIMEOUT = 60
+DEFAULT_SMTP_POOL = {'keepalive': 60, 'max_idle': 300, 'max_sessions': 2}
+# errors meaning that a pooled session has gone stale
+SMTP_STALE_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, socket.timeout)
+
 # ============================================================= #
 
 class Proxifier:
 
+    # proxy settings resolved once (see get_proxifier)
+    _cached = ()
+
     def __init__(self, proxy_server=None, proxy_port=None, proxy_type='HTTP', proxy_username=None, proxy_password=None):
         self.proxy_type = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}.get(proxy_type, socks.HTTP)
         self.proxy_username = proxy_username
@@ -56,19 +67,29 @@ class Proxifier:
                                        proxy_type=self.proxy_type, proxy_addr=self.proxy_server, proxy_port=self.proxy_port,
                                        proxy_username=self.proxy_username, proxy_password=self.proxy_password)
 
+    @property
+    def key(self):
+        return (self.proxy_type, self.proxy_server, self.proxy_port, self.proxy_username)
+
     @staticmethod
-    def get_proxifier():
+    def get_proxifier(refresh=False):
+        """Returns the configured proxifier (or None), resolving the (system) proxy settings only once."""
+        if Proxifier._cached and not refresh:
+            return Proxifier._cached[0]
         proxy = CONFIG.get('proxy', None)
         if not proxy or not proxy.get('useproxy', False):
-            return None
-        return Proxifier(proxy.get('server', None), proxy.get('port', None), proxy.get('type', None),
-                         proxy.get('username', None), proxy.get('password', None))
+            proxifier = None
+        else:
+            proxifier = Proxifier(proxy.get('server', None), proxy.get('port', None), proxy.get('type', None),
+                                  proxy.get('username', None), proxy.get('password', None))
+        Proxifier._cached = (proxifier,)
+        return proxifier
 
 # ============================================================= #
 
 class SMTP_Proxy(smtplib.SMTP):
 
-    def __init__(self, host='', port=0, local_hostname=None, timeout=object(), source_address=None,
+    def __init__(self, host='', port=0, local_hostname=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None,
                  proxifier: Proxifier=None):
         self._proxifier = proxifier
         super().__init__(host, port, local_hostname, timeout, source_address)
@@ -86,10 +107,10 @@ class SMTP_Proxy(smtplib.SMTP):
 
 class SMTP_SSL_Proxy(smtplib.SMTP_SSL):
 
-    def __init__(self, host='', port=0, local_hostname=None, keyfile=None, certfile=None, timeout=object(), source_address=None, context=None,
+    def __init__(self, host='', port=0, local_hostname=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, context=None,
                  proxifier: Proxifier=None):
         self._proxifier = proxifier
-        super().__init__(host, port, local_hostname, keyfile, certfile, timeout, source_address, context)
+        super().__init__(host, port, local_hostname, timeout=timeout, source_address=source_address, context=context)
 
     def _get_socket(self, host, port, timeout):
         if not self._proxifier:
@@ -103,9 +124,187 @@ class SMTP_SSL_Proxy(smtplib.SMTP_SSL):
 
 # ============================================================= #
 
-def send_email(body, subject, sender, receivers, smtp, sender_name='Watcher', attachments=None):
-    is_ssl = smtp['protocol'].upper() == 'SSL'
-    smtp_class = SMTP_SSL_Proxy if is_ssl else SMTP_Proxy
+class SMTPSession:
+    """
+    Authenticated SMTP connection reused for many messages.
+    Reconnects (once per message) if the server has dropped the connection.
+    """
+
+    def __init__(self, smtp, proxifier: Proxifier=None):
+        self.smtp = smtp
+        self.proxifier = proxifier
+        self.conn = None
+        self.last_used = time.monotonic()
+
+    def connect(self):
+        self.close()
+        protocol = self.smtp['protocol'].upper()
+        smtp_class = SMTP_SSL_Proxy if protocol == 'SSL' else SMTP_Proxy
+        started = time.perf_counter()
+        conn = smtp_class(self.smtp['server'], self.smtp['port'], timeout=SMTP_TIMEOUT, proxifier=self.proxifier)
+        try:
+            if not protocol in ('SSL', 'PLAIN'):
+                conn.starttls()
+            # PLAIN = unencrypted connection (e.g. to a local relay), login is optional
+            if protocol != 'PLAIN' or self.smtp.get('login', None):
+                conn.login(self.smtp['login'], self.smtp['password'])
+        except:
+            conn.close()
+            raise
+        metrics.SMTP_CONNECT_SECONDS.observe(time.perf_counter() - started, server=_server_label(self.smtp))
+        self.conn = conn
+        utils.log(f"SMTP session opened to {self.smtp['server']}:{self.smtp['port']}", how='debug')
+
+    def close(self):
+        if self.conn is None: return
+        try:
+            self.conn.quit()
+        except Exception:
+            self.conn.close()
+        self.conn = None
+
+    def noop(self):
+        """Keeps the session alive, returns False if it is dead."""
+        if self.conn is None: return False
+        try:
+            return self.conn.noop()[0] == 250
+        except Exception:
+            self.close()
+            return False
+
+    def sendmail(self, sender, receivers, msg):
+        if self.conn is None:
+            self.connect()
+        try:
+            self.conn.sendmail(sender, receivers, msg)
+        except SMTP_STALE_ERRORS:
+            self.connect()
+            self.conn.sendmail(sender, receivers, msg)
+        self.last_used = time.monotonic()
+
+# ============================================================= #
+
+class SMTPPool:
+    """
+    Pool of SMTP sessions keyed on (server, port, protocol, login, password hash, proxy):
+    handlers with other credentials (or changed ones) get sessions of their own.
+    Up to `max_sessions` sessions per key are used concurrently;
+    idle sessions are kept alive with NOOP every `keepalive` seconds
+    and closed after `max_idle` seconds without messages.
+    """
+
+    def __init__(self, keepalive=60, max_idle=300, max_sessions=2):
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self.max_sessions = max(1, max_sessions)
+        # key -> idle sessions
+        self._idle = {}
+        # key -> number of sessions in use
+        self._busy = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _key(smtp, proxifier):
+        # the password itself is not kept in the key
+        password = hashlib.sha256(str(smtp.get('password', None) or '').encode('utf-8')).hexdigest()
+        return (smtp['server'], smtp['port'], smtp.get('protocol', '').upper(), smtp.get('login', None), password,
+                proxifier.key if proxifier else None)
+
+    def _acquire(self, key, smtp, proxifier):
+        with self._lock:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    session = idle.pop()
+                    break
+                if self._busy.get(key, 0) < self.max_sessions:
+                    session = SMTPSession(smtp, proxifier)
+                    break
+                self._released.wait()
+            self._busy[key] = self._busy.get(key, 0) + 1
+        if not self._thread and self.keepalive > 0:
+            self._start_keepalive()
+        return session
+
+    def _release(self, key, session):
+        with self._lock:
+            self._busy[key] -= 1
+            if not session.conn is None:
+                self._idle.setdefault(key, []).append(session)
+            self._released.notify()
+
+    def send(self, smtp, sender, receivers, msg, proxifier: Proxifier=None):
+        key = self._key(smtp, proxifier)
+        session = self._acquire(key, smtp, proxifier)
+        try:
+            session.sendmail(sender, receivers, msg)
+        except:
+            session.close()
+            raise
+        finally:
+            self._release(key, session)
+
+    def _start_keepalive(self):
+        with self._lock:
+            if self._thread: return
+            self._thread = threading.Thread(target=self._keepalive_loop, name='smtp-keepalive', daemon=True)
+            self._thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stopped.wait(self.keepalive):
+            self.check_idle()
+
+    def check_idle(self):
+        """Pings idle sessions and closes expired ones."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = [(key, s) for key, idle in self._idle.items() for s in idle]
+            self._idle = {}
+            for key, _ in sessions:
+                self._busy[key] = self._busy.get(key, 0) + 1
+        for key, session in sessions:
+            if now - session.last_used >= self.max_idle:
+                session.close()
+            elif now - session.last_used >= self.keepalive:
+                session.noop()
+            self._release(key, session)
+
+    def close(self):
+        self._stopped.set()
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle = {}
+        for session in sessions:
+            session.close()
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_smtp_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            cfg = dict(DEFAULT_SMTP_POOL, **(CONFIG.get('smtp_pool', None) or {}))
+            _POOL = SMTPPool(cfg['keepalive'], cfg['max_idle'], cfg['max_sessions'])
+    return _POOL
+
+def close_smtp_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None: return
+        _POOL.close()
+        _POOL = None
+
+# ============================================================= #
+
+def _server_label(smtp):
+    return f"{smtp.get('server', '')}:{smtp.get('port', '')}"
+
+def send_email(body, subject, sender, receivers, smtp, sender_name='Watcher', attachments=None, raise_errors=False):
+    """Sends an email; errors are logged or (`raise_errors`) raised to the caller."""
     try:
         msg = MIMEMultipart()
         msg['Subject'] = subject
@@ -124,19 +323,20 @@ def send_email(body, subject, sender, receivers, smtp, sender_name='Watcher', at
                 except:
                     continue
 
-        with smtp_class(smtp['server'], smtp['port'], proxifier=Proxifier.get_proxifier()) as emailer:
-            emailer.login(smtp['login'], smtp['password'])
-            if not is_ssl:
-                emailer.starttls()
-            emailer.sendmail(sender, receivers, msg.as_string())
+        with metrics.SMTP_SEND_SECONDS.time(server=_server_label(smtp)):
+            get_smtp_pool().send(smtp, sender, receivers, msg.as_string(), Proxifier.get_proxifier())
 
         utils.log(f"Email sent to: {msg['Bcc']}", how='debug')
 
     except smtplib.SMTPException as smtp_err:
+        metrics.SMTP_FAILURES.inc(server=_server_label(smtp))
+        if raise_errors: raise
         utils.log(f'SMTP ERROR: {str(smtp_err)}', how='exception')
 
     # except:
     #     traceback.print_exc()
 
     except Exception as err:
+        metrics.SMTP_FAILURES.inc(server=_server_label(smtp))
+        if raise_errors: raise
         utils.log(err, how='exception')
\ No newline at end of file
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+import sys, errno, time, threading
+from collections import OrderedDict
+from functools import partial
+from watchdog.observers.api import BaseObserver, DEFAULT_EMITTER_TIMEOUT
+from watchdog.observers.polling import PollingEmitter
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent,
+                             FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent)
+
+from globals import CONFIG, DEFAULT_POLL_SECONDS
+import utils
+import metrics
+from snapshot import CompactSnapshot, SnapshotDiff, SnapshotStore
+from scanner import TreeScanner, DEFAULT_SCAN_WORKERS
+from scheduler import Scheduler
+
+# ============================================================= #
+
+BACKENDS = ('auto', 'inotify', 'polling')
+# errors raised by inotify when the kernel limits are exhausted (max_user_watches / max_user_instances)
+WATCH_LIMIT_ERRORS = (errno.ENOSPC, errno.EMFILE)
+# default dedupe window (seconds) of the native backend (polling diffs report every change once)
+DEFAULT_DEDUPE_SECONDS = 1.0
+# shortest allowed poll interval (seconds)
+MIN_POLL_SECONDS = 0.1
+# an adaptive poll interval grows by this factor after every quiet poll
+POLL_BACKOFF = 2.0
+# interval (seconds) between polling statistics log records
+SCAN_STATS_INTERVAL = 300
+# a poll timed by the scheduler is made anyway after this many poll intervals (busy scheduler)
+POLL_FALLBACK_FACTOR = 3
+
+# ============================================================= #
+
+def native_observer_class():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        from watchdog.observers.inotify import InotifyObserver
+        return InotifyObserver
+    except Exception:
+        return None
+
+_native_emitter = None
+
+def native_emitter_class():
+    """The inotify emitter reporting the watch limits reached at runtime (None if unavailable)."""
+    global _native_emitter
+    if _native_emitter is None and native_observer_class():
+        from watchdog.observers.inotify import InotifyEmitter
+        _native_emitter = type('NativeEmitter', (WatchLimitMixin, InotifyEmitter), {})
+    return _native_emitter
+
+def resolve_backend(backend=None):
+    backend = (backend or CONFIG.get('backend', 'auto') or 'auto').lower()
+    if not backend in BACKENDS:
+        raise Exception(f'Wrong observer backend: {backend}!')
+    if backend == 'auto':
+        backend = 'inotify' if native_observer_class() else 'polling'
+    return backend
+
+def dedupe_seconds(value, backend):
+    """The dedupe window of a root: the `value` set or, by default, DEFAULT_DEDUPE_SECONDS with the native backend only."""
+    if value is None:
+        return DEFAULT_DEDUPE_SECONDS if backend == 'inotify' else 0
+    return float(value)
+
+def poll_bounds(value=None):
+    """
+    Parses a poll interval setting: either a number of seconds (fixed interval)
+    or a dict {min: seconds, max: seconds} (adaptive interval).
+    Returns a tuple (min, max); defaults to the global 'poll_interval'.
+    """
+    if value is None:
+        value = CONFIG.get('poll_interval', DEFAULT_POLL_SECONDS)
+    if isinstance(value, dict):
+        lo = float(value.get('min', DEFAULT_POLL_SECONDS))
+        hi = float(value.get('max', lo))
+    else:
+        lo = hi = float(value)
+    lo = max(MIN_POLL_SECONDS, lo)
+    return (lo, max(lo, hi))
+
+def start_observer(handler, path, recursive=True, backend='auto', timeout=DEFAULT_POLL_SECONDS, store=None,
+                   scan_workers=DEFAULT_SCAN_WORKERS, matcher=None, structure_only=False, max_timeout=None, scheduler=None):
+    """
+    Creates, schedules and starts an observer for a single root.
+    Returns a tuple (observer, backend). If the native backend cannot
+    watch the root because of kernel watch limits, falls back to polling
+    (at once, or later with the watches of new directories, see NativeObserver).
+    `store` (SnapshotStore) is used by the polling backend to persist snapshots,
+    `scan_workers` is the number of threads the polling backend scans the tree with,
+    `matcher` (PathMatcher) lets the polling backend prune ignored paths while scanning,
+    `structure_only` makes the polling backend track created / deleted / moved paths only
+    (files are not stat'ed and modifications are not reported).
+    `timeout` is the polling interval; if `max_timeout` is greater, the interval adapts
+    to the activity of the root between the two (see SnapshotEmitter).
+    `scheduler` (Scheduler) times the polls and snapshot checkpoints of the polling backend.
+    """
+    backend = resolve_backend(backend)
+    polling = partial(SnapshotEmitter, timeout=timeout, store=store, checkpoint=checkpoint_seconds(), scan_workers=scan_workers,
+                      matcher=matcher, structure_only=structure_only, max_timeout=max_timeout, scheduler=scheduler)
+    if backend == 'inotify':
+        cls_ = native_emitter_class()
+        if not cls_:
+            utils.log(f'Native observer is unavailable on {sys.platform}, falling back to polling', how='warning', watched_path=path)
+        else:
+            observer = NativeObserver(cls_, polling, timeout=1)
+            # start first so that watch limit errors are raised right here in schedule()
+            observer.start()
+            try:
+                observer.schedule(handler, path, recursive=recursive)
+                return (observer, backend)
+            except OSError as err:
+                stop_observer(observer)
+                if not err.errno in WATCH_LIMIT_ERRORS:
+                    raise
+                utils.log(f'Inotify limit reached ({err}), falling back to polling', how='warning', watched_path=path)
+    observer = SnapshotObserver(store, checkpoint_seconds(), scan_workers, matcher, structure_only, max_timeout, scheduler,
+                                timeout=timeout)
+    observer.schedule(handler, path, recursive=recursive)
+    observer.start()
+    return (observer, 'polling')
+
+def stop_observer(observer):
+    try:
+        observer.stop()
+        observer.join()
+    except RuntimeError:
+        pass
+
+def checkpoint_seconds():
+    cfg = (CONFIG.get('snapshots', None) or {}).get('checkpoint', None) or {'interval': 5, 'unit': 'm'}
+    return utils.span_to_seconds(cfg['interval'], cfg['unit'])
+
+# ============================================================= #
+
+class SnapshotEmitter(PollingEmitter):
+    """
+    Polling emitter that can resume from a persisted snapshot (so that
+    changes made while the watcher was down are reported on the first poll)
+    and checkpoints its snapshot to the store every `checkpoint` seconds.
+
+    The root is polled every `timeout` seconds. If `max_timeout` is greater, the interval
+    is adaptive: it drops back to `timeout` whenever a poll finds changes and grows
+    by POLL_BACKOFF after every quiet poll up to `max_timeout`.
+    Scan times are logged every SCAN_STATS_INTERVAL seconds.
+
+    If a `scheduler` is given, polls and checkpoints are timed by its jobs
+    (the emitter thread sleeps until its next poll is due, or POLL_FALLBACK_FACTOR
+    poll intervals at most), otherwise the emitter thread keeps its own time.
+    """
+
+    def __init__(self, event_queue, watch, timeout=DEFAULT_EMITTER_TIMEOUT, store: SnapshotStore=None, checkpoint=0,
+                 scan_workers=DEFAULT_SCAN_WORKERS, matcher=None, structure_only=False, max_timeout=None,
+                 scheduler: Scheduler=None, **kwargs):
+        super().__init__(event_queue, watch, timeout=timeout, **kwargs)
+        self._scheduler = scheduler
+        self._poll_due = threading.Event()
+        self._poll_job = None
+        self._checkpoint_job = None
+        self._checkpoint_due = False
+        self._min_interval = timeout
+        self._max_interval = max(timeout, max_timeout or timeout)
+        self._interval = timeout
+        self._store = store
+        self._checkpoint = checkpoint
+        self._last_checkpoint = time.monotonic()
+        self._dirty = False
+        self._scanner = TreeScanner(scan_workers, matcher, structure_only)
+        self._snapshot = None
+        self._take_snapshot = lambda: CompactSnapshot.take(self.watch.path, self.watch.is_recursive, self._scanner, self._snapshot)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats_time = time.monotonic()
+        self._scans = 0
+        self._scan_total = 0.0
+        self._scan_max = 0.0
+        self._events = 0
+
+    @property
+    def interval(self):
+        """Current poll interval (seconds)."""
+        return self._interval
+
+    def on_thread_start(self):
+        snapshot = self._store.load() if self._store else None
+        if snapshot is None:
+            self._snapshot = self._take_snapshot()
+            self._dirty = True
+        else:
+            # the first poll will diff against the stored snapshot
+            utils.log(f'Loaded snapshot with {len(snapshot)} entries from "{self._store.filename}"', how='debug', watched_path=self.watch.path)
+            self._snapshot = snapshot
+        if self._scheduler:
+            self._schedule_poll()
+            if self._store and self._checkpoint > 0:
+                self._checkpoint_job = self._scheduler.every(self._checkpoint, self.checkpoint, name=f'checkpoint {self.watch.path}',
+                                                              background=True)
+
+    def on_thread_stop(self):
+        for job in (self._poll_job, self._checkpoint_job):
+            if job: job.cancel()
+        # wake up the emitter thread waiting for its next poll
+        self._poll_due.set()
+        with self._lock:
+            self.save_snapshot()
+            self._scanner.shutdown()
+
+    def _schedule_poll(self):
+        if self._poll_job:
+            # still pending if the poll was not started by the scheduler
+            self._poll_job.cancel()
+        self._poll_job = self._scheduler.call_later(self._interval, self._poll_due.set, name=f'poll {self.watch.path}')
+
+    def checkpoint(self):
+        """Saves the snapshot unless a poll is in progress (the poll saves it when done)."""
+        if not self._lock.acquire(blocking=False):
+            self._checkpoint_due = True
+            return
+        try:
+            self.save_snapshot()
+        finally:
+            self._lock.release()
+
+    def save_snapshot(self, force=True):
+        if not self._store or not self._dirty: return
+        if not force and time.monotonic() - self._last_checkpoint < self._checkpoint: return
+        try:
+            self._store.save(self._snapshot)
+            self._dirty = False
+            utils.log(f'Snapshot saved to "{self._store.filename}"', how='debug', watched_path=self.watch.path)
+        except Exception as err:
+            utils.log(f'Failed to save snapshot: {err}', how='exception', watched_path=self.watch.path)
+        self._last_checkpoint = time.monotonic()
+
+    def queue_events(self, timeout):
+        if self._scheduler:
+            # the emitter does not wait for a late scheduler forever
+            self._poll_due.wait(self._interval * POLL_FALLBACK_FACTOR)
+            self._poll_due.clear()
+            if self.stopped_event.is_set():
+                return
+        # the emitter's own (adaptive) interval replaces the fixed timeout
+        elif self.stopped_event.wait(self._interval):
+            return
+
+        try:
+            self._poll()
+        finally:
+            if self._scheduler and not self.stopped_event.is_set():
+                self._schedule_poll()
+
+    def _poll(self):
+        with self._lock:
+            if not self.should_keep_running():
+                return
+            started = time.monotonic()
+            try:
+                new_snapshot = self._take_snapshot()
+            except OSError:
+                self.queue_event(DirDeletedEvent(self.watch.path))
+                self.stop()
+                return
+
+            diff = SnapshotDiff(self._snapshot, new_snapshot)
+            self._snapshot = new_snapshot
+            n = self._queue_diff(diff)
+            if n:
+                self._dirty = True
+            self._adapt(n)
+            self._log_stats(time.monotonic() - started, n)
+            if not self._scheduler:
+                self.save_snapshot(False)
+            elif self._checkpoint_due:
+                self._checkpoint_due = False
+                self.save_snapshot()
+
+    def _adapt(self, n):
+        if self._max_interval <= self._min_interval:
+            return
+        if n:
+            self._interval = self._min_interval
+        else:
+            self._interval = min(self._max_interval, self._interval * POLL_BACKOFF)
+
+    def _log_stats(self, elapsed, n):
+        root = self.watch.path
+        metrics.SCAN_SECONDS.observe(elapsed, root=root)
+        metrics.SCAN_FILES.inc(len(self._snapshot), root=root)
+        metrics.POLL_INTERVAL.set(self._interval, root=root)
+        if elapsed > self._min_interval:
+            metrics.SCAN_OVERRUNS.inc(root=root)
+        self._scans += 1
+        self._scan_total += elapsed
+        self._scan_max = max(self._scan_max, elapsed)
+        self._events += n
+        if time.monotonic() - self._stats_time < SCAN_STATS_INTERVAL:
+            return
+        utils.log(f'Polling: {self._scans} scans of {len(self._snapshot)} entries, scan time avg {self._scan_total / self._scans:.3f} s / '
+                  f'max {self._scan_max:.3f} s, {self._events} events, interval {self._interval:g} s '
+                  f'(min {self._min_interval:g} s, max {self._max_interval:g} s)', watched_path=self.watch.path)
+        self._reset_stats()
+
+    def _queue_diff(self, diff):
+        n = 0
+        for src_path in diff.files_deleted:
+            self.queue_event(FileDeletedEvent(src_path)); n += 1
+        for src_path in diff.files_modified:
+            self.queue_event(FileModifiedEvent(src_path)); n += 1
+        for src_path in diff.files_created:
+            self.queue_event(FileCreatedEvent(src_path)); n += 1
+        for src_path, dest_path in diff.files_moved:
+            self.queue_event(FileMovedEvent(src_path, dest_path)); n += 1
+        for src_path in diff.dirs_deleted:
+            self.queue_event(DirDeletedEvent(src_path)); n += 1
+        for src_path in diff.dirs_modified:
+            self.queue_event(DirModifiedEvent(src_path)); n += 1
+        for src_path in diff.dirs_created:
+            self.queue_event(DirCreatedEvent(src_path)); n += 1
+        for src_path, dest_path in diff.dirs_moved:
+            self.queue_event(DirMovedEvent(src_path, dest_path)); n += 1
+        return n
+
+# ============================================================= #
+
+class SnapshotObserver(BaseObserver):
+
+    def __init__(self, store=None, checkpoint=0, scan_workers=DEFAULT_SCAN_WORKERS, matcher=None, structure_only=False,
+                 max_timeout=None, scheduler=None, timeout=DEFAULT_POLL_SECONDS):
+        super().__init__(partial(SnapshotEmitter, store=store, checkpoint=checkpoint, scan_workers=scan_workers, matcher=matcher,
+                                 structure_only=structure_only, max_timeout=max_timeout, scheduler=scheduler),
+                         timeout=timeout)
+
+# ============================================================= #
+
+class WatchLimitMixin:
+    """
+    Mixin of the native emitter: watchdog ignores the errors of the watches added for the directories
+    created under the root, so a kernel watch limit reached then would leave them unwatched.
+    Such errors are recorded and reported to `on_limit` (emitter, error) by the emitter thread.
+    """
+
+    on_limit = None
+
+    def on_thread_start(self):
+        super().on_thread_start()
+        self.limit_error = None
+        inotify = getattr(getattr(self, '_inotify', None), '_inotify', None)
+        if inotify is None: return
+        add_watch = inotify._add_watch
+
+        def _add_watch(path, mask):
+            try:
+                return add_watch(path, mask)
+            except OSError as err:
+                if err.errno in WATCH_LIMIT_ERRORS:
+                    self.limit_error = err
+                raise
+
+        inotify._add_watch = _add_watch
+
+    def queue_events(self, timeout, **kwargs):
+        super().queue_events(timeout, **kwargs)
+        if self.limit_error and self.on_limit and self.should_keep_running():
+            self.on_limit(self, self.limit_error)
+
+class NativeObserver(BaseObserver):
+    """
+    Native (inotify) observer switching a watch to the `fallback` (polling) emitter
+    when the kernel watch limits are reached while watching its new directories.
+    """
+
+    def __init__(self, emitter_class, fallback, timeout=1):
+        super().__init__(emitter_class, timeout=timeout)
+        self._fallback = fallback
+        self.backend = 'inotify'
+
+    def _add_emitter(self, emitter):
+        emitter.on_limit = self._switch_to_polling
+        super()._add_emitter(emitter)
+
+    def _switch_to_polling(self, emitter, err):
+        with self._lock:
+            if self._emitter_for_watch.get(emitter.watch, None) is not emitter:
+                return
+            utils.log(f'Inotify limit reached ({err}), switching to polling', how='warning', watched_path=emitter.watch.path)
+            del self._emitter_for_watch[emitter.watch]
+            self._emitters.discard(emitter)
+            # called on the thread of the emitter: stopped, not joined
+            emitter.stop()
+            polling = self._fallback(self.event_queue, emitter.watch)
+            self._add_emitter(polling)
+            if self.is_alive():
+                polling.start()
+            self.backend = 'polling'
+
+# ============================================================= #
+
+class EventDeduper:
+    """
+    Drops an event repeating the last event of its path (same type, source and destination)
+    within `window` seconds: native backends emit several such events for a single change
+    (e.g. one 'modified' per written chunk). Any other event of the path ends the repetition,
+    so e.g. created -> deleted -> created is reported in full.
+    """
+
+    def __init__(self, window=DEFAULT_DEDUPE_SECONDS):
+        self.window = window
+        # path -> (key of its last event, time), oldest first
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, event):
+        if self.window <= 0:
+            return False
+        dest_path = getattr(event, 'dest_path', '')
+        key = (event.event_type, event.src_path, dest_path, event.is_directory)
+        now = time.monotonic()
+        with self._lock:
+            # purge expired records (oldest first)
+            while self._last:
+                path, (_, t) = next(iter(self._last.items()))
+                if now - t < self.window: break
+                self._last.popitem(last=False)
+            last = self._last.get(event.src_path, None)
+            if last and last[0] == key:
+                return True
+            # the event is the last one of both its paths
+            for path in ((event.src_path, dest_path) if dest_path else (event.src_path,)):
+                self._last.pop(path, None)
+                self._last[path] = (key, now)
+        return False
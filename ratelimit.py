@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import os, re, time, threading
+from collections import Counter
+
+import utils
+
+# ============================================================= #
+
+# storm summaries: sent after 'quiet' seconds without events (or every 'max' seconds), the first 'list' messages quoted
+DEFAULT_STORM = {'quiet': 10, 'list': 20, 'max': 300}
+# interval (seconds) between the checks for ended storms
+STORM_CHECK_SECONDS = 1.0
+# 'N per unit' or 'N per K units' (units as in the emit intervals), e.g. '20 per m', '100 per 10 s'
+RATE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(?:per|/)\s*(\d+(?:\.\d+)?)?\s*([smhdw])\s*$', re.I)
+EVENT_NAMES = {'cre': 'CREATED', 'mod': 'MODIFIED', 'del': 'DELETED', 'mov': 'MOVED', 'ren': 'RENAMED'}
+
+# ============================================================= #
+
+def parse_rate(rate):
+    """(number of messages, seconds) of a rate 'N per unit'."""
+    m = RATE.match(str(rate))
+    if not m or float(m.group(1)) <= 0:
+        raise Exception(f'Wrong rate: {rate}!')
+    return float(m.group(1)), utils.span_to_seconds(float(m.group(2) or 1), m.group(3).lower())
+
+class TokenBucket:
+    """Up to `capacity` messages at once, refilled at `capacity` messages per `period` seconds."""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.refill = capacity / period
+        self.tokens = capacity
+        self._last = time.monotonic()
+
+    def take(self):
+        """Returns False if the bucket is empty."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.refill)
+        self._last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+# ============================================================= #
+
+class StormLimiter:
+    """
+    Rate limit of the immediate messages of a handler. Once the token bucket is empty,
+    the events are collected (a 'storm') until no event has come for `quiet` seconds:
+    the storm is then rendered as one summary message (see `take`), e.g.
+    '4,812 DELETED events under /data/tmp in 30 s, first 20 listed:' + the first `listed` messages.
+    Storms longer than `max_seconds` are summarized every `max_seconds`.
+    """
+
+    def __init__(self, rate, watched_path='', quiet=10, listed=20, max_seconds=300):
+        self.bucket = TokenBucket(*parse_rate(rate))
+        self.watched_path = watched_path
+        self.quiet = quiet
+        self.listed = listed
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.events = Counter()
+        self._samples = []
+        self._common = None
+        self._first = self._last = 0.0
+
+    def allow(self, event, message, src_path, dest_path=''):
+        """Returns True if the message can be sent now; otherwise the event is collected into the storm."""
+        with self._lock:
+            if not self.total and self.bucket.take():
+                return True
+            now = time.monotonic()
+            if not self.total:
+                self._first = now
+            self._last = now
+            self.total += 1
+            self.events[event] += 1
+            if len(self._samples) < self.listed:
+                self._samples.append(message)
+            folder = os.path.dirname(src_path) or os.sep
+            try:
+                self._common = folder if self._common is None else os.path.commonpath([self._common, folder])
+            except ValueError:
+                # different drives
+                self._common = ''
+            return False
+
+    def take(self, force=False):
+        """The summary (event, message) of the storm if it has ended (any collected events with `force`), or None."""
+        with self._lock:
+            if not self.total:
+                return None
+            now = time.monotonic()
+            if not force and now - self._last < self.quiet and now - self._first < self.max_seconds:
+                return None
+            summary = ('sum', self._render())
+            self._reset()
+        return summary
+
+    def _render(self):
+        if len(self.events) == 1:
+            event = next(iter(self.events))
+            what = f'{self.total:,} {EVENT_NAMES.get(event, event)} events'
+        else:
+            counts = ', '.join(f'{n:,} {EVENT_NAMES.get(evt, evt)}' for evt, n in self.events.most_common())
+            what = f'{self.total:,} events ({counts})'
+        where = self.watched_path.rstrip(os.sep) + self._common if self._common.strip(os.sep) else self.watched_path
+        lines = [f'{what} under {where} in {self._last - self._first:.0f} s, first {len(self._samples)} listed:']
+        lines.extend(self._samples)
+        return '\n'.join(lines)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import os, stat, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from matcher import PathMatcher
+
+# ============================================================= #
+
+DEFAULT_SCAN_WORKERS = 1
+# directories modified less than this long ago (ns) are always listed again in structure-only mode
+# (a later change within the same mtime tick would go unnoticed otherwise)
+RECENT_MTIME_NS = 2 * 10**9
+
+# ============================================================= #
+
+def _reuse_dir(root, rel, ref, mtime_ns, recursive=True):
+    """
+    Returns (records, subdirs) of directory `rel` taken from the previous snapshot `ref`
+    if the directory has not been modified since, else None.
+    Only the subdirectories are stat'ed (to detect changes deeper in the tree).
+    """
+    if mtime_ns is None or time.time_ns() - mtime_ns < RECENT_MTIME_NS:
+        return None
+    cached = ref.dir_records(rel, mtime_ns)
+    if cached is None:
+        return None
+    path = os.path.join(root, rel) if rel else root
+    records, subdirs = [], []
+    for rec in cached:
+        if rec[4]:
+            name = rec[0]
+            try:
+                st = os.lstat(os.path.join(path, name))
+            except OSError:
+                return None
+            rec = (name, st.st_ino, st.st_size, st.st_mtime_ns, True)
+            if recursive:
+                subdirs.append((os.path.join(rel, name) if rel else name, st.st_mtime_ns))
+        records.append(rec)
+    return (records, subdirs)
+
+def scan_dir(root, rel, recursive=True, matcher: PathMatcher=None, structure_only=False, ref=None, mtime_ns=None):
+    """
+    Lists a single directory `rel` (relative to `root`).
+    Returns a tuple (rel, records, subdirs) where records is a list of
+    (name, inode, size, mtime_ns, isdir) tuples and subdirs is a list
+    of (relative path, mtime_ns) tuples of subdirectories to scan next.
+    Directories and files rejected by `matcher` are skipped without being stat'ed.
+
+    In `structure_only` mode files are not stat'ed at all (their size and mtime
+    are recorded as 0), and if the previous snapshot `ref` holds the directory
+    with the same modification time `mtime_ns`, its entries are reused instead
+    of listing the directory again.
+    """
+    if structure_only and ref is not None:
+        reused = _reuse_dir(root, rel, ref, mtime_ns, recursive)
+        if reused is not None:
+            return (rel, *reused)
+    records = []
+    subdirs = []
+    try:
+        it = os.scandir(os.path.join(root, rel) if rel else root)
+    except OSError:
+        # directory vanished or is not accessible
+        return (rel, records, subdirs)
+    with it:
+        for entry in it:
+            name = entry.name
+            sub = os.path.join(rel, name) if rel else name
+            if matcher or structure_only:
+                # the entry type usually comes from the directory listing itself (no stat)
+                try:
+                    isdir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if matcher and not (matcher.match_dir(sub, name) if isdir else matcher.match_file(sub, name)):
+                    continue
+                if structure_only and not isdir:
+                    try:
+                        records.append((name, entry.inode(), 0, 0, False))
+                    except OSError:
+                        pass
+                    continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            isdir = stat.S_ISDIR(st.st_mode)
+            records.append((name, st.st_ino, st.st_size, st.st_mtime_ns, isdir))
+            if isdir and recursive:
+                subdirs.append((sub, st.st_mtime_ns))
+    return (rel, records, subdirs)
+
+# ============================================================= #
+
+class TreeScanner:
+    """
+    Walks a directory tree with os.scandir, one task per directory.
+    With `workers` > 1 the directories are listed concurrently on a thread pool,
+    which hides the stat latency of network mounts. If `matcher` is given,
+    ignored subtrees and files are pruned during the walk.
+    With `structure_only` the scan only tracks the tree structure (names and inodes):
+    files are never stat'ed and directories unchanged since the previous scan
+    are not listed again, so a poll costs about one stat per directory.
+    """
+
+    def __init__(self, workers=DEFAULT_SCAN_WORKERS, matcher: PathMatcher=None, structure_only=False):
+        self.workers = max(1, int(workers or 1))
+        self.matcher = matcher if matcher and not matcher.is_trivial else None
+        self.structure_only = structure_only
+        self._pool = None
+
+    def scan(self, root, recursive=True, ref=None):
+        """
+        Returns the listing of `root`: a dict mapping relative directory paths
+        to lists of records (see scan_dir). The root itself is recorded
+        in the '' directory under an empty name.
+        `ref` is the previous snapshot (used in structure-only mode only).
+        Raises OSError if the root cannot be accessed.
+        """
+        st = os.lstat(root)
+        listing = {'': [('', st.st_ino, st.st_size, st.st_mtime_ns, True)]}
+        args = (recursive, self.matcher, self.structure_only, ref if self.structure_only else None)
+
+        if self.workers == 1:
+            pending = [('', st.st_mtime_ns)]
+            while pending:
+                sub, mtime_ns = pending.pop()
+                rel, records, subdirs = scan_dir(root, sub, *args, mtime_ns)
+                listing.setdefault(rel, []).extend(records)
+                pending.extend(subdirs)
+            return listing
+
+        if not self._pool:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='scanner')
+        pending = {self._pool.submit(scan_dir, root, '', *args, st.st_mtime_ns)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel, records, subdirs = future.result()
+                listing.setdefault(rel, []).extend(records)
+                for sub, mtime_ns in subdirs:
+                    pending.add(self._pool.submit(scan_dir, root, sub, *args, mtime_ns))
+        return listing
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
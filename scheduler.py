@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import time, math, heapq, itertools, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+
+# ============================================================= #
+
+# number of threads running the background jobs
+JOB_WORKERS = 4
+
+# ============================================================= #
+
+class Job:
+    """A scheduled call; periodic if `interval` > 0, run on a background thread if `background`."""
+
+    __slots__ = ('deadline', 'interval', 'func', 'args', 'name', 'background', 'running', 'cancelled')
+
+    def __init__(self, deadline, interval, func, args=(), name='', background=False):
+        self.deadline = deadline
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.name = name
+        self.background = background
+        self.running = False
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return f'Job [{self.name or self.func}] (interval = {self.interval}, cancelled = {self.cancelled})'
+
+# ============================================================= #
+
+class Scheduler:
+    """
+    Runs the periodic jobs of the watcher (interval emits, digests, snapshot checkpoints, polls)
+    from a single heap of deadlines on a monotonic clock.
+
+    `run` sleeps exactly until the next deadline (or until a job with an earlier deadline
+    is added), so an idle watcher does not wake up at all. Periodic jobs are rescheduled
+    relative to their previous deadline, so their timing does not drift; deadlines
+    missed while a job was running late are skipped rather than run in a burst.
+    Cancelled jobs are dropped lazily when they reach the top of the heap.
+
+    Jobs that may block (sends, reloads, disk writes) are scheduled with `background`:
+    they run on a pool of `workers` threads, so that they never delay the timers of the others
+    (e.g. the polls); a periodic background job still running at its next deadline skips it.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = False
+        self._thread = None
+
+    def call_later(self, delay, func, *args, name='', background=False):
+        """Schedules a single call of `func` in `delay` seconds."""
+        return self._add(Job(time.monotonic() + max(0.0, delay), 0, func, args, name, background))
+
+    def every(self, interval, func, *args, name='', first=None, background=False):
+        """
+        Schedules calls of `func` every `interval` seconds;
+        the first call is made after `first` seconds (default = `interval`).
+        """
+        if interval <= 0:
+            raise Exception(f'Wrong job interval: {interval}!')
+        delay = interval if first is None else max(0.0, first)
+        return self._add(Job(time.monotonic() + delay, interval, func, args, name, background))
+
+    def _add(self, job):
+        with self._lock:
+            heapq.heappush(self._heap, (job.deadline, next(self._seq), job))
+            # only an earlier deadline requires the sleeping thread to wake up
+            if self._heap[0][2] is job:
+                self._wakeup.notify()
+        return job
+
+    def _next_job(self):
+        # returns the next due job (waiting for it) or None if stopped
+        with self._lock:
+            while not self._stopped:
+                if not self._heap:
+                    self._wakeup.wait()
+                    continue
+                deadline, _, job = self._heap[0]
+                if job.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self._wakeup.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                return job
+            return None
+
+    def run(self):
+        """Runs the jobs on the calling thread until `stop` is called."""
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            if job.background:
+                self._submit(job)
+            else:
+                self._call(job)
+            if job.interval > 0 and not job.cancelled:
+                job.deadline += job.interval
+                now = time.monotonic()
+                if job.deadline <= now:
+                    job.deadline += (math.floor((now - job.deadline) / job.interval) + 1) * job.interval
+                self._add(job)
+
+    @staticmethod
+    def _call(job):
+        try:
+            job.func(*job.args)
+        except Exception as err:
+            utils.log(err, how='exception')
+
+    def _submit(self, job):
+        if job.running:
+            utils.log(f'{job!r} is still running, skipped', how='debug')
+            return
+        with self._lock:
+            if self._stopped: return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+            job.running = True
+            self._executor.submit(self._run_background, job)
+
+    def _run_background(self, job):
+        try:
+            self._call(job)
+        finally:
+            job.running = False
+
+    def start(self):
+        """Runs the jobs on a background thread."""
+        if self._thread: return
+        self._thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._heap.clear()
+            self._wakeup.notify_all()
+            executor, self._executor = self._executor, None
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if executor:
+            # the background jobs in progress are completed, the queued ones dropped
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def pending(self):
+        """Number of scheduled (not cancelled) jobs."""
+        with self._lock:
+            return sum(1 for _, _, job in self._heap if not job.cancelled)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+import os, sys, struct, hashlib
+from array import array
+from bisect import bisect_left
+
+from globals import CONFIG
+import utils
+from scanner import TreeScanner
+
+# ============================================================= #
+
+SNAPSHOT_MAGIC = b'WSNP'
+SNAPSHOT_VERSION = 2
+# header: magic, version, big endian flag, number of directories, number of entries
+HEADER = struct.Struct('<4sBBII')
+# name separator in the serialized name tables (cannot occur in file names)
+NAME_SEP = b'\0'
+
+# ============================================================= #
+
+class CompactSnapshot:
+    """
+    Memory-efficient directory tree snapshot.
+
+    Paths are prefix-compressed: every entry only keeps its (interned) base name,
+    the directory part is shared through a table of relative directory paths.
+    Entries are sorted by (directory, name) and grouped by directory, so that
+    `dir_start[k]:dir_start[k + 1]` is the slice of entries in directory `dirs[k]`.
+    Inodes, sizes, mtimes (ns) and directory flags are kept in parallel arrays.
+    The root itself is the first entry (directory '', name '').
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.dirs = []
+        self.dir_start = array('I', [0])
+        self.names = []
+        self.inodes = array('Q')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.flags = array('B')
+
+    @staticmethod
+    def take(root, recursive=True, scanner: TreeScanner=None, ref=None):
+        """
+        Scans `root`. `ref` is the previous snapshot, a structure-only scanner
+        reuses the entries of directories that have not changed since.
+        """
+        return CompactSnapshot.from_listing(root, (scanner or TreeScanner()).scan(root, recursive, ref))
+
+    @staticmethod
+    def from_listing(root, listing):
+        """
+        Builds a snapshot from a mapping of relative directory path ->
+        list of (name, inode, size, mtime_ns, isdir) records.
+        """
+        snap = CompactSnapshot(root)
+        intern = sys.intern
+        for rel in sorted(listing):
+            snap.dirs.append(intern(rel))
+            for name, ino, size, mtime_ns, isdir in sorted(listing[rel]):
+                snap.names.append(intern(name))
+                snap.inodes.append(ino)
+                snap.sizes.append(size)
+                snap.mtimes.append(mtime_ns)
+                snap.flags.append(isdir)
+            snap.dir_start.append(len(snap.names))
+        return snap
+
+    def _find_dir(self, rel):
+        k = bisect_left(self.dirs, rel)
+        return k if k < len(self.dirs) and self.dirs[k] == rel else -1
+
+    def dir_records(self, rel, mtime_ns):
+        """
+        Returns the records (see TreeScanner.scan) of directory `rel` if the
+        snapshot holds it with the modification time `mtime_ns`, else None.
+        """
+        k = self._find_dir(rel)
+        if k < 0:
+            return None
+        if rel:
+            # the directory's own entry is located in its parent directory
+            parent, name = os.path.split(rel)
+            p = self._find_dir(parent)
+            if p < 0:
+                return None
+            start, end = self.dir_start[p], self.dir_start[p + 1]
+            i = bisect_left(self.names, name, start, end)
+            if i == end or self.names[i] != name or not self.flags[i]:
+                return None
+        else:
+            i = 0
+        if self.mtimes[i] != mtime_ns:
+            return None
+        # the root entry (empty name) is not a record of the root directory listing
+        return [(self.names[j], self.inodes[j], self.sizes[j], self.mtimes[j], bool(self.flags[j]))
+                for j in range(self.dir_start[k], self.dir_start[k + 1]) if self.names[j]]
+
+    def fullpath(self, k, i):
+        """Full path of entry `i` located in directory `k`."""
+        rel, name = self.dirs[k], self.names[i]
+        if not name:
+            return self.root
+        return os.path.join(self.root, rel, name) if rel else os.path.join(self.root, name)
+
+    def __len__(self):
+        return len(self.names)
+
+# ============================================================= #
+
+class SnapshotDiff:
+    """
+    Difference between two CompactSnapshot objects.
+    Exposes the same properties as watchdog's DirectorySnapshotDiff.
+
+    Directories are merged by name first; in each directory present in both
+    snapshots the sorted entries are compared slice-wise (unchanged directories
+    are skipped by comparing whole array slices), then merged by name.
+    Moves are found by merging the deleted and created entries sorted by inode.
+    """
+
+    def __init__(self, ref: CompactSnapshot, snapshot: CompactSnapshot):
+        # (dir index, entry index) tuples
+        created, deleted = [], []
+        # (dir index in ref, entry index in ref, dir index in snapshot, entry index in snapshot)
+        modified = []
+
+        def add_all(snap, k, dest):
+            dest.extend((k, i) for i in range(snap.dir_start[k], snap.dir_start[k + 1]))
+
+        a, b = 0, 0
+        na, nb = len(ref.dirs), len(snapshot.dirs)
+        while a < na or b < nb:
+            da = ref.dirs[a] if a < na else None
+            db = snapshot.dirs[b] if b < nb else None
+            if db is None or (da is not None and da < db):
+                add_all(ref, a, deleted)
+                a += 1
+            elif da is None or db < da:
+                add_all(snapshot, b, created)
+                b += 1
+            else:
+                self._diff_dir(ref, a, snapshot, b, created, deleted, modified)
+                a += 1
+                b += 1
+
+        # pair deleted and created entries by inode (moves)
+        moved = []
+        dels = sorted(deleted, key=lambda e: ref.inodes[e[1]])
+        cres = sorted(created, key=lambda e: snapshot.inodes[e[1]])
+        deleted, created = [], []
+        i, j = 0, 0
+        while i < len(dels) and j < len(cres):
+            ia, ib = ref.inodes[dels[i][1]], snapshot.inodes[cres[j][1]]
+            if ia == ib:
+                moved.append((dels[i][0], dels[i][1], cres[j][0], cres[j][1]))
+                i += 1
+                j += 1
+            elif ia < ib:
+                deleted.append(dels[i])
+                i += 1
+            else:
+                created.append(cres[j])
+                j += 1
+        deleted.extend(dels[i:])
+        created.extend(cres[j:])
+
+        for ka, ia, kb, ib in moved:
+            if ref.mtimes[ia] != snapshot.mtimes[ib] or ref.sizes[ia] != snapshot.sizes[ib]:
+                modified.append((ka, ia, kb, ib))
+
+        self._dirs_created, self._files_created = self._split(snapshot, created, lambda k, i: snapshot.fullpath(k, i))
+        self._dirs_deleted, self._files_deleted = self._split(ref, deleted, lambda k, i: ref.fullpath(k, i))
+        self._dirs_modified, self._files_modified = self._split(ref, [(m[0], m[1]) for m in modified],
+                                                                lambda k, i: ref.fullpath(k, i))
+        self._dirs_moved, self._files_moved = self._split(ref, moved,
+                                                          lambda ka, ia, kb, ib: (ref.fullpath(ka, ia), snapshot.fullpath(kb, ib)))
+
+    @staticmethod
+    def _diff_dir(ref, a, snapshot, b, created, deleted, modified):
+        sa, ea = ref.dir_start[a], ref.dir_start[a + 1]
+        sb, eb = snapshot.dir_start[b], snapshot.dir_start[b + 1]
+        if ref.names[sa:ea] == snapshot.names[sb:eb]:
+            # same entries: compare the parallel arrays slice-wise first
+            if (ref.inodes[sa:ea] == snapshot.inodes[sb:eb] and ref.mtimes[sa:ea] == snapshot.mtimes[sb:eb]
+                    and ref.sizes[sa:ea] == snapshot.sizes[sb:eb]):
+                return
+        i, j = sa, sb
+        while i < ea and j < eb:
+            na, nb = ref.names[i], snapshot.names[j]
+            if na == nb:
+                if ref.inodes[i] != snapshot.inodes[j]:
+                    deleted.append((a, i))
+                    created.append((b, j))
+                elif ref.mtimes[i] != snapshot.mtimes[j] or ref.sizes[i] != snapshot.sizes[j]:
+                    modified.append((a, i, b, j))
+                i += 1
+                j += 1
+            elif na < nb:
+                deleted.append((a, i))
+                i += 1
+            else:
+                created.append((b, j))
+                j += 1
+        deleted.extend((a, x) for x in range(i, ea))
+        created.extend((b, x) for x in range(j, eb))
+
+    @staticmethod
+    def _split(snap, items, to_path):
+        # items are tuples whose first two elements locate the entry in `snap`
+        dirs, files = [], []
+        for item in items:
+            (dirs if snap.flags[item[1]] else files).append(to_path(*item))
+        return dirs, files
+
+    @property
+    def files_created(self):
+        return self._files_created
+
+    @property
+    def files_deleted(self):
+        return self._files_deleted
+
+    @property
+    def files_modified(self):
+        return self._files_modified
+
+    @property
+    def files_moved(self):
+        return self._files_moved
+
+    @property
+    def dirs_created(self):
+        return self._dirs_created
+
+    @property
+    def dirs_deleted(self):
+        return self._dirs_deleted
+
+    @property
+    def dirs_modified(self):
+        return self._dirs_modified
+
+    @property
+    def dirs_moved(self):
+        return self._dirs_moved
+
+# ============================================================= #
+
+class SnapshotStore:
+    """
+    Persists the snapshot of a watched root in a compact binary file:
+    the directory and name tables followed by the raw parallel arrays.
+    """
+
+    def __init__(self, root, store_dir=None, key=''):
+        self.root = root
+        if store_dir is None:
+            store_dir = (CONFIG.get('snapshots', None) or {}).get('dir', 'snapshots')
+        if not os.path.isabs(store_dir):
+            store_dir = utils.abspath(store_dir)
+        # the key (e.g. the path filter signature) is part of the file name, so that
+        # snapshots taken with different filters are never diffed against each other
+        uid = hashlib.sha1(f'{root}\0{key}'.encode('utf-8', 'surrogateescape')).hexdigest()
+        self.filename = os.path.join(store_dir, uid + '.snap')
+
+    @staticmethod
+    def from_config(root, key=''):
+        cfg = CONFIG.get('snapshots', None)
+        if not cfg or not cfg.get('dir', None):
+            return None
+        return SnapshotStore(root, cfg['dir'], key)
+
+    @staticmethod
+    def _read_blob(f):
+        size = struct.unpack('<Q', f.read(8))[0]
+        return f.read(size)
+
+    @staticmethod
+    def _write_blob(f, data):
+        f.write(struct.pack('<Q', len(data)))
+        f.write(data)
+
+    @staticmethod
+    def _read_array(f, typecode, count, swap):
+        arr = array(typecode)
+        arr.frombytes(f.read(count * arr.itemsize))
+        if swap: arr.byteswap()
+        return arr
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename, 'rb') as f:
+                magic, version, bigendian, ndirs, nentries = HEADER.unpack(f.read(HEADER.size))
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    utils.log(f'Incompatible snapshot file "{self.filename}", ignoring', how='warning', watched_path=self.root)
+                    return None
+                root = self._read_blob(f).decode('utf-8', 'surrogateescape')
+                if root != self.root:
+                    return None
+                snap = CompactSnapshot(root)
+                intern = sys.intern
+                snap.dirs = [intern(d.decode('utf-8', 'surrogateescape')) for d in self._read_blob(f).split(NAME_SEP)]
+                snap.names = [intern(n.decode('utf-8', 'surrogateescape')) for n in self._read_blob(f).split(NAME_SEP)]
+                swap = bigendian != (sys.byteorder == 'big')
+                snap.dir_start = self._read_array(f, 'I', ndirs + 1, swap)
+                snap.inodes = self._read_array(f, 'Q', nentries, swap)
+                snap.sizes = self._read_array(f, 'q', nentries, swap)
+                snap.mtimes = self._read_array(f, 'q', nentries, swap)
+                snap.flags = self._read_array(f, 'B', nentries, False)
+            if len(snap.dirs) != ndirs or len(snap.names) != nentries or len(snap.flags) != nentries:
+                raise Exception('Truncated snapshot file')
+            return snap
+        except Exception as err:
+            utils.log(f'Failed to load snapshot "{self.filename}": {err}', how='warning', watched_path=self.root)
+            return None
+
+    def save(self, snapshot: CompactSnapshot):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sys.byteorder == 'big', len(snapshot.dirs), len(snapshot)))
+            self._write_blob(f, self.root.encode('utf-8', 'surrogateescape'))
+            self._write_blob(f, NAME_SEP.join(d.encode('utf-8', 'surrogateescape') for d in snapshot.dirs))
+            self._write_blob(f, NAME_SEP.join(n.encode('utf-8', 'surrogateescape') for n in snapshot.names))
+            for arr in (snapshot.dir_start, snapshot.inodes, snapshot.sizes, snapshot.mtimes, snapshot.flags):
+                arr.tofile(f)
+        os.replace(tmpfile, self.filename)
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import os, sys, tempfile
+
+# the modules are imported from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not ROOT in sys.path:
+    sys.path.insert(0, ROOT)
+
+# globals.py loads the config file named on the command line (here: the pytest arguments),
+# so the modules are tested with an empty config of their own
+_CONFIG = os.path.join(tempfile.mkdtemp(prefix='watcher-tests-'), 'config.yaml')
+with open(_CONFIG, 'w', encoding='utf-8') as f:
+    f.write('watchers: []\n')
+sys.argv[1:] = [_CONFIG]
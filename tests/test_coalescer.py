@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os, time
+
+import pytest
+from watchdog.events import (DirCreatedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent)
+
+from coalescer import EventCoalescer
+
+# ============================================================= #
+
+@pytest.fixture
+def events():
+    return []
+
+@pytest.fixture
+def coalescer(events):
+    # released on flush(True) only
+    return EventCoalescer(lambda e: events.append((e.event_type, e.src_path) + ((e.dest_path,) if e.dest_path else ())), 60)
+
+def push(coalescer, *events):
+    for e in events:
+        coalescer.push(e)
+    coalescer.flush(True)
+
+# ============================================================= #
+
+def test_modifications_merged(coalescer, events):
+    push(coalescer, *[FileModifiedEvent('/data/f')] * 3)
+    assert events == [('modified', '/data/f')]
+
+def test_created_then_modified(coalescer, events):
+    push(coalescer, FileCreatedEvent('/data/f'), FileModifiedEvent('/data/f'))
+    assert events == [('created', '/data/f')]
+
+def test_created_then_deleted(coalescer, events):
+    push(coalescer, FileCreatedEvent('/data/f'), FileModifiedEvent('/data/f'), FileDeletedEvent('/data/f'))
+    assert events == []
+
+def test_deleted_then_created_is_replaced(coalescer, events):
+    push(coalescer, FileDeletedEvent('/data/f'), FileCreatedEvent('/data/f'))
+    assert events == [('modified', '/data/f')]
+
+def test_created_then_moved(coalescer, events):
+    push(coalescer, FileCreatedEvent('/data/f'), FileMovedEvent('/data/f', '/data/g'))
+    assert events == [('created', '/data/g')]
+
+def test_moves_chained_and_moved_back(coalescer, events):
+    push(coalescer, FileMovedEvent('/data/f', '/data/g'), FileMovedEvent('/data/g', '/data/h'))
+    assert events == [('moved', '/data/f', '/data/h')]
+    events.clear()
+    push(coalescer, FileMovedEvent('/data/f', '/data/g'), FileMovedEvent('/data/g', '/data/f'))
+    assert events == []
+
+def test_modified_then_moved(coalescer, events):
+    push(coalescer, FileModifiedEvent('/data/f'), FileMovedEvent('/data/f', '/data/g'))
+    assert events == [('moved', '/data/f', '/data/g'), ('modified', '/data/g')]
+
+def test_moved_then_modified(coalescer, events):
+    push(coalescer, FileMovedEvent('/data/f', '/data/g'), FileModifiedEvent('/data/g'), FileModifiedEvent('/data/g'))
+    assert events == [('moved', '/data/f', '/data/g'), ('modified', '/data/g')]
+
+def test_modified_and_moved_back(coalescer, events):
+    push(coalescer, FileMovedEvent('/data/f', '/data/g'), FileModifiedEvent('/data/g'), FileMovedEvent('/data/g', '/data/f'))
+    assert events == [('modified', '/data/f')]
+
+def test_moved_then_deleted(coalescer, events):
+    push(coalescer, FileMovedEvent('/data/f', '/data/g'), FileDeletedEvent('/data/g'))
+    assert events == [('deleted', '/data/f')]
+
+def test_deleted_and_created_with_the_same_inode(tmp_path, coalescer, events):
+    old, new = str(tmp_path / 'old'), str(tmp_path / 'new')
+    open(old, 'w').close()
+    # the inode of the path is recorded by an earlier event
+    push(coalescer, FileModifiedEvent(old))
+    events.clear()
+    os.rename(old, new)
+    push(coalescer, FileDeletedEvent(old), FileCreatedEvent(new))
+    assert events == [('moved', old, new)]
+
+def test_deleted_path_without_recorded_inode_is_not_paired(tmp_path, coalescer, events):
+    old, new = str(tmp_path / 'old'), str(tmp_path / 'new')
+    open(new, 'w').close()
+    push(coalescer, FileDeletedEvent(old), FileCreatedEvent(new))
+    assert sorted(events) == [('created', new), ('deleted', old)]
+
+def test_directories_keep_their_type():
+    released = []
+    coalescer = EventCoalescer(released.append, 60)
+    push(coalescer, DirCreatedEvent('/data/d'))
+    assert [type(e) for e in released] == [DirCreatedEvent]
+
+def test_quiet_paths_are_released(events):
+    coalescer = EventCoalescer(lambda e: events.append((e.event_type, e.src_path)), 0.05)
+    coalescer.start()
+    try:
+        coalescer.push(FileModifiedEvent('/data/f'))
+        for _ in range(200):
+            if events: break
+            time.sleep(0.01)
+        assert events == [('modified', '/data/f')]
+    finally:
+        coalescer.stop()
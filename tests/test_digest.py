@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os, csv
+
+from digest import DigestBuffer
+
+# ============================================================= #
+
+def fill(digest, n=3, event='cre', folder='/a'):
+    for i in range(n):
+        digest.add(event, f'CREATED FILE {folder}/f{i}', f'{folder}/f{i}', '')
+
+def rows(filename):
+    with open(filename, encoding='utf-8', newline='') as f:
+        return [row[1:] for row in csv.reader(f, delimiter=';')]
+
+# ============================================================= #
+
+def test_render_counts():
+    digest = DigestBuffer('/data', top=2)
+    fill(digest, 3)
+    fill(digest, 1, 'del', '/b')
+    digest.add('mod', 'MODIFIED FILE /a/f0', '/a/f0', '')
+    text = digest.render()
+    assert text.startswith('5 events in /data from ')
+    assert '  cre: 3\n  del: 1\n  mod: 1' in text
+    assert 'DIRECTORIES (top 2 of 2):\n  /a: 4\n  /b: 1' in text
+    assert 'PATHS (top 2 of 4):\n  /a/f0: 2\n' in text
+
+def test_take_starts_a_new_digest():
+    digest = DigestBuffer('/data')
+    assert digest.take() is None
+    fill(digest)
+    text, records_file = digest.take()
+    assert text.startswith('3 events') and records_file is None
+    assert digest.total == 0
+    assert digest.take() is None
+
+def test_records_spilled_and_taken(tmp_path):
+    spill = str(tmp_path / 'spill.csv')
+    digest = DigestBuffer('/data', spill_bytes=200, spill_file=spill, keep_records=True)
+    fill(digest, 5)
+    assert os.path.isfile(spill)
+    _, records_file = digest.take(str(tmp_path / 'records.csv'))
+    assert [r[1] for r in rows(records_file)] == [f'/a/f{i}' for i in range(5)]
+    assert not os.path.isfile(spill)
+
+def test_restore_merges_with_newer_events():
+    digest = DigestBuffer('/data')
+    fill(digest, 2)
+    started = digest.started
+    digest.take()
+    fill(digest, 1, 'del', '/b')
+    digest.restore()
+    assert digest.total == 3
+    assert digest.started == started
+    assert digest.events == {'cre': 2, 'del': 1}
+    assert digest.paths['/a/f1'] == 1
+    # only the last taken digest is restored, once
+    digest.restore()
+    assert digest.total == 3
+
+def test_restore_keeps_the_records_in_order(tmp_path):
+    spill = str(tmp_path / 'spill.csv')
+    digest = DigestBuffer('/data', spill_bytes=100, spill_file=spill, keep_records=True)
+    fill(digest, 3)
+    _, records_file = digest.take(str(tmp_path / 'records.csv'))
+    fill(digest, 3, folder='/b')
+    digest.restore()
+    assert not os.path.isfile(records_file)
+    _, records_file = digest.take(str(tmp_path / 'records2.csv'))
+    assert [r[1] for r in rows(records_file)] == [f'/a/f{i}' for i in range(3)] + [f'/b/f{i}' for i in range(3)]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import time, threading
+
+import pytest
+
+from dispatch import DispatchQueue
+
+# ============================================================= #
+
+class Gate:
+    """Worker function blocked until `open` is called, recording the processed messages."""
+
+    def __init__(self):
+        self.opened = threading.Event()
+        self.started = threading.Event()
+        self.messages = []
+
+    def __call__(self, event, message, src_path, dest_path, *extra):
+        self.started.set()
+        self.opened.wait(5)
+        self.messages.append(message)
+
+    def open(self):
+        self.opened.set()
+
+def busy_queue(overflow, maxsize=2):
+    # a queue whose single worker is busy with item '0'
+    gate = Gate()
+    q = DispatchQueue(gate, maxsize, 1, overflow)
+    q.put('cre', '0')
+    assert gate.started.wait(5)
+    return q, gate
+
+# ============================================================= #
+
+def test_wrong_policy():
+    with pytest.raises(Exception, match='Wrong overflow policy'):
+        DispatchQueue(print, overflow='newest')
+
+def test_processes_in_order():
+    gate = Gate()
+    gate.open()
+    q = DispatchQueue(gate, 10)
+    for i in range(5):
+        assert q.put('cre', str(i))
+    q.stop(5)
+    assert gate.messages == ['0', '1', '2', '3', '4']
+
+def test_drop_oldest():
+    q, gate = busy_queue('drop_oldest')
+    dropped = []
+    q.on_drop = lambda *item: dropped.append(item[1])
+    for i in range(1, 6):
+        assert q.put('cre', str(i), '', '', i)
+    gate.open()
+    q.stop(5)
+    assert dropped == ['1', '2', '3']
+    assert gate.messages == ['0', '4', '5']
+
+def test_collapse():
+    q, gate = busy_queue('collapse')
+    dropped = []
+    q.on_drop = lambda *item: dropped.append(item)
+    results = [q.put(event, str(i), '', '', i) for i, event in enumerate(['cre', 'cre', 'del', 'cre', 'mod'], 1)]
+    assert results == [True, True, False, False, False]
+    gate.open()
+    q.stop(5)
+    # the extra item (journal id) is passed on to on_drop
+    assert dropped == [('del', '3', '', '', 3), ('cre', '4', '', '', 4), ('mod', '5', '', '', 5)]
+    assert gate.messages[:3] == ['0', '1', '2']
+    summary = gate.messages[3].splitlines()
+    assert summary[0].startswith('3 events collapsed while the queue was full')
+    assert summary[1:] == ['3', '4', '5']
+
+def test_block_waits_for_a_free_slot():
+    q, gate = busy_queue('block', maxsize=1)
+    q.put('cre', '1')
+    done = threading.Event()
+    threading.Thread(target=lambda: (q.put('cre', '2'), done.set()), daemon=True).start()
+    assert not done.wait(0.2)
+    gate.open()
+    assert done.wait(5)
+    q.stop(5)
+    assert gate.messages == ['0', '1', '2']
+
+def test_block_released_by_stop_rejects_the_item():
+    q, gate = busy_queue('block', maxsize=1)
+    q.put('cre', '1')
+    results = []
+    t = threading.Thread(target=lambda: results.append(q.put('cre', '2')), daemon=True)
+    t.start()
+    time.sleep(0.1)
+    q.stop(0.1)
+    t.join(5)
+    assert results == [False]
+    assert q.depth <= 1
+    gate.open()
+
+def test_stopped_queue_is_not_restarted():
+    gate = Gate()
+    gate.open()
+    q = DispatchQueue(gate)
+    q.stop()
+    assert not q.put('cre', 'late')
+    assert q._threads == []
+    assert gate.messages == []
+
+def test_on_drop_is_called_outside_the_lock():
+    q, gate = busy_queue('drop_oldest', maxsize=1)
+    free = []
+
+    def on_drop(*item):
+        free.append(q._lock.acquire(blocking=False))
+        if free[-1]:
+            q._lock.release()
+
+    q.on_drop = on_drop
+    q.put('cre', '1')
+    q.put('cre', '2')
+    gate.open()
+    q.stop(5)
+    assert free == [True]
+
+def test_warnings_are_logged_outside_the_lock(monkeypatch):
+    q, gate = busy_queue('drop_oldest', maxsize=1)
+    free = []
+
+    def log(msg, **kwargs):
+        free.append(q._lock.acquire(blocking=False))
+        if free[-1]:
+            q._lock.release()
+
+    monkeypatch.setattr('dispatch.utils.log', log)
+    q.put('cre', '1')
+    # full
+    q.put('cre', '2')
+    gate.open()
+    q.stop(5)
+    # stopped
+    q.put('cre', '3')
+    assert free == [True, True]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import socket, threading
+
+import pytest
+
+from eventbus import encode, read_frame, wants, Subscriber, EventBus, HEADER
+
+# ============================================================= #
+
+def test_frames_round_trip():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(encode({'paths': ['/data']}) + encode([1.5, '/data', 'cre', 0, '/data/é', '']))
+        assert read_frame(b) == {'paths': ['/data']}
+        assert read_frame(b) == [1.5, '/data', 'cre', 0, '/data/é', '']
+
+def test_frame_limit_and_closed_connection():
+    a, b = socket.socketpair()
+    with b:
+        a.sendall(HEADER.pack(100) + b'{}')
+        with pytest.raises(ValueError):
+            read_frame(b, limit=10)
+        a.close()
+        with pytest.raises(ConnectionError):
+            read_frame(b)
+
+def test_wants_moves_and_renames():
+    assert wants({'mov'}, 'ren')
+    assert not wants({'cre'}, 'ren')
+
+def test_subscriber_filter():
+    s = Subscriber(None, 'test')
+    s.subscribe({'paths': ['/data/a/'], 'events': ['del']})
+    assert s.matches('del', '/data/a/f', '')
+    assert s.matches('del', '/data/a', '')
+    assert not s.matches('del', '/data/ab/f', '')
+    assert not s.matches('cre', '/data/a/f', '')
+    s.subscribe({})
+    assert s.matches('cre', '/other', '')
+    with pytest.raises(ValueError):
+        s.subscribe(['/data'])
+
+def test_subscriber_drops_the_oldest_records():
+    a, b = socket.socketpair()
+    with b:
+        s = Subscriber(a, 'test', buffer=2)
+        for i in range(5):
+            s.push(encode([i]))
+        writer = threading.Thread(target=s.run, daemon=True)
+        writer.start()
+        b.settimeout(5)
+        # the drop notice comes first, then the newest records
+        assert [read_frame(b) for _ in range(3)] == [{'dropped': 3}, [3], [4]]
+        s.close()
+        writer.join(5)
+        assert not writer.is_alive()
+
+def test_start_keeps_files_at_the_socket_path(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('keep me')
+    with pytest.raises(Exception, match='already in use'):
+        EventBus(str(path)).start()
+    assert path.read_text() == 'keep me'
+
+def test_start_replaces_a_stale_socket_only(tmp_path):
+    path = str(tmp_path / 'bus.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    bus = EventBus(path).start()
+    try:
+        # the socket of a running bus
+        with pytest.raises(Exception, match='already in use'):
+            EventBus(path).start()
+    finally:
+        bus.stop()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import os, time, sqlite3
+
+import pytest
+
+import history
+from history import EventHistory, query, parse_time, _choose_index
+
+# ============================================================= #
+
+ROOT = os.sep + 'data'
+
+def p(*parts):
+    return os.path.join(ROOT, *parts)
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = str(tmp_path / 'history.db')
+    # creates the database
+    EventHistory(filename, commit_interval=0.01).open().close()
+    return filename
+
+def insert(filename, rows):
+    # (time, event, path, dest) rows of the root
+    conn = sqlite3.connect(filename)
+    with conn:
+        conn.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)', [(t, ROOT, e, 0, path, dest) for t, e, path, dest in rows])
+    conn.close()
+
+def paths(rows):
+    return [(row[4], row[5]) for row in rows]
+
+# ============================================================= #
+
+def test_add_and_query(filename):
+    h = EventHistory(filename, commit_interval=0.01).open()
+    h.add(ROOT, 'cre', True, os.sep + 'a')
+    h.add(ROOT, 'mov', False, os.path.join(os.sep, 'a', 'f'), os.path.join(os.sep, 'b', 'f'))
+    h.close()
+    rows = query(filename)
+    assert [(r[1], r[2], r[3]) for r in rows] == [(ROOT, 'cre', 1), (ROOT, 'mov', 0)]
+    assert paths(rows) == [(p('a'), ''), (p('a', 'f'), p('b', 'f'))]
+
+def test_path_prefix(filename):
+    insert(filename, [(1, 'cre', p('a'), ''), (2, 'mod', p('a', 'f'), ''), (3, 'cre', p('ab'), ''),
+                      (4, 'mov', p('x'), p('a', 'x')), (5, 'mov', p('a', 'g'), p('a', 'h')), (6, 'mov', p('a', 'y'), p('z'))])
+    rows = query(filename, prefix=p('a'))
+    # moved into the prefix: listed once; moves within it: listed once
+    assert [row[0] for row in rows] == [1, 2, 4, 5, 6]
+    assert [row[0] for row in query(filename, prefix=p('a') + os.sep)] == [1, 2, 4, 5, 6]
+    assert [row[0] for row in query(filename, prefix=os.sep)] == [1, 2, 3, 4, 5, 6]
+
+def test_time_range_events_limit_and_count(filename):
+    insert(filename, [(t, 'cre' if t % 2 else 'del', p(f'f{t}'), '') for t in range(1, 11)])
+    assert [row[0] for row in query(filename, since=3, until=6)] == [3, 4, 5]
+    assert [row[0] for row in query(filename, events=['del'], limit=2)] == [2, 4]
+    assert query(filename, since=5, count=True) == [('cre', 3), ('del', 3)]
+    assert query(filename, since=5, prefix=ROOT, count=True) == [('cre', 3), ('del', 3)]
+
+def test_index_choice(filename):
+    # 1000 events over 1000 s, 10 of them under /data/small
+    insert(filename, [(t, 'cre', p('small' if t % 100 == 0 else 'big', f'f{t}'), '') for t in range(1, 1001)])
+    conn = sqlite3.connect(filename)
+    try:
+        def choose(since, until, prefix):
+            base = prefix.rstrip(os.sep)
+            return _choose_index(conn, since, until, prefix, base + os.sep, base + chr(ord(os.sep) + 1))
+
+        assert choose(None, None, p('big')) == 'events_path'
+        # few events under the prefix
+        assert choose(1, 1000, p('small')) == 'events_path'
+        # few events in the time range
+        assert choose(500, 505, p('big')) == 'events_time'
+    finally:
+        conn.close()
+    # same results with either index
+    assert [row[0] for row in query(filename, 500, 505, p('big'))] == [500 + i for i in range(5) if (500 + i) % 100]
+    assert len(query(filename, 1, 1001, p('small'))) == 10
+
+def test_parse_time():
+    now = time.time()
+    assert parse_time(None) is None
+    assert abs(parse_time('2h') - (now - 7200)) < 5
+    assert abs(parse_time('now') - now) < 5
+    assert parse_time('2024-05-01 02:00') == time.mktime((2024, 5, 1, 2, 0, 0, 0, 0, -1))
+    with pytest.raises(ValueError):
+        parse_time('yesterday')
+
+def test_query_command_makes_the_path_absolute(filename, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    cwd = os.getcwd()
+    insert(filename, [(1, 'cre', os.path.join(cwd, 'a', 'f'), ''), (2, 'cre', os.path.join(cwd, 'b', 'f'), '')])
+    history.main(['--file', filename, '--path', 'a', '--format', 'csv'])
+    out = capsys.readouterr()
+    assert os.path.join(cwd, 'a', 'f') in out.out
+    assert not os.path.join(cwd, 'b', 'f') in out.out
+    assert out.err.startswith('1 events')
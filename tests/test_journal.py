@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from journal import EventJournal, DeliveryCursor
+
+# ============================================================= #
+
+ROOT = '/data'
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = EventJournal(str(tmp_path / 'journal.db'), commit_interval=0.01, retry_min=5, retry_max=20).open()
+    yield journal
+    journal.close()
+
+def append(journal, n, root=ROOT):
+    return [journal.append(root, 'cre', f'CREATED FILE /f{i}', f'/f{i}', '') for i in range(n)]
+
+def stored_position(journal, key):
+    journal.flush()
+    with journal._db_lock:
+        return journal._conn.execute('SELECT position FROM cursors WHERE handler = ?', (key,)).fetchone()[0]
+
+# ============================================================= #
+
+def test_new_cursor_starts_at_the_end(journal):
+    append(journal, 3)
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    assert cursor.position == 3
+    assert cursor.pending() == []
+
+def test_position_waits_for_events_in_flight(journal):
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    ids = append(journal, 3)
+    assert all(cursor.send(eid) for eid in ids)
+    # delivered out of order (several dispatch workers)
+    cursor.done(ids[1])
+    assert cursor.position == 0
+    cursor.done(ids[0])
+    assert cursor.position == ids[1]
+    cursor.done(ids[2])
+    assert cursor.position == ids[2]
+    assert stored_position(journal, 'h') == ids[2]
+
+def test_skipped_events_advance_the_position(journal):
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    ids = append(journal, 2)
+    cursor.skip(ids[0])
+    cursor.skip(ids[1])
+    assert cursor.position == ids[1]
+
+def test_failure_starts_retrying(journal):
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    ids = append(journal, 4)
+    cursor.send(ids[0])
+    cursor.done(ids[0])
+    cursor.send(ids[1])
+    assert cursor.failed(ids[1])
+    # only the first failure starts the retries
+    assert not cursor.failed(ids[1])
+    assert cursor.retrying
+    # new events wait in the journal meanwhile
+    assert not cursor.send(ids[2])
+    assert [row[0] for row in cursor.pending()] == ids[1:]
+    assert not cursor.finish_retry()
+    cursor.advance(ids[-1])
+    assert cursor.finish_retry()
+    assert not cursor.retrying
+    assert cursor.send(journal.append(ROOT, 'del', 'DELETED FILE /f0', '/f0', ''))
+
+def test_retry_backoff(journal):
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    assert [cursor.next_delay() for _ in range(5)] == [5, 10, 20, 20, 20]
+    cursor.advance(0)
+    assert cursor.finish_retry()
+    assert cursor.next_delay() == 5
+
+def test_pending_is_per_root(journal):
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    append(journal, 2, '/other')
+    ids = append(journal, 2)
+    assert [row[0] for row in cursor.pending()] == ids
+    assert [row[0] for row in cursor.pending(until=ids[0])] == ids[:1]
+
+def test_positions_survive_a_restart(tmp_path):
+    filename = str(tmp_path / 'journal.db')
+    journal = EventJournal(filename, commit_interval=0.01).open()
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    ids = append(journal, 3)
+    for eid in ids:
+        cursor.send(eid)
+    cursor.done(ids[0])
+    journal.close()
+
+    journal = EventJournal(filename, commit_interval=0.01).open()
+    try:
+        cursor = DeliveryCursor(journal, 'h', ROOT)
+        assert cursor.position == ids[0]
+        assert [row[0] for row in cursor.pending()] == ids[1:]
+        # ids go on after the journaled ones
+        assert journal.append(ROOT, 'cre', 'm', '/g', '') == ids[-1] + 1
+    finally:
+        journal.close()
+
+def test_position_waits_for_lower_ids_sent_later(journal):
+    # events triggered by several threads are not always sent in id order
+    cursor = DeliveryCursor(journal, 'h', ROOT)
+    ids = append(journal, 6)
+    for eid in ids[:3]:
+        cursor.skip(eid)
+    for eid in (ids[3], ids[5], ids[4]):
+        cursor.send(eid)
+    cursor.done(ids[3])
+    assert cursor.position == ids[3]
+    cursor.done(ids[5])
+    assert cursor.position == ids[3]
+    cursor.done(ids[4])
+    assert cursor.position == ids[5]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from matcher import PathMatcher
+from scanner import TreeScanner
+
+# ============================================================= #
+
+ROOT = os.sep + 'data'
+
+def p(*parts):
+    return os.path.join(ROOT, *parts)
+
+def rel(*parts):
+    return os.path.join(*parts)
+
+# ============================================================= #
+
+def test_trivial_matcher():
+    m = PathMatcher(ROOT, ['*'])
+    assert m.is_trivial
+    assert m.match_path(p('a', 'b.bin'))
+    assert not m.match_path(os.sep + 'other' + os.sep + 'b.bin')
+
+def test_types_and_ignored_types():
+    m = PathMatcher(ROOT, ['*.txt', 'docs/*.md'], ['secret*'])
+    assert not m.is_trivial
+    assert m.match_file('a.txt', 'a.txt')
+    assert not m.match_file('a.bin', 'a.bin')
+    assert not m.match_file('secret.txt', 'secret.txt')
+    # masks with a separator match the trailing path components
+    assert m.match_file(rel('x', 'docs', 'r.md'), 'r.md')
+    assert not m.match_file(rel('x', 'r.md'), 'r.md')
+
+def test_case_sensitivity():
+    assert PathMatcher(ROOT, ['*.TXT']).match_file('a.txt', 'a.txt')
+    assert not PathMatcher(ROOT, ['*.TXT'], case_sensitive=True).match_file('a.txt', 'a.txt')
+
+def test_ignored_dirs_by_name_and_by_path():
+    m = PathMatcher(ROOT, None, None, ['node_modules', '*cache*', 'build/out', p('tmp')])
+    # names at any depth
+    assert not m.match_dir(rel('a', 'node_modules'), 'node_modules')
+    assert not m.match_dir(rel('a', 'b', '.pycache'), '.pycache')
+    # paths (relative or absolute) under the root only
+    assert not m.match_dir(rel('build', 'out'), 'out')
+    assert m.match_dir(rel('src', 'build', 'out'), 'out')
+    assert not m.match_dir('tmp', 'tmp')
+    assert m.match_dir(rel('a', 'tmp'), 'tmp')
+
+def test_events_under_ignored_dirs():
+    m = PathMatcher(ROOT, ['*.txt'], None, ['node_modules'])
+    assert m.match_path(p('a', 'b.txt'))
+    assert not m.match_path(p('node_modules', 'a', 'b.txt'))
+    assert not m.match_path(p('x', 'node_modules'), is_directory=True)
+    assert m.match_path(p('x', 'sub.txt'), is_directory=True)
+
+def test_ignore_dir_events():
+    m = PathMatcher(ROOT, None, None, True)
+    assert not m.match_path(p('a'), is_directory=True)
+    assert m.match_path(p('a', 'b'))
+
+def test_signature_follows_the_masks():
+    assert PathMatcher(ROOT, ['*.txt']).signature == PathMatcher(ROOT, ['*.txt']).signature
+    assert PathMatcher(ROOT, ['*.txt']).signature != PathMatcher(ROOT, ['*.md']).signature
+    assert PathMatcher(ROOT, ['*.txt']).signature != PathMatcher(ROOT, ['*.txt'], case_sensitive=True).signature
+
+# ============================================================= #
+
+@pytest.fixture
+def tree(tmp_path):
+    for d in ('src', os.path.join('src', 'node_modules', 'pkg'), 'logs'):
+        (tmp_path / d).mkdir(parents=True)
+    for f in ('a.txt', 'b.bin', os.path.join('src', 'c.txt'), os.path.join('src', 'node_modules', 'pkg', 'd.txt'),
+              os.path.join('logs', 'e.txt')):
+        (tmp_path / f).write_text('x')
+    return tmp_path
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_scan_prunes_ignored_subtrees(tree, workers, monkeypatch):
+    root = str(tree)
+    listed = []
+    scandir = os.scandir
+
+    def _scandir(path):
+        listed.append(os.path.relpath(path, root))
+        return scandir(path)
+
+    monkeypatch.setattr('scanner.os.scandir', _scandir)
+    scanner = TreeScanner(workers, PathMatcher(root, ['*.txt'], None, ['node_modules', 'logs']))
+    try:
+        listing = scanner.scan(root)
+    finally:
+        scanner.shutdown()
+    # the ignored directories are never listed
+    assert sorted(listed) == ['.', 'src']
+    assert sorted(name for name, *_ in listing['']) == ['', 'a.txt', 'src']
+    assert sorted(name for name, *_ in listing['src']) == ['c.txt']
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+
+from observers import EventDeduper, dedupe_seconds, DEFAULT_DEDUPE_SECONDS
+
+# ============================================================= #
+
+def test_repeated_events_are_dropped():
+    deduper = EventDeduper(1.0)
+    events = [FileModifiedEvent('/data/f')] * 3 + [FileModifiedEvent('/data/g')]
+    assert [deduper.is_duplicate(e) for e in events] == [False, True, True, False]
+
+def test_other_events_end_the_repetition():
+    deduper = EventDeduper(1.0)
+    events = [FileCreatedEvent('/data/f'), FileDeletedEvent('/data/f'), FileCreatedEvent('/data/f'),
+              FileModifiedEvent('/data/f'), FileModifiedEvent('/data/f')]
+    assert [deduper.is_duplicate(e) for e in events] == [False, False, False, False, True]
+
+def test_moves_are_the_last_event_of_both_paths():
+    deduper = EventDeduper(1.0)
+    events = [FileModifiedEvent('/data/g'), FileMovedEvent('/data/f', '/data/g'), FileMovedEvent('/data/f', '/data/g'),
+              FileModifiedEvent('/data/g'), FileModifiedEvent('/data/f')]
+    assert [deduper.is_duplicate(e) for e in events] == [False, False, True, False, False]
+
+def test_window_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('observers.time.monotonic', lambda: now[0])
+    deduper = EventDeduper(1.0)
+    assert not deduper.is_duplicate(FileModifiedEvent('/data/f'))
+    now[0] += 0.5
+    assert deduper.is_duplicate(FileModifiedEvent('/data/f'))
+    now[0] += 1.0
+    assert not deduper.is_duplicate(FileModifiedEvent('/data/f'))
+    assert len(deduper._last) == 1
+
+def test_off():
+    deduper = EventDeduper(0)
+    assert not any(deduper.is_duplicate(FileModifiedEvent('/data/f')) for _ in range(3))
+
+def test_default_window_by_backend():
+    assert dedupe_seconds(None, 'inotify') == DEFAULT_DEDUPE_SECONDS
+    assert dedupe_seconds(None, 'polling') == 0
+    assert dedupe_seconds(None, None) == 0
+    assert dedupe_seconds(2, 'polling') == 2.0
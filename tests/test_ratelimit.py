@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import ratelimit
+from ratelimit import parse_rate, TokenBucket, StormLimiter
+
+# ============================================================= #
+
+class Clock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock)
+    return clock
+
+# ============================================================= #
+
+@pytest.mark.parametrize('rate, expected', [
+    ('20 per m', (20.0, 60.0)),
+    ('100 per 10 s', (100.0, 10.0)),
+    ('1.5/h', (1.5, 3600.0)),
+    (' 3 PER 2 D ', (3.0, 172800.0)),
+])
+def test_parse_rate(rate, expected):
+    assert parse_rate(rate) == expected
+
+@pytest.mark.parametrize('rate', ['', 'fast', '0 per m', '10 per', '10 per y', '-1 per s', 5])
+def test_parse_wrong_rate(rate):
+    with pytest.raises(Exception, match='Wrong rate'):
+        parse_rate(rate)
+
+def test_bucket_burst_then_refill(clock):
+    bucket = TokenBucket(3, 60)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    # one token every 20 s
+    clock.now += 19
+    assert not bucket.take()
+    clock.now += 1
+    assert bucket.take()
+    assert not bucket.take()
+
+def test_bucket_is_capped(clock):
+    bucket = TokenBucket(2, 10)
+    clock.now += 3600
+    assert [bucket.take() for _ in range(3)] == [True, True, False]
+
+def test_storm_summary(clock):
+    limiter = StormLimiter('2 per m', '/data', quiet=10, listed=2, max_seconds=300)
+    assert limiter.allow('del', 'DELETED FILE /tmp/a', '/tmp/a')
+    assert limiter.allow('del', 'DELETED FILE /tmp/b', '/tmp/b')
+    for name in 'cdef':
+        clock.now += 1
+        assert not limiter.allow('del', f'DELETED FILE /tmp/x/{name}', f'/tmp/x/{name}')
+    assert not limiter.allow('cre', 'CREATED FILE /tmp/g', '/tmp/g')
+    # not over until `quiet` seconds without events
+    clock.now += 9
+    assert limiter.take() is None
+    clock.now += 1
+    event, text = limiter.take()
+    assert event == 'sum'
+    assert text.splitlines() == ['5 events (4 DELETED, 1 CREATED) under /data/tmp in 3 s, first 2 listed:',
+                                 'DELETED FILE /tmp/x/c', 'DELETED FILE /tmp/x/d']
+    assert limiter.take() is None
+
+def test_long_storm_is_summarized_every_max_seconds(clock):
+    limiter = StormLimiter('1 per h', '/data', quiet=10, listed=0, max_seconds=30)
+    assert limiter.allow('mod', 'm', '/f')
+    for _ in range(31):
+        clock.now += 1
+        limiter.allow('mod', 'm', '/f')
+    assert limiter.take()[1].startswith('31 MODIFIED events under /data in 30 s')
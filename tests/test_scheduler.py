@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import time, threading
+
+import pytest
+
+from scheduler import Scheduler
+
+# ============================================================= #
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler()
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+# ============================================================= #
+
+def test_calls_in_deadline_order(scheduler):
+    calls = []
+    scheduler.call_later(0.15, calls.append, 3)
+    scheduler.call_later(0.05, calls.append, 1)
+    scheduler.call_later(0.1, calls.append, 2)
+    assert wait_for(lambda: len(calls) == 3)
+    assert calls == [1, 2, 3]
+
+def test_earlier_job_wakes_up_the_scheduler(scheduler):
+    called = threading.Event()
+    scheduler.call_later(60, print)
+    time.sleep(0.05)
+    started = time.monotonic()
+    scheduler.call_later(0.05, called.set)
+    assert called.wait(5)
+    assert time.monotonic() - started < 1
+
+def test_periodic_job_and_cancel(scheduler):
+    calls = []
+    job = scheduler.every(0.05, lambda: calls.append(time.monotonic()), first=0)
+    assert wait_for(lambda: len(calls) >= 4)
+    job.cancel()
+    n = len(calls)
+    time.sleep(0.2)
+    assert len(calls) <= n + 1
+    assert scheduler.pending == 0
+
+def test_missed_deadlines_are_skipped(scheduler):
+    calls = []
+
+    def slow():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            time.sleep(0.35)
+
+    scheduler.every(0.1, slow, first=0)
+    assert wait_for(lambda: len(calls) >= 3)
+    # no burst of the missed calls after the slow one
+    assert calls[2] - calls[1] > 0.05
+
+def test_wrong_interval():
+    with pytest.raises(Exception, match='Wrong job interval'):
+        Scheduler().every(0, print)
+
+def test_background_jobs_do_not_delay_the_timers(scheduler):
+    release = threading.Event()
+    ticks = []
+    scheduler.call_later(0, release.wait, 5, background=True)
+    scheduler.every(0.05, lambda: ticks.append(1), first=0.05)
+    assert wait_for(lambda: len(ticks) >= 3, 2)
+    release.set()
+
+def test_running_background_job_is_skipped(scheduler):
+    release = threading.Event()
+    calls = []
+
+    def job():
+        calls.append(1)
+        release.wait(5)
+
+    scheduler.every(0.05, job, first=0, background=True)
+    time.sleep(0.3)
+    assert calls == [1]
+    release.set()
+    assert wait_for(lambda: len(calls) >= 2)
+
+def test_stop_from_a_job():
+    scheduler = Scheduler()
+    calls = []
+    scheduler.call_later(0, calls.append, 1)
+    scheduler.call_later(0.01, scheduler.stop)
+    scheduler.call_later(60, calls.append, 2)
+    # returns once stopped
+    scheduler.run()
+    assert calls == [1]
+    assert scheduler.pending == 0
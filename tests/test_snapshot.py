@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+
+from snapshot import CompactSnapshot, SnapshotDiff, SnapshotStore, HEADER
+
+# ============================================================= #
+
+ROOT = '/data'
+
+def snapshot(listing, root=ROOT):
+    # listing: relative directory -> [(name, inode, size, mtime_ns, isdir)], the root entry added
+    listing = dict(listing)
+    listing.setdefault('', [])
+    listing[''] = [('', 1, 0, 0, 1)] + listing['']
+    return CompactSnapshot.from_listing(root, listing)
+
+BASE = {'': [('a.txt', 10, 5, 100, 0), ('docs', 11, 0, 100, 1)],
+        'docs': [('b.txt', 12, 7, 100, 0), ('c.txt', 13, 9, 100, 0)]}
+
+def diff(ref, new):
+    d = SnapshotDiff(ref, new)
+    return {k: sorted(getattr(d, k)) for k in ('files_created', 'files_deleted', 'files_modified', 'files_moved',
+                                               'dirs_created', 'dirs_deleted', 'dirs_modified', 'dirs_moved')}
+
+def changes(**kwargs):
+    result = {k: [] for k in ('files_created', 'files_deleted', 'files_modified', 'files_moved',
+                              'dirs_created', 'dirs_deleted', 'dirs_modified', 'dirs_moved')}
+    result.update({k: sorted(v) for k, v in kwargs.items()})
+    return result
+
+# ============================================================= #
+
+def test_diff_unchanged():
+    assert diff(snapshot(BASE), snapshot(BASE)) == changes()
+
+def test_diff_created_deleted_modified():
+    new = {'': [('a.txt', 10, 6, 200, 0), ('docs', 11, 0, 100, 1), ('new', 20, 0, 100, 1)],
+           'docs': [('c.txt', 13, 9, 100, 0)],
+           'new': [('d.txt', 21, 1, 100, 0)]}
+    assert diff(snapshot(BASE), snapshot(new)) == changes(
+        files_created=['/data/new/d.txt'], dirs_created=['/data/new'],
+        files_deleted=['/data/docs/b.txt'], files_modified=['/data/a.txt'])
+
+def test_diff_moves_by_inode():
+    # b.txt renamed in place, c.txt moved (and modified) to the root
+    new = {'': [('a.txt', 10, 5, 100, 0), ('c2.txt', 13, 1, 300, 0), ('docs', 11, 0, 100, 1)],
+           'docs': [('b2.txt', 12, 7, 100, 0)]}
+    assert diff(snapshot(BASE), snapshot(new)) == changes(
+        files_moved=[('/data/docs/b.txt', '/data/docs/b2.txt'), ('/data/docs/c.txt', '/data/c2.txt')],
+        files_modified=['/data/docs/c.txt'])
+
+def test_diff_directory_removed_and_moved():
+    new = {'': [('a.txt', 10, 5, 100, 0), ('archive', 11, 0, 100, 1)],
+           'archive': [('b.txt', 12, 7, 100, 0)]}
+    assert diff(snapshot(BASE), snapshot(new)) == changes(
+        dirs_moved=[('/data/docs', '/data/archive')], files_moved=[('/data/docs/b.txt', '/data/archive/b.txt')],
+        files_deleted=['/data/docs/c.txt'])
+
+def test_diff_inode_reused_under_same_name():
+    # replaced file: same name, other inode
+    new = dict(BASE, docs=[('b.txt', 99, 7, 100, 0), ('c.txt', 13, 9, 100, 0)])
+    assert diff(snapshot(BASE), snapshot(new)) == changes(files_created=['/data/docs/b.txt'], files_deleted=['/data/docs/b.txt'])
+
+def test_diff_real_tree(tmp_path):
+    root = str(tmp_path)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'f.txt').write_text('x')
+    (tmp_path / 'g.txt').write_text('y')
+    ref = CompactSnapshot.take(root)
+    os.rename(tmp_path / 'sub' / 'f.txt', tmp_path / 'f.txt')
+    (tmp_path / 'g.txt').write_text('longer')
+    (tmp_path / 'h.txt').write_text('z')
+    d = SnapshotDiff(ref, CompactSnapshot.take(root))
+    assert d.files_moved == [(os.path.join(root, 'sub', 'f.txt'), os.path.join(root, 'f.txt'))]
+    assert d.files_modified == [os.path.join(root, 'g.txt')]
+    assert d.files_created == [os.path.join(root, 'h.txt')]
+    assert d.files_deleted == []
+
+# ============================================================= #
+
+def assert_same(a, b):
+    assert a.root == b.root
+    assert a.dirs == b.dirs
+    assert a.names == b.names
+    for attr in ('dir_start', 'inodes', 'sizes', 'mtimes', 'flags'):
+        assert getattr(a, attr) == getattr(b, attr)
+
+def test_store_round_trip(tmp_path):
+    store = SnapshotStore(ROOT, str(tmp_path), 'key')
+    snap = snapshot(dict(BASE, **{'docs': [('é ü.txt', 12, 2**40, -5, 0)]}))
+    store.save(snap)
+    loaded = store.load()
+    assert_same(snap, loaded)
+    assert diff(snap, loaded) == changes()
+
+def test_store_round_trip_real_tree(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'a' / 'b').mkdir(parents=True)
+    (root / 'a' / 'b' / 'f').write_bytes(b'123')
+    snap = CompactSnapshot.take(str(root))
+    store = SnapshotStore(str(root), str(tmp_path / 'store'))
+    store.save(snap)
+    assert_same(snap, store.load())
+
+def test_store_keys_and_missing_file(tmp_path):
+    assert SnapshotStore(ROOT, str(tmp_path)).load() is None
+    assert SnapshotStore(ROOT, str(tmp_path), 'a').filename != SnapshotStore(ROOT, str(tmp_path), 'b').filename
+
+def test_store_rejects_bad_files(tmp_path):
+    store = SnapshotStore(ROOT, str(tmp_path))
+    store.save(snapshot(BASE))
+    data = open(store.filename, 'rb').read()
+    # truncated
+    with open(store.filename, 'wb') as f:
+        f.write(data[:-3])
+    assert store.load() is None
+    # other format version
+    magic, version, bigendian, ndirs, nentries = HEADER.unpack(data[:HEADER.size])
+    with open(store.filename, 'wb') as f:
+        f.write(HEADER.pack(magic, version + 1, bigendian, ndirs, nentries) + data[HEADER.size:])
+    assert store.load() is None
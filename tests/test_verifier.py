@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os, threading
+
+import pytest
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+
+import verifier
+from verifier import ContentVerifier, file_digest
+
+# ============================================================= #
+
+@pytest.fixture
+def events():
+    return []
+
+@pytest.fixture
+def cv(events):
+    cv = ContentVerifier(lambda e: events.append((e.event_type, e.src_path) + ((e.dest_path,) if e.dest_path else ())))
+    cv.start()
+    yield cv
+    cv.stop()
+
+@pytest.fixture
+def slow_hash(monkeypatch):
+    # file digests computed once `release` is set
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def digest(path):
+        started.release()
+        release.wait(5)
+        return file_digest(path)
+
+    monkeypatch.setattr(verifier, 'file_digest', digest)
+    release.started = started
+    return release
+
+def write(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+    return str(path)
+
+# ============================================================= #
+
+def test_file_digest(tmp_path):
+    a, b = write(tmp_path / 'a', 'x' * 10), write(tmp_path / 'b', 'x' * 10)
+    assert file_digest(a, 3) == file_digest(b) != file_digest(write(tmp_path / 'c', 'y'))
+
+def test_unchanged_content_is_suppressed(tmp_path, cv, events):
+    path = write(tmp_path / 'f', 'data')
+    cv.push(FileCreatedEvent(path))
+    cv.stop()
+    cv.start()
+    # touched only
+    os.utime(path, ns=(0, 0))
+    cv.push(FileModifiedEvent(path))
+    cv.stop()
+    cv.start()
+    write(path, 'other')
+    cv.push(FileModifiedEvent(path))
+    cv.stop()
+    assert events == [('created', path), ('modified', path)]
+    assert cv.suppressed == 1
+
+def test_modification_passed_on_before_a_move(tmp_path, cv, events, slow_hash):
+    path = write(tmp_path / 'f', 'data')
+    cv.push(FileModifiedEvent(path))
+    assert slow_hash.started.acquire(timeout=5)
+    os.rename(path, tmp_path / 'g')
+    cv.push(FileMovedEvent(path, str(tmp_path / 'g')))
+    slow_hash.set()
+    cv.stop()
+    assert events == [('modified', path), ('moved', path, str(tmp_path / 'g'))]
+
+def test_modification_passed_on_before_a_deletion(tmp_path, cv, events, slow_hash):
+    path = write(tmp_path / 'f', 'data')
+    cv.push(FileModifiedEvent(path))
+    assert slow_hash.started.acquire(timeout=5)
+    os.remove(path)
+    cv.push(FileDeletedEvent(path))
+    slow_hash.set()
+    cv.stop()
+    assert events == [('modified', path), ('deleted', path)]
+
+def test_newer_modification_replaces_the_one_verified(tmp_path, cv, events, slow_hash):
+    path = write(tmp_path / 'f', 'data')
+    cv.push(FileModifiedEvent(path))
+    assert slow_hash.started.acquire(timeout=5)
+    write(path, 'more data')
+    cv.push(FileModifiedEvent(path))
+    slow_hash.set()
+    cv.stop()
+    assert events == [('modified', path)]
+
+def test_created_file_hash_dropped_by_a_deletion(tmp_path, cv, events, slow_hash):
+    path = write(tmp_path / 'f', 'data')
+    cv.push(FileCreatedEvent(path))
+    assert slow_hash.started.acquire(timeout=5)
+    cv.push(FileDeletedEvent(path))
+    slow_hash.set()
+    cv.stop()
+    assert events == [('created', path), ('deleted', path)]
+    assert cv._cache == {} and cv._versions == {}
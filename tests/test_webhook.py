@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from webhook import BatchQueue, event_record
+
+# ============================================================= #
+
+class Sender:
+    """Batch function blocked until `open` is called, recording the sent batches (messages)."""
+
+    def __init__(self):
+        self.opened = threading.Event()
+        self.started = threading.Event()
+        self.batches = []
+
+    def __call__(self, batch):
+        self.started.set()
+        self.opened.wait(5)
+        self.batches.append([item[1] for _, item in batch])
+
+    def open(self):
+        self.opened.set()
+
+def busy_queue(overflow, size=2, maxsize=2):
+    sender = Sender()
+    q = BatchQueue(sender, size, 0.01, maxsize, overflow)
+    q.put('cre', '0')
+    assert sender.started.wait(5)
+    return q, sender
+
+# ============================================================= #
+
+def test_wrong_policy():
+    with pytest.raises(Exception, match='Wrong overflow policy'):
+        BatchQueue(print, overflow='newest')
+
+def test_batches_by_size():
+    sender = Sender()
+    sender.open()
+    q = BatchQueue(sender, 3, 5, 100)
+    for i in range(7):
+        q.put('cre', str(i))
+    q.stop(5)
+    assert sender.batches == [['0', '1', '2'], ['3', '4', '5'], ['6']]
+
+def test_drop_oldest():
+    q, sender = busy_queue('drop_oldest')
+    dropped = []
+    q.on_drop = lambda *item: dropped.append(item[1])
+    for i in range(1, 6):
+        assert q.put('cre', str(i))
+    sender.open()
+    q.stop(5)
+    assert dropped == ['1', '2', '3']
+    assert sender.batches == [['0'], ['4', '5']]
+
+def test_collapse_sends_a_summary_record():
+    q, sender = busy_queue('collapse')
+    dropped = []
+    q.on_drop = lambda *item: dropped.append(item[1])
+    assert [q.put('del', str(i)) for i in range(1, 6)] == [True, True, False, False, False]
+    sender.open()
+    q.stop(5)
+    assert dropped == ['3', '4', '5']
+    assert sender.batches[:2] == [['0'], ['1', '2']]
+    summary = sender.batches[2][0].splitlines()
+    assert summary[0] == '3 events collapsed while the queue was full (del: 3), first 3 listed:'
+    assert summary[1:] == ['3', '4', '5']
+
+def test_stopped_queue_rejects_items():
+    sender = Sender()
+    q = BatchQueue(sender)
+    q.stop()
+    assert not q.put('cre', 'late')
+    assert q._threads == []
+
+def test_event_record():
+    record = event_record('/data', 'mov', 'MOVED FILE /a ==> /b/a', '/a', '/b/a', timestamp=0)
+    assert record['source'] == '/data/a'
+    assert record['destination'] == '/data/b/a'
+    assert record['timestamp'].startswith('1970-01-01T') or record['timestamp'].startswith('1969-12-31T')
+    assert event_record('/data', 'log', 'text')['source'] == ''
+
+def test_full_queue_warning_and_stats(monkeypatch):
+    warnings = []
+    monkeypatch.setattr('dispatch.utils.log', lambda msg, how='info', **kwargs: warnings.append(msg) if how == 'warning' else None)
+    q, sender = busy_queue('drop_oldest')
+    for i in range(1, 6):
+        q.put('cre', str(i))
+    sender.open()
+    q.stop(5)
+    assert warnings == ['Batch queue [] is full (2 items), overflow policy: drop_oldest']
+    assert (q._processed, q._dropped) == (3, 3)
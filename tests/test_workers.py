@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os, time, signal, itertools, threading
+
+import workers
+from workers import WorkerPool, assign
+from watcher import DirWatcher
+
+# ============================================================= #
+
+def settings(path, events=('cre', 'mod')):
+    return {'path': str(path), 'backend': 'polling', 'poll_interval': 0.1,
+            'handlers': [{'active': True, 'type': 'popup', 'events': list(events)}]}
+
+def created(root, name, received, timeout=30):
+    # creates files until one is reported (the worker process may not observe the root yet)
+    deadline = time.monotonic() + timeout
+    for i in itertools.count():
+        (root / f'{name}{i}').write_text(name)
+        if wait_for(lambda: any(r.startswith(name) for r in received), 1):
+            return True
+        if time.monotonic() > deadline:
+            return False
+
+def wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+# ============================================================= #
+
+def test_assign_balances_the_weights():
+    weights = [10, 1, 1, 8, 2]
+    groups = assign(weights, 2)
+    assert sorted(i for g in groups for i in g) == [0, 1, 2, 3, 4]
+    assert [sum(weights[i] for i in g) for g in groups] == [11, 11]
+    assert assign([1, 1], 4) == [[0], [1]]
+
+def test_observing_watcher_has_no_handlers(tmp_path):
+    w = DirWatcher(settings(tmp_path, ['cre']), process=lambda event: None)
+    assert w.handlers == []
+    assert w.wanted_events == {'cre'}
+    assert w.structure_only
+    assert w
+    assert not DirWatcher(settings(tmp_path, []), process=lambda event: None)
+
+def test_crashed_worker_is_restarted(tmp_path, monkeypatch):
+    monkeypatch.setattr(workers, 'WORKER_RESTART_SECONDS', 0.1)
+    root = tmp_path / 'root'
+    root.mkdir()
+    w = DirWatcher(settings(root), process=lambda event: None)
+    pool = WorkerPool([w], 1)
+    received = []
+    lock = threading.Lock()
+
+    def record(event):
+        with lock:
+            received.append(os.path.basename(event.src_path))
+
+    pool._processors = {wid: record for wid in pool._processors}
+    pool.start()
+    try:
+        assert created(root, 'a', received)
+        worker = pool.workers[0]
+        pid = worker.process.pid
+        os.kill(pid, signal.SIGKILL)
+        assert wait_for(lambda: worker.process.pid != pid and worker.process.is_alive())
+        assert created(root, 'b', received)
+    finally:
+        pool.stop()
+    assert not pool.workers[0].process.is_alive()
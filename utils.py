@@ -1,34 +1,190 @@
 # -*- coding: utf-8 -*-
-import logging, os, datetime, zipfile, uuid, time, glob
+import logging, os, datetime, zipfile, gzip, lzma, uuid, time, glob, queue, threading, atexit
+from functools import lru_cache
 from logging.handlers import TimedRotatingFileHandler
 try:
     import zlib
     ZIP_COMPRESSION = zipfile.ZIP_DEFLATED
 except:
     ZIP_COMPRESSION = zipfile.ZIP_STORED
-from plyer import notification
 
 from globals import ROOT_DIR, CONFIG
 
 # ============================================================= #
 
 EXTRA_PARAMS = ['watched_path', 'event', 'source', 'destination']
+EMPTY_EXTRA = {k: '' for k in EXTRA_PARAMS}
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warn': logging.WARNING, 'warning': logging.WARNING,
+              'error': logging.ERROR, 'critical': logging.CRITICAL, 'exception': logging.ERROR}
+# max number of records written by the background log writer at once
+LOG_BATCH_SIZE = 500
+# compression codecs: file extension and default level
+COMPRESSION_CODECS = {'zip': ('.zip', 6), 'gzip': ('.gz', 6), 'lzma': ('.xz', 6)}
+# size of the chunks files are streamed in
+COPY_CHUNK = 2**20
 
 # ============================================================= #
 
 class TRFHandler(TimedRotatingFileHandler):
+    """
+    Timed rotating file handler calling `on_rollover` before each rollover.
+    With `manual` = True the handler never rolls over by itself when records are emitted,
+    rollovers are then made by calling `rollover` (e.g. from a scheduler),
+    and a manual rollover is skipped (the log goes on) if `on_rollover` returns False.
+    """
 
-    def __init__(self, filename, when='h', interval=1, on_rollover=None, backupCount=1, utc=False, atTime=None):
+    def __init__(self, filename, when='h', interval=1, on_rollover=None, backupCount=1, utc=False, atTime=None, manual=False):
         self.on_rollover = on_rollover
+        self.manual = manual
         super().__init__(filename, when, interval, backupCount, 'utf-8', True, utc, atTime)
 
+    def shouldRollover(self, record):
+        return False if self.manual else super().shouldRollover(record)
+
+    def rollover(self):
+        self.acquire()
+        try:
+            self.doRollover()
+        finally:
+            self.release()
+
     def doRollover(self):
-        if self.on_rollover:
-            self.on_rollover(self)
+        if self.on_rollover and self.on_rollover(self) is False and self.manual:
+            return
         super().doRollover()
 
 # ============================================================= #
 
+class ExtraDefaults(logging.Filter):
+    """Fills in the extra fields missing in records not logged with `log` (e.g. by third-party modules)."""
+
+    def filter(self, record):
+        for k in EXTRA_PARAMS:
+            if not hasattr(record, k):
+                setattr(record, k, '')
+        return True
+
+# ============================================================= #
+
+class AsyncHandler(logging.Handler):
+    """
+    Hands log records over to the background LogWriter, which formats them
+    and writes them with the `targets` handlers (so that the logging thread never
+    waits for formatting and file I/O).
+    """
+
+    def __init__(self, targets):
+        super().__init__()
+        self.targets = list(targets)
+
+    def emit(self, record):
+        get_log_writer().put(self, record)
+
+    def flush(self):
+        if _log_writer:
+            _log_writer.flush()
+
+    def close(self):
+        self.flush()
+        for h in self.targets:
+            h.close()
+        super().close()
+
+# ============================================================= #
+
+class LogWriter:
+    """
+    Background thread writing the records of AsyncHandler objects.
+    The queued records are taken in batches of up to LOG_BATCH_SIZE and written
+    with a single write and flush per stream handler and batch.
+    """
+
+    def __init__(self, batch=LOG_BATCH_SIZE):
+        self.batch = batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, handler, record):
+        self._queue.put((handler, record))
+
+    def flush(self):
+        """Waits until all queued records are written."""
+        if threading.current_thread() is not self._thread:
+            self._queue.join()
+
+    def stop(self):
+        self._queue.put((None, None))
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            groups = {}
+            for handler, record in items:
+                if handler is None:
+                    stop = True
+                    continue
+                for target in handler.targets:
+                    groups.setdefault(target, []).append(record)
+            for target, records in groups.items():
+                self._write(target, records)
+            for _ in items:
+                self._queue.task_done()
+            if stop:
+                return
+
+    @staticmethod
+    def _write(handler, records):
+        records = [r for r in records if r.levelno >= handler.level]
+        if not type(handler) in (logging.StreamHandler, logging.FileHandler) and not getattr(handler, 'manual', False):
+            # the handler may roll over on any record: write one by one
+            for record in records:
+                handler.handle(record)
+            return
+        handler.acquire()
+        try:
+            lines = [handler.format(r) + handler.terminator for r in records if handler.filter(r)]
+            if not lines: return
+            if handler.stream is None:
+                handler.stream = handler._open()
+            handler.stream.write(''.join(lines))
+            handler.stream.flush()
+        except Exception:
+            handler.handleError(records[-1])
+        finally:
+            handler.release()
+
+_log_writer: LogWriter = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = LogWriter()
+                atexit.register(_log_writer.stop)
+    return _log_writer
+
+def flush_logger(logger):
+    """Waits until the records queued by the `logger` handlers are written."""
+    if any(isinstance(h, AsyncHandler) for h in logger.handlers):
+        get_log_writer().flush()
+
+def logger_handlers(logger):
+    """Handlers (the targets of asynchronous handlers) writing the records of `logger`."""
+    for h in logger.handlers:
+        yield from (h.targets if isinstance(h, AsyncHandler) else (h,))
+
+# ============================================================= #
+
 def abspath(path, root=None):
     if root is None: root = ROOT_DIR
     root = os.path.abspath(root)
@@ -44,7 +200,7 @@ def root_logger():
     return logging.getLogger()
 
 def get_logger(name=None, logfile=None, level='info', rotate_interval=0, on_rollover=None,
-               when='s', keep_backups=1, at_time=None, utc=False):
+               when='s', keep_backups=1, at_time=None, utc=False, manual_rollover=False):
     logger = logging.getLogger(name)
 
     if name is None:
@@ -52,6 +208,38 @@ def get_logger(name=None, logfile=None, level='info', rotate_interval=0, on_roll
     else:
         logger.setLevel(level.upper())
 
+    formatter = _get_formatter()
+    handlers = []
+
+    if (name is None) and ('logging' in CONFIG) and CONFIG['logging'].get('log', False):
+        file_ = CONFIG['logging'].get('file', None)
+        if file_ and not os.path.isabs(file_):
+            file_ = abspath(file_)
+        handlers.append(logging.FileHandler(file_, mode=('w' if CONFIG['logging'].get('restart', True) else 'a'), encoding='utf-8', delay=True)
+                        if file_ else logging.StreamHandler())
+
+    if not logfile:
+        if not handlers and not logger.hasHandlers():
+            handlers.append(logging.StreamHandler())
+    elif not rotate_interval:
+        handlers.append(logging.FileHandler(logfile, mode='w', encoding='utf-8', delay=True))
+    else:
+        handlers.append(TRFHandler(logfile, when, rotate_interval, on_rollover, keep_backups, utc, at_time, manual_rollover))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(ExtraDefaults())
+    if handlers and CONFIG['logging'].get('async', False):
+        # formatting and I/O are moved to the background writer
+        handlers = [AsyncHandler(handlers)]
+    for handler in handlers:
+        logger.addHandler(handler)
+
+    return logger
+
+@lru_cache(maxsize=None)
+def _get_formatter():
+    # the record layout is built once from the config
     fmt = CONFIG['logging'].get('format', None)
     if fmt:
         fmap = {'time': 'asctime', 'logger': 'name', 'path': 'watched_path', 'level': 'levelname'}
@@ -71,57 +259,23 @@ def get_logger(name=None, logfile=None, level='info', rotate_interval=0, on_roll
     else:
         str_fmt = '{asctime} [{name}] [{levelname}] >>> {watched_path} :: {event} >> {message}'
         time_fmt = '%m/%d/%Y %I:%M:%S'
-
-    formatter = logging.Formatter(str_fmt, time_fmt, '{')
-
-    if (name is None) and ('logging' in CONFIG) and CONFIG['logging'].get('log', False):
-        file_ = CONFIG['logging'].get('file', None)
-        if file_ and not os.path.isabs(file_):
-            file_ = abspath(file_)
-        handler = logging.FileHandler(file_, mode=('w' if CONFIG['logging'].get('restart', True) else 'a'), encoding='utf-8', delay=True) if file_ else logging.StreamHandler()
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-
-    if not logfile:
-        if not logger.hasHandlers():
-            handler = logging.StreamHandler()
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
-        return logger
-
-    if not rotate_interval:
-        handler = logging.FileHandler(logfile, mode='w', encoding='utf-8', delay=True)
-    else:
-        handler = TRFHandler(logfile, when, rotate_interval, on_rollover, keep_backups, utc, at_time)
-
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-
-    return logger
+    return logging.Formatter(str_fmt, time_fmt, '{')
 
 def log(what, logger=None, how='info', **kwargs):
     logger = logger or root_logger()
     if not logger: return
-    if not kwargs:
-        kwargs = {e: '' for e in EXTRA_PARAMS}
+    level = LOG_LEVELS.get(how, None)
+    if level is None or not logger.isEnabledFor(level): return
+    if kwargs:
+        extra = EMPTY_EXTRA.copy()
+        extra.update((k, v) for k, v in kwargs.items() if v or not k in extra)
     else:
-        for k in EXTRA_PARAMS:
-            if (not k in kwargs) or (not kwargs[k]):
-                kwargs[k] = ''
-    if how == 'info':
-        logger.info(what, extra=kwargs)
-    elif how == 'warn':
-        logger.warning(what, extra=kwargs)
-    elif how == 'error':
-        logger.error(what, extra=kwargs)
-    elif how == 'debug':
-        logger.debug(what, extra=kwargs)
-    elif how == 'critical':
-        logger.critical(what, extra=kwargs)
-    elif how == 'exception':
-        logger.exception(what, extra=kwargs)
+        extra = EMPTY_EXTRA
+    logger.log(level, what, exc_info=(how == 'exception'), extra=extra)
 
 def sys_notify(title, message, timeout=10, ticker='', icon=''):
+    # imported on first use (only popup handlers need it)
+    from plyer import notification
     notification.notify(title, message, 'Watcher', icon, timeout, ticker)
 
 def get_now():
@@ -145,10 +299,79 @@ def span_to_seconds(value, unit='s'):
         return datetime.timedelta(weeks=value).total_seconds()
     raise Exception(f'Wrong unit: {unit}!')
 
-def zipfiles(files, destination):
+def zipfiles(files, destination, level=9):
     with zipfile.ZipFile(destination, 'w') as z:
         for file in files:
-            z.write(file, os.path.basename(file), compress_type=ZIP_COMPRESSION, compresslevel=9)
+            z.write(file, os.path.basename(file), compress_type=ZIP_COMPRESSION, compresslevel=level)
+
+def line_end(path, end):
+    """Returns the position after the last complete line in `path` before `end`."""
+    with open(path, 'rb') as f:
+        pos = end
+        while pos > 0:
+            start = max(0, pos - COPY_CHUNK)
+            f.seek(start)
+            i = f.read(pos - start).rfind(b'\n')
+            if i >= 0:
+                return start + i + 1
+            pos = start
+    return 0
+
+def _copy_region(src, dest, offset=0, end=None):
+    # streams bytes [offset, end) of the open file `src` to the open file `dest`
+    src.seek(offset)
+    left = None if end is None else end - offset
+    while left is None or left > 0:
+        chunk = src.read(COPY_CHUNK if left is None else min(COPY_CHUNK, left))
+        if not chunk: break
+        dest.write(chunk)
+        if left is not None: left -= len(chunk)
+
+def copy_region(path, destination, offset=0, end=None):
+    """Copies bytes [offset, end) of file `path` to `destination` (in chunks)."""
+    with open(path, 'rb') as src, open(destination, 'wb') as dest:
+        _copy_region(src, dest, offset, end)
+    return destination
+
+def read_region(path, offset=0, end=None, limit=None):
+    """
+    Reads bytes [offset, end) of the text file `path`, at most `limit` bytes.
+    Returns a tuple (text, number of bytes left out).
+    """
+    size = os.path.getsize(path)
+    end = size if end is None else min(end, size)
+    count = max(0, end - offset)
+    n = count if limit is None else min(count, limit)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(n)
+    return (data.decode('utf-8', 'replace'), count - n)
+
+def compress_file(path, destination=None, codec='zip', level=None, offset=0, end=None):
+    """
+    Compresses bytes [offset, end) of file `path` with `codec` ('zip', 'gzip' or 'lzma')
+    streaming it in chunks, so that memory use does not depend on the file size.
+    `destination` defaults to `path` with the codec's extension. Returns the destination path.
+    """
+    codec = (codec or 'zip').lower()
+    if not codec in COMPRESSION_CODECS:
+        raise Exception(f'Wrong compression codec: {codec}!')
+    ext, default_level = COMPRESSION_CODECS[codec]
+    if level is None: level = default_level
+    if not destination:
+        destination = os.path.splitext(path)[0] + ext
+    with open(path, 'rb') as src:
+        if codec == 'zip':
+            with zipfile.ZipFile(destination, 'w', ZIP_COMPRESSION, compresslevel=level) as z:
+                with z.open(os.path.basename(path), 'w', force_zip64=True) as dest:
+                    _copy_region(src, dest, offset, end)
+        elif codec == 'gzip':
+            with gzip.open(destination, 'wb', compresslevel=level) as dest:
+                _copy_region(src, dest, offset, end)
+        else:
+            with lzma.open(destination, 'wb', preset=level) as dest:
+                _copy_region(src, dest, offset, end)
+    return destination
 
 def list_files(mask='*.*', root=None):
     yield from glob.glob(abspath(mask, root))
\ No newline at end of file
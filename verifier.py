@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import os, hashlib, itertools, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from watchdog.events import EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED
+
+import utils
+
+# ============================================================= #
+
+# files larger than this (bytes) are not hashed: their modifications are always reported
+DEFAULT_MAX_SIZE = 100 * 2**20
+DEFAULT_VERIFY_WORKERS = 2
+# max number of files waiting to be hashed (further modifications are reported unverified)
+DEFAULT_VERIFY_QUEUE = 1000
+# number of file digests remembered
+DIGEST_CACHE_SIZE = 100000
+# files are hashed in chunks of this size (bytes)
+HASH_CHUNK = 2**20
+
+# ============================================================= #
+
+def file_digest(path, chunk=HASH_CHUNK):
+    """BLAKE2 digest of the file `path`, read in chunks into a reused buffer."""
+    # plain reads, not a memory map: a file truncated while it is hashed would raise SIGBUS
+    h = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(chunk)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n: break
+            h.update(view[:n])
+    return h.digest()
+
+# ============================================================= #
+
+class ContentVerifier:
+    """
+    Drops 'modified' file events whose content did not change (e.g. files only touched),
+    passing all other events on to `callback`.
+
+    Digests of the files are kept in an LRU cache keyed on (size, mtime_ns), so a file is
+    hashed only when its size or mtime changes. Files are hashed on `workers` background threads;
+    files larger than `max_size`, files with no digest yet and modifications arriving while
+    `queue` files are waiting to be hashed are reported without verification.
+    Created files are hashed in the background as well, so that their first modification
+    can be verified. Only a newer modification replaces one being verified: other events
+    of the file (e.g. moved, deleted) first pass the pending modification on unverified.
+    """
+
+    def __init__(self, callback, max_size=DEFAULT_MAX_SIZE, workers=DEFAULT_VERIFY_WORKERS, queue=DEFAULT_VERIFY_QUEUE,
+                 watched_path=''):
+        self.callback = callback
+        self.max_size = max_size
+        self.workers = max(1, workers)
+        self.watched_path = watched_path
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # (version, event, verify) of the hashes in progress per path: results superseded by a later event are dropped
+        self._versions = {}
+        # held while events are passed on, so the events of a path keep their order
+        self._order = threading.RLock()
+        self._seq = itertools.count(1)
+        self._slots = threading.BoundedSemaphore(max(1, queue))
+        self._pool = None
+        self.suppressed = 0
+
+    @staticmethod
+    def from_config(callback, cfg, watched_path=''):
+        if not cfg: return None
+        cfg = cfg if isinstance(cfg, dict) else {}
+        return ContentVerifier(callback, cfg.get('max_size', DEFAULT_MAX_SIZE), cfg.get('workers', DEFAULT_VERIFY_WORKERS),
+                               cfg.get('queue', DEFAULT_VERIFY_QUEUE), watched_path)
+
+    def start(self):
+        if not self._pool:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='verifier')
+
+    def stop(self):
+        """Waits for the files being hashed (their events are still passed on)."""
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def push(self, event):
+        with self._order:
+            if event.is_directory:
+                self._emit(event)
+                return
+            etype = event.event_type
+            path = event.src_path
+            if etype == EVENT_TYPE_MODIFIED:
+                with self._lock:
+                    # a newer modification replaces the one being verified
+                    self._versions.pop(path, None)
+                if not self._submit(event, path, True):
+                    self._emit(event)
+                return
+            with self._lock:
+                # the modifications being verified are passed on (unverified) before the event ending them
+                flushed = [self._flush(path)]
+                if etype == EVENT_TYPE_DELETED:
+                    self._cache.pop(path, None)
+                elif etype == EVENT_TYPE_MOVED:
+                    flushed.append(self._flush(event.dest_path))
+                    item = self._cache.pop(path, None)
+                    if item is not None:
+                        self._cache[event.dest_path] = item
+            for e in flushed:
+                if e: self._emit(e)
+            if etype == EVENT_TYPE_CREATED:
+                # the digest of the new file is the reference for its first modification
+                self._submit(event, path, False)
+            self._emit(event)
+
+    def _flush(self, path):
+        # drops the hash in progress of `path` (called with the lock): its modification event, if any, is returned
+        pending = self._versions.pop(path, None)
+        return pending[1] if pending and pending[2] else None
+
+    def _submit(self, event, path, verify):
+        # returns True if the event is passed on after hashing
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_size > self.max_size:
+            return False
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            item = self._cache.get(path, None)
+            if item is not None and item[0] == key:
+                # not changed since it was hashed
+                if verify:
+                    self.suppressed += 1
+                return verify
+        if not self._pool or not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            version = next(self._seq)
+            self._versions[path] = (version, event, verify)
+        try:
+            self._pool.submit(self._hash, event, path, version, key, verify)
+        except RuntimeError:
+            # the pool is shutting down
+            with self._lock:
+                self._versions.pop(path, None)
+            self._slots.release()
+            return False
+        return verify
+
+    def _hash(self, event, path, version, key, verify):
+        try:
+            try:
+                digest = file_digest(path)
+            except (OSError, ValueError):
+                digest = None
+            changed = True
+            with self._order:
+                with self._lock:
+                    pending = self._versions.get(path, None)
+                    if not pending or pending[0] != version:
+                        # a later event superseded this one (e.g. a newer modification, or a deletion that passed it on)
+                        return
+                    del self._versions[path]
+                    item = self._cache.pop(path, None)
+                    if digest is not None:
+                        changed = item is None or item[1] != digest
+                        self._cache[path] = (key, digest)
+                        if len(self._cache) > DIGEST_CACHE_SIZE:
+                            self._cache.popitem(last=False)
+                if not verify:
+                    return
+                if changed:
+                    self._emit(event)
+                else:
+                    self.suppressed += 1
+                    utils.log(f'Content of {path} did not change', how='debug', watched_path=self.watched_path)
+        finally:
+            self._slots.release()
+
+    def _emit(self, event):
+        try:
+            self.callback(event)
+        except Exception as err:
+            utils.log(err, how='exception', watched_path=self.watched_path)
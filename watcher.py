@@ -1,16 +1,42 @@
 # -*- coding: utf-8 -*-
 import logging
 import os
-# from watchdog.observers import Observer # <-- this uses WinAPI implementation which generates duplicate events! See https://github.com/gorakhargosh/watchdog/issues/93
-# TODO: consider switching to watchgod [https://github.com/samuelcolvin/watchgod]
-from watchdog.observers.polling import PollingObserver as Observer
-from watchdog.events import (PatternMatchingEventHandler,
-                             EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED)
+import sys
+import signal
+import importlib
+import threading
+# native observers may generate duplicate events (see https://github.com/gorakhargosh/watchdog/issues/93),
+# these are filtered by observers.EventDeduper
+from watchdog.events import (EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED)
 import abc
 
 from globals import *
 import utils
-import networking
+import observers
+import metrics
+from snapshot import SnapshotStore
+from scanner import DEFAULT_SCAN_WORKERS
+from matcher import PathMatcher, MatchingEventHandler
+from coalescer import EventCoalescer
+from dispatch import DispatchQueue, DEFAULT_DISPATCH
+from digest import DigestBuffer, DEFAULT_TOP, DEFAULT_SPILL_BYTES
+from scheduler import Scheduler
+from verifier import ContentVerifier
+from workers import WorkerPool
+from journal import EventJournal, DeliveryCursor, PRUNE_SECONDS, READ_BATCH
+from history import EventHistory, COMPACT_SECONDS
+from ratelimit import StormLimiter, DEFAULT_STORM, STORM_CHECK_SECONDS
+from eventbus import EventBus, published_events
+
+# ============================================================= #
+
+# seconds to wait for each handler's queued messages on shutdown
+DISPATCH_STOP_TIMEOUT = 30
+# interval (seconds) between checks of the main log for handlers emitting it immediately
+LOG_CHECK_SECONDS = 1.0
+# max size (bytes) of log text sent in an email body / shown in a popup (the rest is left out)
+MAX_BODY_BYTES = 2**20
+MAX_POPUP_BYTES = 4096
 
 # ============================================================= #
 
@@ -28,6 +54,11 @@ class BaseHandler(abc.ABC):
         self.on_after_emit = on_after_emit
         self.user_data = {}
         self._logger_uid = ''
+        self._jobs = []
+        # delivery position in the event journal (see attach_journal)
+        self._cursor: DeliveryCursor = None
+        self._scheduler: Scheduler = None
+        self._retry_job = None
         self._update(dict_handler)
 
     def __del__(self):
@@ -38,31 +69,87 @@ class BaseHandler(abc.ABC):
         if not dict_handler:
             dict_handler = {}
         self.active = dict_handler.get('active', False)
-        self.events = dict_handler.get('events', [])
-        self.type = None
         self.emit = dict_handler.get('emit', {'interval': 0, 'unit': 's'})
+        self.dispatch = dict_handler.get('dispatch', DEFAULT_DISPATCH)
         self.logger: logging.Logger = None
         self._logfile = ''
-        if self.create_log: self._create_logger()
+        self._dispatcher: DispatchQueue = None
+        self._digest: DigestBuffer = None
+        self._logger_uid = utils.generate_uuid()
+        if self.is_digest:
+            # events are collected in memory instead of the handler's log file
+            self._digest = DigestBuffer(self.watched_path, self.emit.get('top', DEFAULT_TOP),
+                                        self.emit.get('spill', DEFAULT_SPILL_BYTES), utils.abspath(f'{self._logger_uid}.digest'))
+        elif self.create_log:
+            self._create_logger()
+        if self.emit['interval'] <= 0 and self.dispatch and self.dispatch.get('workers', 1) > 0:
+            self._dispatcher = self._create_dispatcher(dict_handler)
+            self._dispatcher.on_drop = self._dropped
+        self._limiter: StormLimiter = None
+        if self.emit['interval'] <= 0 and dict_handler.get('rate', None):
+            # beyond the rate, the immediate messages are collected into storm summaries
+            storm = dict(DEFAULT_STORM, **(dict_handler.get('storm', None) or {}))
+            self._limiter = StormLimiter(dict_handler['rate'], self.watched_path, storm['quiet'], storm['list'], storm['max'])
+        self._configure(dict_handler)
+
+    def _create_dispatcher(self, dict_handler):
+        # immediate messages are emitted from background workers (started on first use)
+        return DispatchQueue(self._emit_now, self.dispatch.get('queue', DEFAULT_DISPATCH['queue']),
+                             self.dispatch.get('workers', 1), self.dispatch.get('overflow', 'block'),
+                             dict_handler.get('type', ''), self.watched_path)
+
+    def _configure(self, dict_handler):
+        # settings that can change without recreating the log / digest / dispatch queue
+        self.config = dict_handler
+        self.events = dict_handler.get('events', [])
+        self.type = None
+
+    def reconfigure(self, dict_handler):
+        """Applies new settings in place; returns False if the handler must be recreated instead."""
+        if any(self.config.get(k, None) != dict_handler.get(k, None) for k in ('type', 'emit', 'dispatch', 'rate', 'storm', 'batch')):
+            return False
+        if self.active != dict_handler.get('active', False):
+            return False
+        self._configure(dict_handler)
+        return True
+
+    def retire(self):
+        """Sends what has been collected and releases the handler (replaced or removed)."""
+        self.stop_dispatch(DISPATCH_STOP_TIMEOUT)
+        self.unschedule()
+        self.cancel_retry()
+        if self._digest:
+            self.emit_digest()
+        else:
+            self.rollover()
+        self.close_logger(self.cleanup_log)
+        self._logger_uid = ''
 
     def _on_rollover(self, trf_handler):
-        if self.active:
-            self.emit_log()
+        if not self.active: return
+        emitted = self.user_data['emitted'] = self.emit_log()
+        # without a journal to collect the events again from, a log not sent is kept for the next emit
+        return emitted or not self._cursor is None
+
+    @property
+    def is_digest(self):
+        return self.emit['interval'] > 0 and self.emit.get('mode', 'log') == 'digest'
 
     def _create_logger(self):
-        self._logger_uid = utils.generate_uuid()
         self._logfile = utils.abspath(f'{self._logger_uid}.log')
         if self.active:
             self.logger = utils.get_logger(self._logger_uid if not self.root_logger else None,
                                            self._logfile, 'info', self.emit['interval'],
-                                           self._on_rollover if self.emit['interval'] > 0 else None, self.emit['unit'])
+                                           self._on_rollover if self.emit['interval'] > 0 else None, self.emit['unit'],
+                                           manual_rollover=True)
 
     def close_logger(self, delete_files=True):
-        if not self.logger or not self._logfile:
+        if not self._logger_uid or not (self.logger or self._digest):
             return
-        for h in self.logger.handlers:
+        for h in (list(self.logger.handlers) if self.logger else []):
             try:
                 h.close()
+                self.logger.removeHandler(h)
             except:
                 continue
         if delete_files:
@@ -84,52 +171,273 @@ class BaseHandler(abc.ABC):
         utils.log(f"Handling '{event}' event with {obj} ...", how='debug', event=event, watched_path=obj.watched_path)
         return True
 
-    def trigger(self, event, message, src_path, dest_path):
+    def trigger(self, event, message, src_path, dest_path, eid=None):
+        """Handles an event (`eid` = its id in the event journal, if any)."""
         if not self.active:
             return
+        cursor = self._cursor if not eid is None else None
         if self.on_before_emit and not self.on_before_emit(self, event, message):
+            if cursor and self.emit['interval'] <= 0:
+                cursor.skip(eid)
+            elif cursor:
+                # interval handlers stay at the position of their last emit
+                cursor.mark(eid)
             return
-        if self.logger and not self.root_logger:
+        self._record(event, message, src_path, dest_path)
+        if self.emit['interval'] <= 0:
+            if cursor and not cursor.send(eid):
+                # the event waits in the journal until the failed ones have been resent
+                return
+            if self._limiter and not self._limiter.allow(event, message, src_path, dest_path):
+                # collected into the storm summary (delivered with it)
+                metrics.RATE_LIMITED.inc(root=self.watched_path, handler=self.type)
+                if cursor:
+                    cursor.done(eid)
+                return
+            if self._dispatcher:
+                self._dispatcher.put(event, message, src_path, dest_path, eid)
+            else:
+                self._emit_now(event, message, src_path, dest_path, eid)
+        elif cursor:
+            cursor.mark(eid)
+
+    def _record(self, event, message, src_path, dest_path):
+        # collects the event for the interval emits
+        if self._digest:
+            self._digest.add(event, message, src_path, dest_path)
+        elif self.logger and not self.root_logger:
             utils.log(self._format_str(self.msg_format, message=message, event=event), self.logger,
                       event=event, watched_path=self.watched_path, source=src_path, destination=dest_path)
-        if self.emit['interval'] <= 0:
-            self.emit_msg(event, message, src_path, dest_path)
+
+    def _emit_now(self, event, message, src_path, dest_path, eid=None):
+        if self._cursor and not eid is None and self._cursor.retrying:
+            # queued before a failure: resent from the journal
+            return
+        sent = self.emit_msg(event, message, src_path, dest_path)
+        if self._cursor and not eid is None:
+            if sent:
+                self._cursor.done(eid)
+            elif self._cursor.failed(eid):
+                self._schedule_retry()
+        if self.on_after_emit:
+            self.on_after_emit(self, event, message)
+
+    def _dropped(self, event, message, src_path, dest_path, eid=None):
+        # messages discarded / collapsed by the dispatch queue count as delivered
+        if self._cursor and not eid is None:
+            self._cursor.done(eid)
+
+    def attach_journal(self, journal: EventJournal, key, scheduler: Scheduler):
+        """
+        Tracks the delivery of the events in `journal` under the (stable) handler `key`.
+        Events not delivered before a restart are resent (immediate messages)
+        or collected again for the next interval emit.
+        """
+        if not self.active or (self._cursor and self._cursor.key == key and self._cursor.journal is journal):
+            return
+        self.cancel_retry()
+        self._scheduler = scheduler
+        self._cursor = DeliveryCursor(journal, key, self.watched_path)
+        if self.emit['interval'] > 0:
+            self._replay()
+        elif self._cursor.pending(1):
+            self._cursor.retrying = True
+            self._schedule_retry(0)
+
+    def _replay(self, until=None):
+        # collects the journaled events after the delivery position (up to `until`) again
+        cursor = self._cursor
+        after = cursor.position
+        count = 0
+        while True:
+            rows = cursor.journal.pending(self.watched_path, after, READ_BATCH, until)
+            for eid, event, message, src_path, dest_path in rows:
+                if not self.on_before_emit or self.on_before_emit(self, event, message):
+                    self._record(event, message, src_path, dest_path)
+                    count += 1
+                cursor.mark(eid)
+            if len(rows) < READ_BATCH: break
+            after = rows[-1][0]
+        if count:
+            utils.log(f'{count} undelivered events collected again from the journal: {self}', watched_path=self.watched_path)
+
+    def _schedule_retry(self, delay=None):
+        if not self._scheduler: return
+        if delay is None:
+            delay = self._cursor.next_delay()
+            utils.log(f'Delivery failed, resending from the journal in {delay} s: {self}', how='warning', watched_path=self.watched_path)
+        self._retry_job = self._scheduler.call_later(delay, self._start_redelivery, name=f'retry {self!r}')
+
+    def _start_redelivery(self):
+        # the messages are sent on a thread of their own (the scheduler thread runs the polls)
+        threading.Thread(target=self._redeliver, name=f'redeliver-{self.type}', daemon=True).start()
+
+    def cancel_retry(self):
+        if self._retry_job:
+            self._retry_job.cancel()
+            self._retry_job = None
+
+    def _redeliver(self):
+        # resends the events after the delivery position in order; stops at the first failure
+        cursor = self._cursor
+        if not cursor or cursor is not self._cursor or not self.active: return
+        while True:
+            rows = cursor.pending(READ_BATCH)
+            if not rows and cursor.finish_retry():
+                utils.log(f'Journaled events delivered, back to normal: {self}', watched_path=self.watched_path)
+                return
+            if cursor is not self._cursor or not self.active:
+                return
+            resend = []
+            for row in rows:
+                if self.on_before_emit and not self.on_before_emit(self, row[1], row[2]):
+                    continue
+                if self._limiter and not self._limiter.allow(*row[1:]):
+                    metrics.RATE_LIMITED.inc(root=self.watched_path, handler=self.type)
+                    continue
+                resend.append(row)
+            sent = self._resend(resend)
+            if sent < len(resend):
+                # delivered up to the first event not sent
+                cursor.advance(resend[sent][0] - 1)
+                self._schedule_retry()
+                return
+            cursor.advance(rows[-1][0])
+
+    def _resend(self, rows):
+        """Sends the journaled (id, event, message, src_path, dest_path) rows in order; returns the number sent."""
+        for i, (eid, event, message, src_path, dest_path) in enumerate(rows):
+            if not self.active:
+                return i
+            metrics.REDELIVERIES.inc(root=self.watched_path, handler=self.type)
+            if not self.emit_msg(event, message, src_path, dest_path):
+                return i
             if self.on_after_emit:
                 self.on_after_emit(self, event, message)
+        return len(rows)
+
+    def check_storm(self, force=False):
+        """Sends the summary of the rate-limited events once the storm has ended (or now with `force`)."""
+        summary = self._limiter.take(force) if self._limiter and self.active else None
+        if not summary: return
+        if self._dispatcher:
+            self._dispatcher.put(*summary, '', '')
+        else:
+            self.emit_msg(*summary, '', '')
+
+    def stop_dispatch(self, timeout=None):
+        self.check_storm(True)
+        if self._dispatcher:
+            self._dispatcher.stop(timeout)
 
     def __repr__(self):
         return f'Handler [{self.type}] (active = {self.active}, events = {self.events}, path = {self.watched_path}, log = {self._logfile})'
 
     def emit_msg(self, event, message, src_path, dest_path):
-        if not self.active: return
+        """Sends a message; returns False if it failed."""
+        if not self.active: return False
         try:
-            self._emit_msg(event, message, src_path, dest_path)
+            with metrics.EMIT_SECONDS.time(root=self.watched_path, handler=self.type):
+                self._emit_msg(event, message, src_path, dest_path)
+            return True
         except Exception as err:
+            metrics.EMIT_FAILURES.inc(root=self.watched_path, handler=self.type)
             utils.log(err, how='exception', event=event, watched_path=self.watched_path, source=src_path, destination=dest_path)
+            return False
 
-    def emit_log(self, logfile=None):
-        if not self.active: return
+    def emit_log(self, logfile=None, offset=0, end=None):
+        """Emits bytes [offset, end) of the log file (the whole file by default); returns False if it failed."""
+        if not self.active: return False
         dafile = logfile if not logfile is None else ((self._logfile if not self.root_logger else CONFIG['logging'].get('file', '')) or '')
-        if not os.path.isfile(dafile): return
+        if not os.path.isfile(dafile): return True
+        metrics.LOG_EMIT_BYTES.observe((os.path.getsize(dafile) if end is None else end) - offset,
+                                       root=self.watched_path, handler=self.type)
         try:
-            self._emit_log(dafile)
+            self._emit_log(dafile, offset, end)
+            return True
         except Exception as err:
             utils.log(err, how='exception', watched_path=self.watched_path)
+            return False
+
+    @staticmethod
+    def _read_log(logfile, offset=0, end=None, limit=None):
+        text, left = utils.read_region(logfile, offset, end, limit)
+        text = text.strip()
+        if text and left:
+            text += f'\n... ({left} more bytes)'
+        return text
+
+    def schedule(self, scheduler: Scheduler):
+        """Registers the interval emits of the handler with `scheduler`."""
+        self.unschedule()
+        if not self.active: return
+        if self._limiter:
+            self._jobs.append(scheduler.every(STORM_CHECK_SECONDS, self.check_storm, name=f'storm {self!r}', background=True))
+        if self.emit['interval'] <= 0: return
+        interval = utils.span_to_seconds(self.emit['interval'], self.emit['unit'])
+        self._jobs.append(scheduler.every(interval, self.emit_digest if self._digest else self.rollover, name=repr(self), background=True))
+
+    def unschedule(self):
+        for job in self._jobs:
+            job.cancel()
+        self._jobs = []
+
+    def rollover(self):
+        """Emits the collected log and starts a new one."""
+        if not self.logger: return
+        # the journaled events logged so far
+        mark = self._cursor.seen if self._cursor else None
+        # queued records go to the current log
+        utils.flush_logger(self.logger)
+        if os.path.isfile(self._logfile) and os.path.getsize(self._logfile):
+            self.user_data['emitted'] = True
+            for h in utils.logger_handlers(self.logger):
+                if isinstance(h, utils.TRFHandler):
+                    h.rollover()
+        self._emitted(mark, self.user_data.pop('emitted', True))
+
+    def emit_digest(self):
+        """Sends the digest of the events collected since the previous one."""
+        if not self._digest or not self.active: return
+        mark = self._cursor.seen if self._cursor else None
+        emitted = True
+        try:
+            digest = self._digest.take(utils.abspath(f'{self._logger_uid}.csv'))
+            if digest:
+                self._emit_digest(*digest)
+        except Exception as err:
+            emitted = False
+            utils.log(err, how='exception', watched_path=self.watched_path)
+            if mark is None:
+                # no journal to collect the events again from: they go to the next digest
+                self._digest.restore()
+        self._emitted(mark, emitted)
+
+    def _emitted(self, mark, emitted):
+        # the journaled events up to `mark` are delivered or are collected again for the next emit
+        if mark is None: return
+        if emitted:
+            self._cursor.advance(mark)
+        else:
+            self._replay(mark)
+
+    def _emit_digest(self, text, records_file):
+        self._emit_msg('dig', text, '', '')
 
     @abc.abstractmethod
     def _emit_msg(self, event, message, src_path, dest_path):
         pass
 
     @abc.abstractmethod
-    def _emit_log(self, logfile):
+    def _emit_log(self, logfile, offset=0, end=None):
         pass
 
 # ============================================================= #
 
 class EmailHandler(BaseHandler):
 
-    def _update(self, dict_handler=None):
-        super()._update(dict_handler)
+    def _configure(self, dict_handler):
+        super()._configure(dict_handler)
         self.type = dict_handler.get('type', 'email')
         self.sender = dict_handler.get('from', None)
         self.receivers = dict_handler.get('to', [])
@@ -137,37 +445,65 @@ class EmailHandler(BaseHandler):
         self.smtp = dict_handler.get('smtp', {})
         self.attachment = dict_handler.get('attachment', False)
         self.zipped = dict_handler.get('zipped', False)
+        # 'zipped' is the same as compression with the default zip level
+        self.compression = dict_handler.get('compression', None) or ({'codec': 'zip'} if self.zipped else None)
         if not all([self.sender, self.receivers, self.smtp]):
             utils.log(f'The following parameters in Email handler must not be empty: "from", "to", "smtp"!', how='warning', watched_path=self.watched_path)
             self.active = False
+        if self._digest:
+            self._digest.keep_records = self.attachment
+
+    def _send(self, body, attachments=None):
+        # the email backend (smtplib, email, socks) is imported on first use
+        import networking
+        # failures are raised: logged by the emit methods (and retried from the journal)
+        networking.send_email(body, self._format_str(self.subject), self.sender, self.receivers, self.smtp,
+                              attachments=attachments, raise_errors=True)
 
     def _emit_msg(self, event, message, src_path, dest_path):
-        networking.send_email(message, self._format_str(self.subject), self.sender, self.receivers, self.smtp)
+        self._send(message)
 
-    def _emit_log(self, logfile):
-        dafile = logfile
+    def _emit_digest(self, text, records_file):
+        if not records_file:
+            self._send(text)
+            return
+        self._send_attachment(text, records_file)
+
+    def _pack(self, logfile, offset=0, end=None):
+        # returns the file to attach: the compressed / copied region of the log or the log itself
+        if offset or not end is None:
+            base, ext = os.path.splitext(logfile)
+            region = f'{base}.{offset}-{end if not end is None else os.path.getsize(logfile)}{ext}'
+            if not self.compression:
+                return utils.copy_region(logfile, region, offset, end)
+            return utils.compress_file(logfile, os.path.splitext(region)[0] + utils.COMPRESSION_CODECS[self.compression.get('codec', 'zip')][0],
+                                       self.compression.get('codec', 'zip'), self.compression.get('level', None), offset, end)
+        if not self.compression:
+            return logfile
+        return utils.compress_file(logfile, None, self.compression.get('codec', 'zip'), self.compression.get('level', None))
+
+    def _send_attachment(self, body, filepath, offset=0, end=None):
+        dafile = self._pack(filepath, offset, end)
+        try:
+            self._send(body or f'ATTACHED: {os.path.basename(dafile)}', (dafile,))
+        finally:
+            if dafile != filepath and os.path.isfile(dafile):
+                os.remove(dafile)
+
+    def _emit_log(self, logfile, offset=0, end=None):
         if self.attachment:
-            if self.zipped:
-                # zip log file
-                zfile = os.path.splitext(dafile)[0] + '.zip'
-                try:
-                    utils.zipfiles((dafile,), zfile)
-                    dafile = zfile
-                except Exception as err:
-                    utils.log(err, how='exception', watched_path=self.watched_path)
-            networking.send_email(f'ATTACHED: {os.path.basename(dafile)}', self._format_str(self.subject),
-                                      self.sender, self.receivers, self.smtp, attachments=(dafile,))
+            self._send_attachment('', logfile, offset, end)
         else:
-            msg = open(dafile, 'r').read().strip()
+            msg = self._read_log(logfile, offset, end, MAX_BODY_BYTES)
             if msg:
-                networking.send_email(msg, self._format_str(self.subject), self.sender, self.receivers, self.smtp)
+                self._send(msg)
 
 # ============================================================= #
 
 class PopupHandler(BaseHandler):
 
-    def _update(self, dict_handler=None):
-        super()._update(dict_handler)
+    def _configure(self, dict_handler):
+        super()._configure(dict_handler)
         self.type = dict_handler.get('type', 'popup')
         self.subject = dict_handler.get('subject', 'WATCHER NOTIFICATION - {path}')
         self.ticker = dict_handler.get('ticker', 'WATCHER NOTIFICATION - {path}')
@@ -182,22 +518,129 @@ class PopupHandler(BaseHandler):
             ico = ''
         utils.sys_notify(self._format_str(self.subject), message, self.timeout, self._format_str(self.ticker), ico)
 
-    def _emit_log(self, logfile):
+    def _emit_log(self, logfile, offset=0, end=None):
         # TODO: handle toaster activation event (click) to open log file
-        msg = open(logfile, 'r').read().strip()
+        msg = self._read_log(logfile, offset, end, MAX_POPUP_BYTES)
         if msg:
             utils.sys_notify(self._format_str(self.subject), msg, self.timeout, self._format_str(self.ticker), '')
 
 # ============================================================= #
 
+class WebhookHandler(BaseHandler):
+    """
+    POSTs the events as JSON records ({"events": [...]}, see webhook.event_record) to `url`.
+    Immediate events are sent in batches (up to `batch: size` events or `batch: wait` ms per request)
+    over a kept-alive connection; failed requests are retried with backoff (`retry`).
+    """
+
+    def _create_dispatcher(self, dict_handler):
+        # the HTTP backend (http.client) is imported on first use
+        import webhook
+        batch = dict(webhook.DEFAULT_WEBHOOK['batch'], **(dict_handler.get('batch', None) or {}))
+        return webhook.BatchQueue(self._emit_batch, batch['size'], batch['wait'] / 1000,
+                                  self.dispatch.get('queue', DEFAULT_DISPATCH['queue']), self.dispatch.get('overflow', 'block'),
+                                  dict_handler.get('type', ''), self.watched_path)
+
+    def _configure(self, dict_handler):
+        super()._configure(dict_handler)
+        self.type = dict_handler.get('type', 'webhook')
+        self.url = dict_handler.get('url', None)
+        self.headers = dict_handler.get('headers', None) or {}
+        # (re)connected with the new settings on the next request
+        client, self._client = getattr(self, '_client', None), None
+        if client:
+            client.close()
+        if not self.url:
+            utils.log(f'The following parameters in Webhook handler must not be empty: "url"!', how='warning', watched_path=self.watched_path)
+            self.active = False
+
+    @property
+    def client(self):
+        if self._client is None:
+            import webhook, networking
+            cfg = dict(webhook.DEFAULT_WEBHOOK, **self.config)
+            retry = dict(webhook.DEFAULT_WEBHOOK['retry'], **(cfg['retry'] or {}))
+            self._client = webhook.WebhookClient(self.url, self.headers, cfg['timeout'], cfg['gzip'], retry['count'], retry['min'], retry['max'],
+                                                 networking.Proxifier.get_proxifier())
+        return self._client
+
+    def retire(self):
+        super().retire()
+        if self._client:
+            self._client.close()
+
+    def _post(self, records):
+        self.client.post({'events': records})
+
+    def _emit_batch(self, batch):
+        # the batch is one request: its journaled events are all delivered or all resent from the journal
+        import webhook
+        cursor = self._cursor
+        items = [(ts, item[:4], item[4] if len(item) > 4 else None) for ts, item in batch]
+        if cursor and cursor.retrying:
+            # queued before a failure: resent from the journal
+            items = [(ts, item, eid) for ts, item, eid in items if eid is None]
+        if not items: return
+        sent = False
+        try:
+            with metrics.EMIT_SECONDS.time(root=self.watched_path, handler=self.type):
+                self._post([webhook.event_record(self.watched_path, *item, timestamp=ts) for ts, item, _ in items])
+            sent = True
+        except Exception as err:
+            metrics.EMIT_FAILURES.inc(root=self.watched_path, handler=self.type)
+            utils.log(err, how='exception', watched_path=self.watched_path)
+        for _, (event, message, _, _), eid in items:
+            if cursor and not eid is None:
+                if sent:
+                    cursor.done(eid)
+                elif cursor.failed(eid):
+                    self._schedule_retry()
+            if self.on_after_emit:
+                self.on_after_emit(self, event, message)
+
+    def _resend(self, rows):
+        # the journaled events are resent in batches too
+        import webhook
+        size = (self.config.get('batch', None) or {}).get('size', webhook.DEFAULT_WEBHOOK['batch']['size'])
+        for i in range(0, len(rows), size):
+            chunk = rows[i:i + size]
+            if not self.active:
+                return i
+            metrics.REDELIVERIES.inc(len(chunk), root=self.watched_path, handler=self.type)
+            try:
+                with metrics.EMIT_SECONDS.time(root=self.watched_path, handler=self.type):
+                    self._post([webhook.event_record(self.watched_path, *row[1:]) for row in chunk])
+            except Exception as err:
+                metrics.EMIT_FAILURES.inc(root=self.watched_path, handler=self.type)
+                utils.log(err, how='exception', watched_path=self.watched_path)
+                return i
+            if self.on_after_emit:
+                for row in chunk:
+                    self.on_after_emit(self, row[1], row[2])
+        return len(rows)
+
+    def _emit_msg(self, event, message, src_path, dest_path):
+        import webhook
+        self._post([webhook.event_record(self.watched_path, event, message, src_path, dest_path)])
+
+    def _emit_log(self, logfile, offset=0, end=None):
+        msg = self._read_log(logfile, offset, end, MAX_BODY_BYTES)
+        if msg:
+            self._emit_msg('log', msg, '', '')
+
+# ============================================================= #
+
 class BaseWatcher:
 
-    MHDLR = {'email': EmailHandler, 'popup': PopupHandler}
+    # handler classes by type: classes or names ('module.Class') of classes imported on first use
+    MHDLR = {'email': EmailHandler, 'popup': PopupHandler, 'webhook': WebhookHandler}
 
     def __init__(self, data, handler_kwargs={}):
         self.handlers = []
         self._handler_kwargs = handler_kwargs.copy() if handler_kwargs else {}
         self._it = None
+        # events are recorded in the journal before they are handled (see DirWatcher.start)
+        self.journal: EventJournal = None
         self._update(data)
 
     def _update(self, data):
@@ -207,18 +650,71 @@ class BaseWatcher:
         self.handlers.clear()
         self.add_handlers(handlers)
 
+    @staticmethod
+    def handler_class(type_):
+        cls_ = BaseWatcher.MHDLR.get(type_, None)
+        if isinstance(cls_, str):
+            module, _, name = cls_.rpartition('.')
+            cls_ = BaseWatcher.MHDLR[type_] = getattr(importlib.import_module(module), name)
+        return cls_
+
     def add_handlers(self, handlers, handler_kwargs=None):
         if not handlers: return
         if handler_kwargs is None:
             handler_kwargs = self._handler_kwargs
         for h in handlers:
-            cls_ = BaseWatcher.MHDLR.get(h.get('type', ''), None)
+            cls_ = BaseWatcher.handler_class(h.get('type', ''))
             if cls_:
                 self.handlers.append(cls_(h, **handler_kwargs))
 
+    def update_handlers(self, handlers, scheduler: Scheduler=None):
+        """
+        Applies a new list of handler settings: handlers (matched by position) are updated in place
+        where possible, otherwise replaced; new handlers are scheduled with `scheduler`.
+        """
+        old = self.handlers
+        kept = []
+        updated = []
+        for i, h in enumerate(h for h in (handlers or []) if h.get('type', '') in BaseWatcher.MHDLR):
+            handler = old[i] if i < len(old) else None
+            if handler and handler.reconfigure(h):
+                kept.append(handler)
+            else:
+                handler = BaseWatcher.handler_class(h['type'])(h, **self._handler_kwargs)
+                if scheduler:
+                    handler.schedule(scheduler)
+            updated.append(handler)
+        # the event threads iterate over the current list: swap it, then release the replaced handlers
+        self.handlers = updated
+        for handler in old:
+            if not handler in kept:
+                handler.retire()
+
     def trigger_all(self, event, message, src_path, dest_path):
+        eid = self.journal.append(self.path, event, message, src_path, dest_path) if self.journal else None
+        for handler in self.handlers:
+            handler.trigger(event, message, src_path, dest_path, eid)
+
+    def stop_handlers(self, timeout=None):
         for handler in self.handlers:
-            handler.trigger(event, message, src_path, dest_path)
+            handler.stop_dispatch(timeout)
+
+    def emit_digests(self):
+        for handler in self.handlers:
+            handler.emit_digest()
+
+    def schedule_handlers(self, scheduler: Scheduler):
+        for handler in self.handlers:
+            handler.schedule(scheduler)
+
+    def unschedule_handlers(self):
+        for handler in self.handlers:
+            handler.unschedule()
+
+    @property
+    def wanted_events(self):
+        """Union of the events of the active handlers."""
+        return set(e for h in self.handlers if h.active for e in (h.events or []))
 
     @property
     def has_active_handlers(self):
@@ -241,36 +737,191 @@ class BaseWatcher:
 # ============================================================= #
 
 class DirWatcher(BaseWatcher):
+    """
+    Watches a root directory: observer -> deduper -> coalescer -> content verifier -> processor,
+    the processor logging the events and triggering the handlers.
+    A `process` callback replaces the processor (e.g. to pass the events on to another process):
+    the watcher then only observes the root, its handlers are not created.
+    """
+
+    def __init__(self, data, handler_kwargs={}, process=None):
+        self._process = process
+        self.observing = False
+        self.handling = False
+        # the handled events are stored in the event history and published on the bus (see start)
+        self.history: EventHistory = None
+        self.bus: EventBus = None
+        super().__init__(data, handler_kwargs)
 
     @property
     def is_path_ok(self):
         path = getattr(self, 'path', '')
         return os.path.isdir(path)
 
+    @staticmethod
+    def root_path(data):
+        path = data.get('path', '')
+        return os.path.abspath(path) if os.path.isdir(path) else ''
+
+    @staticmethod
+    def handler_events(data):
+        """Union of the events of the active handlers in the settings `data`."""
+        return set(e for h in (data.get('handlers', None) or []) if h.get('active', False) for e in (h.get('events', None) or []))
+
+    @staticmethod
+    def observation_key(data):
+        """The settings of a watcher which its observer depends on (another key requires another observer)."""
+        wanted = DirWatcher.handler_events(data) | published_events()
+        keys = ('types', 'recursive', 'ignore_types', 'ignore_dirs', 'case_sensitive', 'dedupe', 'coalesce', 'verify_content')
+        return (DirWatcher.root_path(data), tuple(repr(data.get(k, None)) for k in keys),
+                data.get('backend', CONFIG.get('backend', 'auto')),
+                repr(data.get('poll_interval', CONFIG.get('poll_interval', DEFAULT_POLL_SECONDS))),
+                data.get('scan_workers', CONFIG.get('scan_workers', DEFAULT_SCAN_WORKERS)),
+                bool(wanted), 'mod' in wanted)
+
     def _update(self, data):
-        self.path = data.get('path', '')
-        if os.path.isdir(self.path):
-            self.path = os.path.abspath(self.path)
-        else:
-            utils.log(f'Empty or non-existent path: "{self.path}"!', how='warning')
-            self.path = ''
+        self.config = data
+        self.key = DirWatcher.observation_key(data)
+        self.path = DirWatcher.root_path(data)
+        if not self.path:
+            utils.log(f'Empty or non-existent path: "{data.get("path", "")}"!', how='warning')
         self._handler_kwargs['watched_path'] = self.path
         self.types =  data.get('types', ['*'])
         self.recursive =  data.get('recursive', True)
         self.ignore_types =  data.get('ignore_types', None)
         self.ignore_dirs =  data.get('ignore_dirs', None)
         self.case_sensitive =  data.get('case_sensitive', False)
-        super()._update(data)
+        self.backend = data.get('backend', CONFIG.get('backend', 'auto'))
+        self.poll_interval = data.get('poll_interval', CONFIG.get('poll_interval', DEFAULT_POLL_SECONDS))
+        self.scan_workers = data.get('scan_workers', CONFIG.get('scan_workers', DEFAULT_SCAN_WORKERS))
+        # the default dedupe window depends on the backend started (see start)
+        self.dedupe = data.get('dedupe', None)
+        self.deduper = observers.EventDeduper(observers.dedupe_seconds(self.dedupe, None))
+        # roots are watched for the bus subscribers too (with or without handlers)
+        self.published = published_events()
+        # events wanted by the handlers (of the process the events are passed on to, if any)
+        self.handled = DirWatcher.handler_events(data)
+        if not self._process:
+            super()._update(data)
         self.handler = None
+        self.coalescer = None
+        self.verifier = None
+        self.matcher = None
+        self.observer = None
+        self.active_backend = None
         if self.path:
-            self.handler = PatternMatchingEventHandler(self.types, self.ignore_types, self.ignore_dirs, self.case_sensitive)
-            self.handler.on_any_event = DirWatcher.event_handler(self, self.path)
+            self.matcher = PathMatcher(self.path, self.types, self.ignore_types, self.ignore_dirs, self.case_sensitive)
+            # raw events -> deduper -> coalescer -> content verifier -> processor
+            process = self._process or DirWatcher.event_processor(self, self.path)
+            self.verifier = ContentVerifier.from_config(process, data.get('verify_content', False), self.path)
+            if self.verifier:
+                process = self.verifier.push
+            if data.get('coalesce', 0) > 0:
+                self.coalescer = EventCoalescer(process, data['coalesce'], self.path)
+            self.handler = MatchingEventHandler(self.matcher)
+            self.handler.on_any_event = DirWatcher.event_handler(self, self.path, process)
+
+    @property
+    def wanted_events(self):
+        return (self.handled if self._process else super().wanted_events) | self.published
+
+    @property
+    def structure_only(self):
+        """Whether the polling scan may skip file stats (no handler wants modifications)."""
+        return not 'mod' in self.wanted_events
+
+    def attach_journal(self, scheduler: Scheduler=None):
+        """Tracks the deliveries of the handlers in the journal (keyed by their position and type)."""
+        if not self.journal: return
+        for i, handler in enumerate(self.handlers):
+            handler.attach_journal(self.journal, f'{self.path}#{i}:{handler.type}', scheduler)
+
+    def update_handlers(self, handlers, scheduler: Scheduler=None):
+        super().update_handlers(handlers, scheduler)
+        self.attach_journal(scheduler)
+
+    def snapshot_store(self):
+        """Store of the polling snapshots of the root (None if snapshots are not persisted)."""
+        # snapshots of structure-only scans carry no file sizes and mtimes: keep them apart
+        return SnapshotStore.from_config(self.path, self.matcher.signature + ('|structure' if self.structure_only else ''))
+
+    def start(self, scheduler: Scheduler=None, observe=True, handle=True, journal: EventJournal=None, history: EventHistory=None,
+              bus: EventBus=None):
+        """
+        Starts observing the root (`observe`) and / or the interval emits of the handlers (`handle`);
+        a root observed by a worker process is only handled here and vice versa.
+        The handled events are recorded in `journal` (if set) and delivered from there,
+        are stored in `history` (if set) and published on `bus` (if set).
+        """
+        if self.observing or self.handling or not self.handler: return
+        if handle and journal:
+            self.journal = journal
+            self.attach_journal(scheduler)
+        if handle:
+            self.history = history
+            self.bus = bus
+        if observe:
+            if self.verifier:
+                self.verifier.start()
+            if self.coalescer:
+                self.coalescer.start()
+        if handle and scheduler:
+            self.schedule_handlers(scheduler)
+        self.handling = handle
+        if not observe: return
+        structure_only = self.structure_only
+        poll_min, poll_max = observers.poll_bounds(self.poll_interval)
+        self.observer, self.active_backend = observers.start_observer(self.handler, self.path, self.recursive,
+                                                                      self.backend, poll_min, self.snapshot_store(),
+                                                                      self.scan_workers, self.matcher, structure_only, poll_max,
+                                                                      scheduler)
+        self.deduper.window = observers.dedupe_seconds(self.dedupe, self.active_backend)
+        self.observing = True
+        utils.log(f'Watching with {self.active_backend} observer' + (' (structure only)' if structure_only and self.active_backend == 'polling' else ''),
+                  watched_path=self.path)
+
+    def stop(self):
+        if self.observing:
+            observers.stop_observer(self.observer)
+            self.observer = None
+            self.observing = False
+            if self.coalescer:
+                # releases the pending events
+                self.coalescer.stop()
+            if self.verifier:
+                self.verifier.stop()
+        if self.handling:
+            self.handling = False
+            self.stop_handlers(DISPATCH_STOP_TIMEOUT)
+            self.unschedule_handlers()
+            # send what has been collected so far
+            self.emit_digests()
+            for handler in self.handlers:
+                handler.cancel_retry()
+            self.journal = None
+            self.history = None
+            self.bus = None
 
     @staticmethod
-    def event_handler(watcher: BaseWatcher, watched_path):
+    def event_handler(watcher: BaseWatcher, watched_path, process=None):
+        process = process or DirWatcher.event_processor(watcher, watched_path)
+
         def wrapped_handler(event):
             if not bool(watcher): return
+            metrics.EVENTS.inc(root=watched_path, type=event.event_type)
+            if watcher.deduper.is_duplicate(event):
+                metrics.DUPLICATES.inc(root=watched_path)
+                return
+            if watcher.coalescer:
+                watcher.coalescer.push(event)
+            else:
+                process(event)
+
+        return wrapped_handler
 
+    @staticmethod
+    def event_processor(watcher: BaseWatcher, watched_path):
+        def process_event(event):
             fdir = 'DIRECTORY' if event.is_directory else 'FILE'
             msg = ''
             evt = ''
@@ -303,12 +954,17 @@ class DirWatcher(BaseWatcher):
             if not msg: return
 
             utils.log(msg, event=evt, watched_path=watched_path, source=src_path, destination=dest_path)
+            if watcher.history:
+                watcher.history.add(watched_path, evt, event.is_directory, src_path, dest_path)
+            if watcher.bus:
+                watcher.bus.publish(watched_path, evt, event.is_directory, src_path, dest_path)
             watcher.trigger_all(evt, msg, src_path, dest_path)
 
-        return wrapped_handler
+        return process_event
 
     def __bool__(self):
-        return self.has_active_handlers and self.is_path_ok
+        handled = bool(getattr(self, 'handled', None)) if self._process else self.has_active_handlers
+        return (handled or bool(getattr(self, 'published', None))) and self.is_path_ok
 
 
 # ============================================================= #
@@ -317,8 +973,14 @@ class Watcher:
 
     def __init__(self):
         self.logging_watcher: BaseWatcher = None
-        self.observer: Observer = None
         self.watchers = []
+        self.running = False
+        self.scheduler: Scheduler = None
+        self.pool: WorkerPool = None
+        self.journal: EventJournal = None
+        self.history: EventHistory = None
+        self.bus: EventBus = None
+        self._config_mtime = None
         self._create_logs()
         self.schedule_watchers()
 
@@ -333,70 +995,77 @@ class Watcher:
             self.logging_watcher = BaseWatcher(CONFIG['logging'], {'create_log': False})
 
     def schedule_watchers(self):
+        self.stop()
         self.watchers.clear()
 
         if not CONFIG.get('watchers', None):
             utils.log('No watchers set in config file!', how='warning')
             return 0
 
-        self.stop()
-        try:
-            self.observer = Observer(CONFIG.get('poll_interval', DEFAULT_POLL_SECONDS))
-        except Exception as err:
-            utils.log(err, how='exception')
-            return 0
-
         for w in CONFIG['watchers']:
             try:
                 watcher = DirWatcher(w)
                 if watcher:
-                    self.observer.schedule(watcher.handler, watcher.path, watcher.recursive)
                     self.watchers.append(watcher)
             except Exception as err:
-                utils.log(err, how='exception', watched_path=watcher.path)
+                utils.log(err, how='exception', watched_path=w.get('path', ''))
 
         return len(self.watchers)
 
-    def _check_send_log(self):
+    def _schedule_log_emits(self):
         if not self.logging_watcher: return
-        dafile = CONFIG['logging'].get('file', '') or ''
-        if not os.path.isfile(dafile):
-            return
-        if not getattr(self, '_last_mdtime', None):
-            self._last_mdtime = os.path.getmtime(dafile)
-            return
-        if os.path.getmtime(dafile) > self._last_mdtime:
-            b_emitted = False
-            for h in self.logging_watcher:
-                if not 'last_time' in h.user_data:
-                    h.user_data['last_time'] = utils.get_now()
-                else:
-                    target_interval = utils.span_to_seconds(h.emit['interval'], h.emit['unit'])
-                    current_interval = utils.get_timedelta(h.user_data['last_time'])
-                    # print(f'Target interval = {int(target_interval)}, current passed = {int(current_interval)} sec.')
-                    if current_interval >= target_interval:
-                        # print(f'Emitting {h} ...')
-                        h.emit_log(dafile)
-                        h.user_data['last_time'] = utils.get_now()
-                        b_emitted = True
-            if b_emitted:
-                self._last_mdtime = os.path.getmtime(dafile)
+        for h in self.logging_watcher:
+            if not h.active: continue
+            h.user_data['offset'] = 0
+            interval = utils.span_to_seconds(h.emit['interval'], h.emit['unit']) if h.emit['interval'] > 0 else LOG_CHECK_SECONDS
+            self.scheduler.every(interval, self._send_log, h, name=f'send log {h!r}', background=True)
+
+    def _send_log(self, handler: BaseHandler):
+        # only the complete lines appended to the main log since the last time are sent
+        utils.flush_logger(utils.root_logger())
+        dafile = CONFIG['logging']['file']
+        if not os.path.isfile(dafile): return
+        size = os.path.getsize(dafile)
+        offset = handler.user_data.get('offset', 0)
+        if size < offset:
+            # the log was truncated (restarted)
+            offset = 0
+        end = utils.line_end(dafile, size)
+        if end <= offset: return
+        # a failed send is retried from the same offset next time
+        if handler.emit_log(dafile, offset, end):
+            handler.user_data['offset'] = end
 
     def run(self):
-        if not self.observer and not (self.watchers or self.schedule_watchers()):
+        if not (self.watchers or self.schedule_watchers()):
             utils.log('No watchers!', how='error')
             return
 
         try:
             utils.log(f"Using config file: {CONFIG_FILE}")
-            utils.log(f"Starting observer with {len(self)} watchers ({self._get_watcher_paths()}). Polling every {self.observer.timeout} sec ...")
-            self.observer.start()
-            while True:
+            utils.log(f"Starting observers for {len(self)} watchers ({self._get_watcher_paths()}) ...")
+            self.running = True
+            self.scheduler = Scheduler()
+            metrics.start(self.scheduler)
+            self._open_stores()
+            self._start_bus()
+            # roots are observed by worker processes (events are still handled here)
+            sharded = CONFIG.get('workers', 0) > 1 and len(self.watchers) > 1
+            for watcher in self.watchers:
                 try:
-                    self._check_send_log()
+                    watcher.start(self.scheduler, observe=not sharded, journal=self.journal, history=self.history, bus=self.bus)
                 except Exception as err:
-                    utils.log(err, how='exception')
-                utils.sleep()
+                    utils.log(err, how='exception', watched_path=watcher.path)
+            if sharded:
+                self.pool = WorkerPool(self.watchers, CONFIG['workers']).start()
+            self._schedule_log_emits()
+            self._config_mtime = self._get_config_mtime()
+            if CONFIG.get('reload', 0) > 0:
+                self.scheduler.every(CONFIG['reload'], self._check_config, name='config check', background=True)
+            if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGHUP, self._on_sighup)
+            # sleeps until the next job is due
+            self.scheduler.run()
 
         except KeyboardInterrupt:
             utils.log('User interrupt', how='warning')
@@ -408,22 +1077,141 @@ class Watcher:
 
         self.stop()
 
+    def _open_stores(self):
+        # the event journal and history (if configured)
+        try:
+            self.journal = EventJournal.from_config()
+            if self.journal:
+                self.journal.open()
+                self.scheduler.every(PRUNE_SECONDS, self.journal.prune, name='journal prune', background=True)
+        except Exception as err:
+            utils.log(f'Failed to open event journal, events are not journaled: {err}', how='error')
+            self.journal = None
+        try:
+            self.history = EventHistory.from_config()
+            if self.history:
+                self.history.open()
+                self.scheduler.every(COMPACT_SECONDS, self.history.compact, name='history compaction', background=True)
+        except Exception as err:
+            utils.log(f'Failed to open event history, events are not stored: {err}', how='error')
+            self.history = None
+
+    def _start_bus(self):
+        # the event bus (if configured)
+        try:
+            self.bus = EventBus.from_config()
+            if self.bus:
+                self.bus.start()
+        except Exception as err:
+            utils.log(f'Failed to start event bus, events are not published: {err}', how='error')
+            self.bus = None
+
     def stop(self):
-        if self.observer:
-            try:
-                utils.log(f"Stopping observer ...")
-                self.observer.stop()
-                self.observer.join()
+        if self.running:
+            utils.log(f"Stopping observers ...")
+            if self.pool:
+                # the events still pending in the workers are handled before the handlers stop
+                self.pool.stop()
+                self.pool = None
+            for watcher in self.watchers:
+                try:
+                    watcher.stop()
+                except Exception as err:
+                    utils.log(err, how='exception', watched_path=watcher.path)
 
-            except RuntimeError:
-                pass
+            self.watchers.clear()
+            if self.scheduler:
+                self.scheduler.stop()
+                self.scheduler = None
+            if self.journal:
+                # the delivery positions of the stopped handlers are written
+                self.journal.close()
+                self.journal = None
+            if self.history:
+                self.history.close()
+                self.history = None
+            if self.bus:
+                self.bus.stop()
+                self.bus = None
+            metrics.stop()
+            networking = sys.modules.get('networking', None)
+            if networking:
+                networking.close_smtp_pool()
+            utils.log('Observers stopped')
+            self.running = False
 
+    @staticmethod
+    def _get_config_mtime():
+        try:
+            return os.stat(CONFIG_FILE).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_config(self):
+        if self._get_config_mtime() != self._config_mtime:
+            self.reload()
+
+    def _on_sighup(self, signum, frame):
+        # signal handlers run on the main thread, which may be holding the scheduler's lock
+        scheduler = self.scheduler
+        if scheduler:
+            threading.Thread(target=scheduler.call_later, args=(0, self.reload), kwargs={'name': 'reload', 'background': True}, daemon=True).start()
+
+    def reload(self):
+        """
+        Applies the changes of the config file to the running watchers: watchers whose observer settings
+        did not change keep their observers, snapshots and queues (only their handlers are updated),
+        changed and new watchers are started and removed ones are stopped.
+        Other settings (logging, metrics, workers, ...) take effect on restart.
+        """
+        if not self.running: return
+        self._config_mtime = self._get_config_mtime()
+        try:
+            reload_config()
+        except Exception as err:
+            utils.log(f'Failed to reload config file: {err}', how='error')
+            return
+        networking = sys.modules.get('networking', None)
+        if networking:
+            networking.Proxifier.get_proxifier(refresh=True)
+
+        current = {w.key: w for w in self.watchers}
+        watchers = []
+        started = []
+        for data in CONFIG.get('watchers', None) or []:
+            try:
+                watcher = current.pop(DirWatcher.observation_key(data), None)
+                if watcher:
+                    watcher.config = data
+                    watcher.update_handlers(data.get('handlers', None), self.scheduler if watcher.handling else None)
+                else:
+                    watcher = DirWatcher(data)
+                    if not watcher: continue
+                    started.append(watcher)
+                watchers.append(watcher)
             except Exception as err:
-                utils.log(err, how='exception')
+                utils.log(err, how='exception', watched_path=data.get('path', ''))
+        stopped = list(current.values())
+        utils.log(f'Config reloaded: {len(watchers) - len(started)} watchers kept, {len(started)} started, {len(stopped)} stopped')
+        if not (started or stopped):
+            self.watchers = watchers
+            return
 
-            self.watchers.clear()
-            utils.log('Observer stopped')
-            self.observer = None
+        if self.pool:
+            self.pool.remove(stopped)
+        for watcher in stopped:
+            try:
+                watcher.stop()
+            except Exception as err:
+                utils.log(err, how='exception', watched_path=watcher.path)
+        self.watchers = watchers
+        for watcher in started:
+            try:
+                watcher.start(self.scheduler, observe=not self.pool, journal=self.journal, history=self.history, bus=self.bus)
+            except Exception as err:
+                utils.log(err, how='exception', watched_path=watcher.path)
+        if self.pool:
+            self.pool.add(started)
 
     def _get_watcher_paths(self):
         return '; '.join([w['path'] for w in CONFIG['watchers'] if 'path' in w] if 'watchers' in CONFIG else [])
@@ -434,6 +1222,14 @@ class Watcher:
 # ============================================================= #
 
 def main():
+    if sys.argv[1:2] == ['query']:
+        import history
+        history.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['subscribe']:
+        import eventbus
+        eventbus.main(sys.argv[2:])
+        return
     watcher = Watcher()
     watcher.run()
 
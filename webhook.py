@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import ssl, gzip, json, time, base64, socket, datetime, threading
+import http.client
+from urllib.parse import urlsplit
+
+import utils
+import metrics
+from dispatch import BoundedQueue
+
+# ============================================================= #
+
+DEFAULT_WEBHOOK = {'batch': {'size': 100, 'wait': 200}, 'gzip': 2048, 'timeout': 10,
+                   'retry': {'count': 3, 'min': 1, 'max': 30}}
+# responses worth retrying (the other errors are raised at once)
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+# errors meaning that the kept-alive connection has gone stale
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, http.client.BadStatusLine,
+                ConnectionError, BrokenPipeError)
+USER_AGENT = 'watcher-webhook/1.0'
+
+# ============================================================= #
+
+def event_record(watched_path, event, message, src_path='', dest_path='', timestamp=None):
+    """JSON record of an event (paths relative to `watched_path` made absolute)."""
+    dt = datetime.datetime.fromtimestamp(timestamp if not timestamp is None else time.time()).astimezone()
+    return {'event': event, 'watched_path': watched_path,
+            'source': watched_path + src_path if src_path else '', 'destination': watched_path + dest_path if dest_path else '',
+            'message': message, 'timestamp': dt.isoformat(timespec='milliseconds')}
+
+# ============================================================= #
+
+class WebhookError(Exception):
+
+    def __init__(self, msg, status=None):
+        super().__init__(msg)
+        self.status = status
+
+# ============================================================= #
+
+class HTTPProxyConnection(http.client.HTTPConnection):
+
+    def __init__(self, host, port=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, proxifier=None):
+        super().__init__(host, port, timeout)
+        self._proxifier = proxifier
+
+    def connect(self):
+        if not self._proxifier:
+            return super().connect()
+        self.sock = self._proxifier.get_socket(self.source_address, self.host, self.port, self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class HTTPSProxyConnection(http.client.HTTPSConnection):
+
+    def __init__(self, host, port=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, context=None, proxifier=None):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self._proxifier = proxifier
+        self.context = context or ssl.create_default_context()
+
+    def connect(self):
+        if not self._proxifier:
+            return super().connect()
+        sock = self._proxifier.get_socket(self.source_address, self.host, self.port, self.timeout)
+        self.sock = self.context.wrap_socket(sock, server_hostname=self.host)
+
+# ============================================================= #
+
+class WebhookClient:
+    """
+    POSTs JSON payloads to `url` over one kept-alive connection (through the proxy, if any).
+    Bodies larger than `gzip_min` bytes are gzipped. Connection errors and the RETRY_STATUS
+    responses are retried `retries` times, waiting `retry_min` seconds doubled after every
+    attempt up to `retry_max` seconds (or the Retry-After delay of the server).
+    """
+
+    def __init__(self, url, headers=None, timeout=10, gzip_min=2048, retries=3, retry_min=1, retry_max=30, proxifier=None):
+        parts = urlsplit(url)
+        if not parts.scheme in ('http', 'https') or not parts.hostname:
+            raise Exception(f'Wrong webhook URL: {url}!')
+        self.url = url
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        self.headers = {'Content-Type': 'application/json', 'User-Agent': USER_AGENT}
+        self.headers.update(headers or {})
+        if parts.username and not 'Authorization' in self.headers:
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(f'{parts.username}:{parts.password or ""}'.encode('utf-8')).decode('ascii')
+        self.timeout = timeout
+        self.gzip_min = gzip_min
+        self.retries = max(0, retries)
+        self.retry_min = retry_min
+        self.retry_max = max(retry_min, retry_max)
+        self.proxifier = proxifier
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._disconnect()
+        if self.https:
+            self.conn = HTTPSProxyConnection(self.host, self.port, self.timeout, proxifier=self.proxifier)
+        else:
+            self.conn = HTTPProxyConnection(self.host, self.port, self.timeout, proxifier=self.proxifier)
+
+    def close(self):
+        """Closes the connection (once the request in progress, if any, is done)."""
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self.conn is None: return
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+    def _request(self, body, headers):
+        # one attempt: the kept-alive connection is reopened once if the server has closed it
+        for attempt in (0, 1):
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request('POST', self.path, body, headers)
+                response = self.conn.getresponse()
+                # the whole response is read for the connection to be reused
+                data = response.read()
+                if response.will_close:
+                    self._disconnect()
+                return response.status, response.getheader('Retry-After'), data
+            except STALE_ERRORS:
+                self._disconnect()
+                if attempt: raise
+            except Exception:
+                self._disconnect()
+                raise
+
+    def post(self, payload):
+        """Sends `payload` (JSON-serializable); raises WebhookError after the last failed attempt."""
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+        headers = dict(self.headers)
+        if self.gzip_min and len(body) > self.gzip_min:
+            body = gzip.compress(body, 6)
+            headers['Content-Encoding'] = 'gzip'
+        delay = self.retry_min
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    status, retry_after, data = self._request(body, headers)
+                except (OSError, http.client.HTTPException) as err:
+                    error = WebhookError(f'Webhook {self.url}: {err}')
+                    retry_after = None
+                else:
+                    if status < 300:
+                        return status
+                    error = WebhookError(f'Webhook {self.url}: HTTP {status} {data[:200].decode("utf-8", "replace")}', status)
+                    if not status in RETRY_STATUS:
+                        raise error
+                if attempt == self.retries:
+                    raise error
+                wait = min(self.retry_max, float(retry_after) if retry_after and retry_after.isdigit() else delay)
+                utils.log(f'{error}, retrying in {wait:g} s', how='warning')
+                time.sleep(wait)
+                delay = min(self.retry_max, delay * 2)
+
+# ============================================================= #
+
+class BatchQueue(BoundedQueue):
+    """
+    Bounded queue (see dispatch.BoundedQueue: same interface and overflow policies as
+    dispatch.DispatchQueue) of items sent in batches by `func` on a background thread:
+    a batch is sent once it has `size` items or its first item has waited `wait` seconds.
+    `func` is called with the list of (timestamp, item) of the batch; the summary of
+    the collapsed items ends the batch sent once the queue drains.
+    """
+
+    label = 'Batch queue'
+    thread_name = 'batch'
+
+    def __init__(self, func, size=100, wait=0.2, maxsize=1000, overflow='block', name='', watched_path=''):
+        super().__init__(max(size, maxsize), 1, overflow, name, watched_path)
+        self.func = func
+        self.size = max(1, size)
+        self.wait = wait
+
+    def _queued(self):
+        # the thread is woken up by the first item of a batch, or a full batch
+        if len(self._queue) == 1 or len(self._queue) >= self.size:
+            self._not_empty.notify()
+
+    def _next_batch(self):
+        with self._lock:
+            while not self._queue and not self._collapsed and not self._stopped:
+                self._not_empty.wait()
+            if not self._queue and not self._collapsed:
+                return None
+            # the first item waits up to `wait` seconds for the rest of the batch
+            while self._queue and len(self._queue) < self.size and not self._stopped:
+                timeout = self._queue[0][0] + self.wait - time.monotonic()
+                if timeout <= 0: break
+                self._not_empty.wait(timeout)
+            batch = [self._take() for _ in range(min(self.size, len(self._queue)))]
+            if self._collapsed and not self._queue and len(batch) < self.size:
+                # the backlog is sent: the summary of the collapsed items ends the batch
+                batch.append((0.0, time.time(), self._summary()))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            metrics.DISPATCH_WAIT.observe(batch[0][0], root=self.watched_path, handler=self.name)
+            try:
+                self.func([(timestamp, item) for _, timestamp, item in batch])
+            except Exception as err:
+                utils.log(err, how='exception', watched_path=self.watched_path)
+            self._log_stats()
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+import os, json, time, heapq, queue, signal, itertools, logging, threading, traceback, multiprocessing
+from collections import namedtuple
+
+from globals import CONFIG, reload_config
+import utils
+import metrics
+
+# ============================================================= #
+
+# seconds to wait for a worker process to stop
+WORKER_STOP_TIMEOUT = 30
+# seconds to wait before restarting a worker process that exited unexpectedly (doubled while it keeps failing at once)
+WORKER_RESTART_SECONDS = 1
+WORKER_RESTART_MAX_SECONDS = 60
+# a worker process running for this many seconds is no longer considered failing at once
+WORKER_STABLE_SECONDS = 60
+# interval (seconds) between the metrics sent by the workers
+METRICS_SYNC_SECONDS = 5
+# max number of records sent to the parent at once
+RECORD_BATCH_SIZE = 1000
+# file (in the snapshots directory) keeping the scan costs of the roots for the next start
+COSTS_FILE = 'workers.json'
+
+# the attributes of a watchdog event used by the event processor
+EventRecord = namedtuple('EventRecord', ('event_type', 'is_directory', 'src_path', 'dest_path'))
+
+# ============================================================= #
+
+def assign(weights, workers):
+    """
+    Distributes the items (indices of `weights`) to `workers` groups with balanced total weights:
+    the heaviest items first, each to the lightest group so far.
+    """
+    groups = [[] for _ in range(max(1, min(workers, len(weights))))]
+    heap = [(0, i) for i in range(len(groups))]
+    for item in sorted(range(len(weights)), key=lambda i: -weights[i]):
+        total, g = heapq.heappop(heap)
+        groups[g].append(item)
+        heapq.heappush(heap, (total + weights[item], g))
+    return groups
+
+def _costs_file():
+    cfg = CONFIG.get('snapshots', None)
+    if not cfg or not cfg.get('dir', None):
+        return None
+    return os.path.join(cfg['dir'] if os.path.isabs(cfg['dir']) else utils.abspath(cfg['dir']), COSTS_FILE)
+
+# ============================================================= #
+
+class _Worker:
+
+    def __init__(self, number):
+        self.number = number
+        # id -> watcher, weight
+        self.watchers = {}
+        self.weights = {}
+        self.process = None
+        self.conn = None
+        self.thread = None
+        self.started = 0.0
+        self.restart_delay = 0
+
+    @property
+    def name(self):
+        return f'worker-{self.number}'
+
+    @property
+    def load(self):
+        return sum(self.weights.values())
+
+    @property
+    def paths(self):
+        return '; '.join(w.path for w in self.watchers.values())
+
+class WorkerPool:
+    """
+    Observes the roots of `watchers` in `workers` processes: each worker runs the observers
+    (and dedupers, coalescers, content verifiers) of its roots, without their handlers, and sends
+    the events back in batches of compact records. The events are logged and handled in this process,
+    the log records and metrics of the workers are passed on here as well. A worker process
+    exiting unexpectedly is restarted for the same roots.
+
+    The roots are assigned to the workers balanced by their scan costs measured in the
+    previous run (if snapshots are persisted), by the size of their stored snapshots
+    (about proportional to the file count) or equally. Roots can be added to / removed
+    from the running workers.
+    """
+
+    def __init__(self, watchers, workers):
+        self._ids = itertools.count()
+        # held while the worker processes are (re)started and sent messages
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # watcher id -> event processor
+        self._processors = {}
+        watchers = list(watchers)
+        weights = self._weights(watchers)
+        groups = assign(weights, workers)
+        self.workers = [_Worker(n) for n in range(len(groups))]
+        for worker, group in zip(self.workers, groups):
+            for i in group:
+                self._add(worker, watchers[i], weights[i])
+
+    def _weights(self, watchers):
+        costs_file = _costs_file()
+        costs = {}
+        if costs_file and os.path.isfile(costs_file):
+            try:
+                with open(costs_file, 'r', encoding='utf-8') as f:
+                    costs = json.load(f)
+            except Exception as err:
+                utils.log(f'Failed to read scan costs: {err}', how='warning')
+        weights = [costs.get(w.path, None) for w in watchers]
+        if all(weights):
+            return weights
+        weights = []
+        for w in watchers:
+            store = w.snapshot_store()
+            weights.append(os.path.getsize(store.filename) if store and os.path.isfile(store.filename) else 0)
+        if all(weights):
+            return weights
+        return [1] * len(watchers)
+
+    def _add(self, worker, watcher, weight):
+        wid = next(self._ids)
+        worker.watchers[wid] = watcher
+        worker.weights[wid] = weight
+        self._processors[wid] = watcher.event_processor(watcher, watcher.path)
+        # plain settings (the worker does not depend on the config file)
+        return (wid, json.loads(json.dumps(watcher.config)))
+
+    def start(self):
+        with self._lock:
+            for worker in self.workers:
+                self._spawn(worker)
+        return self
+
+    def _spawn(self, worker):
+        # starts the process of `worker` for its current roots (called with the lock)
+        ctx = multiprocessing.get_context('spawn')
+        items = [(wid, json.loads(json.dumps(w.config))) for wid, w in worker.watchers.items()]
+        worker.conn, child_conn = ctx.Pipe()
+        worker.process = ctx.Process(target=run_worker, args=(child_conn, items, worker.name), name=worker.name, daemon=True)
+        worker.process.start()
+        worker.started = time.monotonic()
+        child_conn.close()
+        worker.thread = threading.Thread(target=self._receive, args=(worker,), name=f'{worker.name}-receiver', daemon=True)
+        worker.thread.start()
+        utils.log(f'Started {worker.name} (pid {worker.process.pid}) for {len(worker.watchers)} roots: {worker.paths}')
+
+    def _restart(self, worker):
+        # called on the receiver thread of the worker once its process has exited unexpectedly
+        worker.process.join(WORKER_STOP_TIMEOUT)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.conn.close()
+        if time.monotonic() - worker.started >= WORKER_STABLE_SECONDS:
+            worker.restart_delay = 0
+        worker.restart_delay = min(WORKER_RESTART_MAX_SECONDS, worker.restart_delay * 2) if worker.restart_delay else WORKER_RESTART_SECONDS
+        utils.log(f'{worker.name} exited unexpectedly (exit code {worker.process.exitcode}), restarting it in {worker.restart_delay} s '
+                  f'for its roots: {worker.paths}', how='error')
+        if self._stopping.wait(worker.restart_delay):
+            return
+        with self._lock:
+            if not self._stopping.is_set():
+                self._spawn(worker)
+
+    def add(self, watchers):
+        """Starts observing the roots of `watchers` in the least loaded workers."""
+        # the cost of a new root is unknown: take the average
+        weights = [v for w in self.workers for v in w.weights.values()]
+        weight = sum(weights) / len(weights) if weights else 1
+        for watcher in watchers:
+            worker = min(self.workers, key=lambda w: w.load)
+            self._send(worker, ('add', [self._add(worker, watcher, weight)]))
+            utils.log(f'{worker.name} observes {len(worker.watchers)} roots: {worker.paths}')
+
+    def remove(self, watchers):
+        """Stops observing the roots of `watchers` (their pending events are dropped)."""
+        for worker in self.workers:
+            ids = [wid for wid, w in worker.watchers.items() if w in watchers]
+            if not ids: continue
+            for wid in ids:
+                del worker.watchers[wid], worker.weights[wid], self._processors[wid]
+            self._send(worker, ('remove', ids))
+
+    def _send(self, worker, message):
+        # a worker being restarted gets the current roots when it starts
+        with self._lock:
+            try:
+                worker.conn.send(message)
+            except (OSError, ValueError) as err:
+                utils.log(f'Failed to send to {worker.name}: {err}', how='warning')
+
+    def stop(self):
+        """Stops the workers after their pending events have been received."""
+        with self._lock:
+            self._stopping.set()
+            for worker in self.workers:
+                try:
+                    worker.conn.send('stop')
+                except (OSError, ValueError):
+                    pass
+        for worker in self.workers:
+            worker.thread.join(WORKER_STOP_TIMEOUT)
+            worker.process.join(WORKER_STOP_TIMEOUT)
+            if worker.process.is_alive():
+                utils.log(f'{worker.name} did not stop, terminating it', how='warning')
+                worker.process.terminate()
+            worker.conn.close()
+        self._save_costs()
+
+    def _receive(self, worker):
+        while True:
+            try:
+                batch = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            for record in batch:
+                kind = record[0]
+                try:
+                    if kind == 'e':
+                        process = self._processors.get(record[1], None)
+                        # events of removed roots are dropped
+                        if process:
+                            process(EventRecord(*record[2:]))
+                    elif kind == 'l':
+                        utils.root_logger().log(record[1], record[2], extra=record[3])
+                    elif kind == 'm':
+                        metrics.merge(worker.name, record[1])
+                    elif kind == 'x':
+                        return
+                except Exception as err:
+                    utils.log(err, how='exception')
+        # the pipe was closed without the end marker
+        if not self._stopping.is_set():
+            self._restart(worker)
+
+    def _save_costs(self):
+        costs_file = _costs_file()
+        if not costs_file: return
+        costs = {}
+        for (root,), (counts, total, _) in metrics.SCAN_SECONDS.items():
+            if sum(counts):
+                costs[root] = total / sum(counts)
+        if not costs: return
+        try:
+            os.makedirs(os.path.dirname(costs_file), exist_ok=True)
+            with open(costs_file, 'w', encoding='utf-8') as f:
+                json.dump(costs, f, indent=2)
+        except Exception as err:
+            utils.log(f'Failed to save scan costs: {err}', how='warning')
+
+# ============================================================= #
+
+class _ForwardHandler(logging.Handler):
+    """Passes the log records of a worker on to the parent process."""
+
+    def __init__(self, put):
+        super().__init__()
+        self.put = put
+
+    def emit(self, record):
+        try:
+            text = record.getMessage()
+            if record.exc_info:
+                text += '\n' + ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            self.put(('l', record.levelno, text, {k: getattr(record, k, '') for k in utils.EXTRA_PARAMS}))
+        except Exception:
+            self.handleError(record)
+
+def run_worker(conn, items, name='worker'):
+    """
+    Entry point of a worker process observing the roots of `items`: (id, watcher settings) tuples.
+    The parent sends 'stop' or ('add', items) / ('remove', ids) messages.
+    """
+    # imported here: the watcher module imports this one
+    import watcher as watcher_
+    from scheduler import Scheduler
+
+    # an interrupt (Ctrl+C) reaches the whole process group: the parent stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    records = queue.SimpleQueue()
+    logger = utils.root_logger()
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.addHandler(_ForwardHandler(records.put))
+    logger.setLevel(logging.DEBUG if CONFIG['logging'].get('verbose', False) else logging.INFO)
+    scheduler = Scheduler()
+    watchers = {}
+
+    def send():
+        # sends the queued records in batches until the end marker
+        while True:
+            batch = [records.get()]
+            while len(batch) < RECORD_BATCH_SIZE:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                conn.send(batch)
+            except (OSError, ValueError):
+                return
+            if batch[-1][0] == 'x':
+                return
+
+    def add(items, reload=False):
+        if reload:
+            # the global defaults of the new roots
+            try:
+                reload_config()
+            except Exception as err:
+                utils.log(f'Failed to reload config file: {err}', how='error')
+        for wid, data in items:
+            def forward(event, wid=wid):
+                records.put(('e', wid, event.event_type, event.is_directory, event.src_path, getattr(event, 'dest_path', '') or ''))
+            try:
+                # observed only: the handlers run in the parent process
+                w = watcher_.DirWatcher(data, process=forward)
+                w.start(scheduler, handle=False)
+                watchers[wid] = w
+            except Exception as err:
+                utils.log(err, how='exception', watched_path=data.get('path', ''))
+
+    def remove(ids, reload=False):
+        for wid in ids:
+            w = watchers.pop(wid, None)
+            if w: w.stop()
+
+    def receive():
+        # changes are applied on the scheduler thread
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                # the parent is gone
+                break
+            if message == 'stop':
+                break
+            func = {'add': add, 'remove': remove}.get(message[0], None)
+            if func:
+                scheduler.call_later(0, func, message[1], True, name=message[0], background=True)
+        scheduler.stop()
+
+    sender = threading.Thread(target=send, name=f'{name}-sender', daemon=True)
+    sender.start()
+    add(items)
+    scheduler.every(METRICS_SYNC_SECONDS, lambda: records.put(('m', metrics.export())), name='metrics sync')
+    threading.Thread(target=receive, name=f'{name}-receiver', daemon=True).start()
+    # sleeps until the next poll is due
+    scheduler.run()
+
+    for w in watchers.values():
+        try:
+            w.stop()
+        except Exception as err:
+            utils.log(err, how='exception', watched_path=w.path)
+    records.put(('m', metrics.export()))
+    records.put(('x',))
+    sender.join()
+    conn.close()